@@ -165,3 +165,88 @@ def calculate_convenience_score(history_data, current_price):
     S_final = max(0, min(R * S_base, 10))
     
     return round(S_final, 1)
+
+def convenience_score_from_daily(days, daily_prices, current_price, t0=None):
+    """
+    NumPy version of calculate_convenience_score for the batch scoring engine.
+    Same algorithm and parameters, but it takes the already resampled daily
+    minimums instead of raw readings, and skips pandas entirely.
+
+    params:
+    - days: array of datetime64[D], ascending, one entry per day with readings
+    - daily_prices: array of floats, minimum price for each day
+    - current_price: Float, current price p0
+    - t0: datetime used as "now" (pass the same value for a whole batch)
+    """
+    if t0 is None:
+        t0 = datetime.utcnow()
+    daily = np.asarray(daily_prices, dtype=float)
+    if daily.size == 0:
+        return 0.0
+    dates = np.asarray(days, dtype='datetime64[D]').astype('datetime64[us]')
+    now = np.datetime64(t0, 'us')
+
+    # 1) Remove outliers (robust) - Simple IQR method over the full daily series
+    Q1, Q3 = np.quantile(daily, [0.25, 0.75])
+    IQR = Q3 - Q1
+    keep = (daily >= Q1 - 1.5 * IQR) & (daily <= Q3 + 1.5 * IQR)
+    if keep.any():
+        daily = daily[keep]
+        dates = dates[keep]
+
+    # 2) Select last N=365 days
+    recent = dates >= now - np.timedelta64(365, 'D')
+    series = daily[recent]
+    dates = dates[recent]
+    if series.size == 0:
+        return 0.0
+
+    W_days = 60
+    tau = 90
+    d_max = 0.25
+    v0 = 0.03
+
+    # 3) Weights w_i = exp(-(t0 - t_i)/tau), age in whole days
+    days_diff = (now - dates) // np.timedelta64(1, 'D')
+    weights = np.exp(-days_diff / tau)
+
+    # A) Weighted percentile q
+    total_weights = weights.sum()
+    q = weights[series <= current_price].sum() / total_weights if total_weights != 0 else 1.0
+    S_A = 10 * (1 - q)
+
+    # B) Baseline: EMA with span=90 (pandas ewm(adjust=True) closed form)
+    decay = 1 - 2 / (90 + 1)
+    scale = decay ** -np.arange(series.size)
+    ema = np.cumsum(series * scale) / np.cumsum(scale)
+    B0 = ema[-1]
+    if B0 == 0: B0 = 1.0 # Avoid div/0
+
+    d = (B0 - current_price) / B0
+    S_B = 10 * max(0, min(d / d_max, 1))
+
+    # C) Range analysis last W=60 days
+    in_window = dates >= now - np.timedelta64(W_days, 'D')
+    last_W_series = series[in_window]
+
+    if last_W_series.size == 0:
+        S_C = 5.0
+        R = 1.0
+    else:
+        mW = last_W_series.min()
+        MW = last_W_series.max()
+        r = 0.5 if MW == mW else (MW - current_price) / (MW - mW)
+        S_C = 10 * r
+
+        # R) Volatility v = MAD(p - B) / median(p) over last W
+        mad = np.median(np.abs(last_W_series - ema[in_window]))
+        med_p = np.median(last_W_series)
+        v = 0 if med_p == 0 else mad / med_p
+
+        coverage_factor = 1.0 if last_W_series.size > 5 else 0.5
+        R = np.exp(-v / v0) * coverage_factor
+
+    S_base = 0.45 * S_A + 0.35 * S_B + 0.20 * S_C
+    S_final = max(0, min(R * S_base, 10))
+
+    return round(float(S_final), 1)
@@ -0,0 +1,193 @@
+import asyncio
+import os
+import time
+
+import httpx
+
+from page_archive import archive_page
+from metrics import FETCH_SECONDS, FETCH_RESPONSES, PAGE_ITEMS
+from pacing import pacer, THROTTLE_STATUSES, PACING_MAX_THROTTLE_RETRIES
+from scraper import (
+    HEADERS, BlockingError, category_url, get_proxy_url, listing_html, parse_product_list,
+)
+
+# Max requests in flight at once (all categories together)
+SCRAPER_CONCURRENCY = int(os.getenv("SCRAPER_CONCURRENCY", 2))
+
+class HostTokenBucket:
+    """
+    Shared request budget for one host.
+    Tokens arrive one at a time, each after an interval drawn from `interval()`
+    (the adaptive pacer's delay, the same the sequential scraper sleeps between
+    pages), up to `burst` saved tokens. With burst=1 the host sees exactly the
+    sequential request rate, whatever the number of category streams sharing
+    the bucket.
+    """
+
+    def __init__(self, interval, burst=1):
+        self.interval = interval
+        self.burst = burst
+        self._tokens = burst # Start full: the first request goes out immediately
+        self._next_refill = float("inf") # Refill clock only runs while the bucket isn't full
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            while True:
+                now = loop.time()
+                while self._tokens < self.burst and self._next_refill <= now:
+                    self._tokens += 1
+                    self._next_refill += self.interval()
+                if self._tokens >= 1:
+                    if self._tokens >= self.burst:
+                        # Taking from a full bucket starts the refill clock
+                        self._next_refill = now + self.interval()
+                    self._tokens -= 1
+                    return
+                wait = self._next_refill - now
+                print(f"Rate budget: next request in {wait:.2f} seconds...", flush=True)
+                await asyncio.sleep(wait)
+
+async def crawl_category(client, bucket, semaphore, write_lock, category_index, url_suffix, start_page, save_callback, progress, pipeline=None):
+    """One category stream: same paging and stop rules as scraper.scrape_category_page"""
+    full_base_url = category_url(url_suffix)
+    page = start_page
+    last_page_count = None
+    throttled = 0
+
+    while True:
+        progress[category_index] = page
+        await bucket.acquire()
+        params = {'isAjax': 1, 'p': page}
+        print(f"[async] Scraping page {page}: {full_base_url} with params {params}...", flush=True)
+
+        try:
+            async with semaphore:
+                fetch_started = time.perf_counter()
+                try:
+                    response = await client.get(full_base_url, params=params)
+                except httpx.HTTPError:
+                    FETCH_RESPONSES.inc(mode="async", status="error")
+                    raise
+                fetch_seconds = time.perf_counter() - fetch_started
+                if pipeline:
+                    pipeline.record_fetch(fetch_seconds)
+                FETCH_SECONDS.observe(fetch_seconds, mode="async")
+                FETCH_RESPONSES.inc(mode="async", status=response.status_code)
+
+            if response.status_code == 404:
+                print(f"[async] {url_suffix} page {page} returned 404. Stopping.", flush=True)
+                break
+            if response.status_code == 403:
+                print(f"CRITICAL ERROR: {url_suffix} page {page} returned 403 Forbidden. The scraper is BLOCKED by the website.", flush=True)
+                pacer.record_block(403)
+                raise BlockingError("Scraper blocked by website (403 Forbidden)", page_number=page)
+            if response.status_code in THROTTLE_STATUSES:
+                # The pacer slows the shared bucket down; retry the same page on the next token
+                throttled += 1
+                if throttled > PACING_MAX_THROTTLE_RETRIES:
+                    pacer.record_block(response.status_code)
+                    raise BlockingError(f"Scraper throttled by website ({response.status_code})", page_number=page,
+                                        status_code=response.status_code)
+                pacer.record_throttle(response.status_code)
+                print(f"[async] {url_suffix} page {page} returned {response.status_code}. Retrying.", flush=True)
+                await asyncio.to_thread(pacer.save)
+                continue
+            throttled = 0
+            response.raise_for_status()
+
+            # Parsing and DB writes are blocking, keep them off the event loop
+            html_content, is_json = listing_html(response, page)
+            pacer.record_page(fetch_seconds, is_json)
+            await asyncio.to_thread(pacer.save)
+            await asyncio.to_thread(archive_page, url_suffix, page, html_content)
+            if pipeline:
+                # Waits in a thread only while the parse queue is full; the other
+                # categories keep fetching while this page parses in the pool
+                parsed = await asyncio.to_thread(pipeline.submit_parse, html_content)
+                page_products = await asyncio.wrap_future(parsed)
+            else:
+                page_products = await asyncio.to_thread(parse_product_list, html_content)
+            PAGE_ITEMS.observe(len(page_products))
+
+            if not page_products:
+                print(f"[async] No valid products parsed on {url_suffix} page {page}. Stopping.", flush=True)
+                break
+
+            # Count Stop Strategy (see scrape_category_page)
+            current_count = len(page_products)
+            if last_page_count is not None and current_count != last_page_count:
+                print(f"[async] {url_suffix} page {page} has different product count ({current_count}) than previous ({last_page_count}). Considering it the last page. Stopping.", flush=True)
+                break
+            last_page_count = current_count
+
+            if save_callback and pipeline:
+                # The pipeline's writer thread serializes the writes
+                await asyncio.to_thread(pipeline.write, save_callback, page_products, f" from {url_suffix} page {page}")
+            elif save_callback:
+                try:
+                    # One page write at a time: SQLite has a single writer anyway
+                    async with write_lock:
+                        await asyncio.to_thread(save_callback, page_products)
+                    print(f"[async] Saved {len(page_products)} products from {url_suffix} page {page} to DB.", flush=True)
+                except Exception as e:
+                    print(f"Error saving {url_suffix} page {page} to DB: {e}", flush=True)
+
+            page += 1
+
+        except BlockingError as e:
+            e.category_index = category_index
+            raise
+        except Exception as e:
+            print(f"Error fetching URL {full_base_url} (page {page}): {e}", flush=True)
+            break
+
+    # Category finished, nothing to resume
+    progress.pop(category_index, None)
+
+async def crawl_categories_async(categories, start_pages, save_callback_for, pipeline=None):
+    """
+    Crawl several categories concurrently under one shared per-host budget.
+
+    params:
+    - categories: list of category url suffixes
+    - start_pages: {category_index: first page} for the categories still to crawl
+    - save_callback_for: category suffix -> callback(page_products)
+    - pipeline: optional pipeline.ScrapePipeline for the parse and write stages
+
+    On a 403 every stream stops and a BlockingError is raised with
+    page_number/category_index of the blocked stream and `resume_pages`
+    ({category_index: page}) for every unfinished stream.
+    """
+    bucket = HostTokenBucket(pacer.next_delay)
+    semaphore = asyncio.Semaphore(SCRAPER_CONCURRENCY)
+    write_lock = asyncio.Lock()
+    progress = dict(start_pages)
+
+    proxy_url = get_proxy_url("async crawler")
+    async with httpx.AsyncClient(
+        headers=HEADERS,
+        proxy=proxy_url,
+        timeout=30,
+        follow_redirects=True,
+        limits=httpx.Limits(max_connections=SCRAPER_CONCURRENCY, max_keepalive_connections=SCRAPER_CONCURRENCY),
+    ) as client:
+        tasks = [
+            asyncio.create_task(crawl_category(
+                client, bucket, semaphore, write_lock, i, categories[i], page, save_callback_for(categories[i]), progress, pipeline
+            ))
+            for i, page in sorted(start_pages.items())
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        except BlockingError as e:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            e.resume_pages = dict(progress)
+            raise
+
+def crawl_categories(categories, start_pages, save_callback_for, pipeline=None):
+    """Blocking entry point for the scraper thread"""
+    asyncio.run(crawl_categories_async(categories, start_pages, save_callback_for, pipeline))
@@ -0,0 +1,128 @@
+"""
+Compare the batched page upsert (main.save_products_to_db) with the original
+per-item path (lookups, commit and history insert one product at a time).
+
+Both start from copies of the same synthetic catalog and save the same pages.
+
+Usage (from backend/):
+    python -m benchmarks.bench_ingest --products 2000 --pages 30
+"""
+import argparse
+import contextlib
+import copy
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from sqlmodel import Session, select
+
+def legacy_save(engine, products_data):
+    """save_products_to_db before batching: per item lookups (full scan for the slug), two commits each"""
+    from models import Product, PriceHistory
+
+    with Session(engine) as session:
+        for p_data in products_data:
+            try:
+                existing_product = session.exec(select(Product).where(Product.bernabei_code == p_data["bernabei_code"])).first()
+                if not existing_product:
+                    current_link = p_data.get("product_link", "")
+                    current_slug = current_link.split('?')[0].strip('/').split('/')[-1] if current_link else None
+                    if current_slug:
+                        for p in session.exec(select(Product)).all():
+                            if p.product_link and p.product_link.split('?')[0].strip('/').split('/')[-1] == current_slug:
+                                existing_product = p
+                                break
+                if not existing_product and p_data.get("name"):
+                    existing_product = session.exec(select(Product).where(Product.name == p_data.get("name"))).first()
+
+                if not existing_product:
+                    existing_product = Product(
+                        bernabei_code=p_data.get("bernabei_code"), name=p_data.get("name"),
+                        product_link=p_data.get("product_link"), image_url=p_data.get("image_url"),
+                        category=p_data.get("category", ""), current_price=p_data.get("price") or 0.0,
+                        last_checked_at=datetime.utcnow(),
+                    )
+                else:
+                    existing_product.last_checked_at = datetime.utcnow()
+                    if p_data.get("image_url"): existing_product.image_url = p_data.get("image_url")
+                    if p_data.get("price") is not None: existing_product.current_price = p_data.get("price")
+                    if p_data.get("product_link"): existing_product.product_link = p_data.get("product_link")
+                session.add(existing_product)
+                session.commit()
+                session.refresh(existing_product)
+
+                session.exec(
+                    select(PriceHistory).where(PriceHistory.product_id == existing_product.id).order_by(PriceHistory.timestamp.desc())
+                ).first()
+                session.add(PriceHistory(
+                    product_id=existing_product.id, price=p_data.get("price") or 0.0,
+                    ordinary_price=p_data.get("ordinary_price"), lowest_price_30_days=p_data.get("lowest_price_30_days"),
+                    tags=p_data.get("tags"), timestamp=datetime.utcnow(),
+                ))
+                session.commit()
+            except Exception as e:
+                print(f"Error saving product {p_data.get('name')}: {e}", flush=True)
+
+def counts(engine):
+    with engine.connect() as conn:
+        return tuple(conn.exec_driver_sql(f"SELECT COUNT(*) FROM {table}").scalar() for table in ("product", "pricehistory"))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=2000)
+    parser.add_argument("--readings", type=int, default=20, help="readings per product in the starting catalog")
+    parser.add_argument("--pages", type=int, default=30)
+    parser.add_argument("--page-size", type=int, default=48)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # main.py opens DB_PATH at import: point it at the batched copy first
+        os.environ["DB_PATH"] = os.path.join(tmp, "batched.db")
+        os.environ["PAGE_ARCHIVE_DIR"] = ""
+        # One row per reading, like the per-item path
+        os.environ["HISTORY_STORAGE"] = "full"
+        from database import create_sqlite_engine
+        from benchmarks.datagen import CatalogGenerator
+
+        generator = CatalogGenerator(args.products, args.readings)
+        template = os.path.join(tmp, "template.db")
+        engine = create_sqlite_engine(template)
+        with contextlib.redirect_stdout(io.StringIO()):
+            generator.build(engine)
+        engine.dispose()
+        shutil.copyfile(template, os.environ["DB_PATH"])
+        shutil.copyfile(template, os.path.join(tmp, "legacy.db"))
+        pages = list(generator.scraped_pages(args.pages, args.page_size))
+
+        from main import save_products_to_db, engine as batched_engine
+        legacy_engine = create_sqlite_engine(os.path.join(tmp, "legacy.db"))
+        before = counts(legacy_engine)
+
+        start = time.perf_counter()
+        for page in copy.deepcopy(pages):
+            legacy_save(legacy_engine, page)
+        legacy_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for page in copy.deepcopy(pages):
+            save_products_to_db(page)
+        batched_time = time.perf_counter() - start
+
+        legacy_counts, batched_counts = counts(legacy_engine), counts(batched_engine)
+        legacy_engine.dispose()
+        batched_engine.dispose()
+
+    items = args.pages * args.page_size
+    print(f"catalog: {before[0]} products, {before[1]} readings; saved {args.pages} pages of {args.page_size}")
+    print(f"per-item path:  {legacy_time:8.3f}s  ({items / legacy_time:8.1f} items/s)")
+    print(f"batched upsert: {batched_time:8.3f}s  ({items / batched_time:8.1f} items/s, {legacy_time / batched_time:.1f}x)")
+    if batched_counts[1] - before[1] != items or legacy_counts[1] - before[1] != items:
+        print(f"FAIL: expected {items} new readings, got {batched_counts[1] - before[1]} (batched), {legacy_counts[1] - before[1]} (per-item)")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Check that every listing parser backend extracts exactly the same product
+dicts from the fixture corpus, then report items/second for each backend.
+
+The corpus is benchmarks/fixtures/*.html, plus the pages of a page archive
+(see page_archive.py) with --archive, which is the best check against real
+listing pages.
+
+Usage (from backend/):
+    python -m benchmarks.bench_parsers --repeat 20
+    python -m benchmarks.bench_parsers --archive /app/data/page_archive --limit 500
+"""
+import argparse
+import contextlib
+import glob
+import io
+import os
+import sys
+import time
+
+from listing_parsers import PARSERS, LexborHTMLParser
+from page_archive import PageArchive
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+
+def load_corpus(archive_dir=None, limit=None):
+    corpus = []
+    for path in sorted(glob.glob(os.path.join(FIXTURES_DIR, "*.html"))):
+        with open(path, encoding="utf-8") as f:
+            corpus.append((os.path.basename(path), f.read()))
+    if archive_dir:
+        page_archive = PageArchive(archive_dir)
+        digests = list(dict.fromkeys(e["sha256"] for e in page_archive.entries()))
+        for digest in digests[:limit]:
+            corpus.append((f"archive:{digest[:12]}", page_archive.get(digest)))
+    return corpus
+
+def comparable(products):
+    # The reading timestamp is the parse time, not part of the extraction
+    return [{k: v for k, v in p.items() if k != "timestamp"} for p in products]
+
+def parse_quietly(parser, html_content):
+    # Backends log skipped items; keep the report readable
+    with contextlib.redirect_stdout(io.StringIO()):
+        return parser.parse(html_content)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=20, help="passes over the corpus per backend")
+    parser.add_argument("--archive", help="also use the pages of this page archive directory")
+    parser.add_argument("--limit", type=int, help="max archive pages")
+    args = parser.parse_args()
+
+    backends = {name: cls() for name, cls in PARSERS.items()}
+    if LexborHTMLParser is None:
+        print("selectolax is not installed, only benchmarking the soup backend")
+        del backends["selectolax"]
+
+    corpus = load_corpus(args.archive, args.limit)
+    print(f"corpus: {len(corpus)} pages")
+
+    # 1. Parity against the reference backend
+    reference = backends["soup"]
+    mismatches = 0
+    items_per_pass = 0
+    for label, html_content in corpus:
+        expected = comparable(parse_quietly(reference, html_content))
+        items_per_pass += len(expected)
+        for name, backend in backends.items():
+            if backend is reference:
+                continue
+            actual = comparable(parse_quietly(backend, html_content))
+            if actual != expected:
+                mismatches += 1
+                print(f"MISMATCH {name} on {label}: {len(actual)} vs {len(expected)} products")
+                for a, e in zip(actual, expected):
+                    if a != e:
+                        print(f"  {name}: {a}\n  soup: {e}")
+                        break
+
+    # 2. Throughput
+    results = {}
+    for name, backend in backends.items():
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            for _, html_content in corpus:
+                parse_quietly(backend, html_content)
+        elapsed = time.perf_counter() - start
+        results[name] = items_per_pass * args.repeat / elapsed
+
+    print(f"items per pass: {items_per_pass}, passes: {args.repeat}")
+    for name, rate in results.items():
+        print(f"{name:<12} {rate:10.0f} items/s  ({rate / results['soup']:.1f}x)")
+
+    if mismatches:
+        print(f"FAIL: {mismatches} page(s) parsed differently from the soup backend")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
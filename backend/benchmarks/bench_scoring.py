@@ -0,0 +1,106 @@
+"""
+Compare the batch scoring engine (scoring.score_catalog) with the original
+per-product path (one history query + calculate_convenience_score each).
+
+Usage (from backend/):
+    python -m benchmarks.bench_scoring --products 500 --days 400
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert
+from sqlmodel import SQLModel, Session, create_engine, select
+
+from analytics import calculate_convenience_score
+from migrations import run_migrations
+from models import Product, PriceHistory
+from scoring import score_catalog
+
+def build_db(path, n_products, n_days, readings_per_day, seed=42):
+    rng = random.Random(seed)
+    engine = create_engine(f"sqlite:///{path}")
+    SQLModel.metadata.create_all(engine)
+    run_migrations(engine)
+    now = datetime.utcnow()
+
+    with Session(engine) as session:
+        for i in range(n_products):
+            base = rng.uniform(5, 80)
+            price = base
+            history = []
+            for d in range(n_days, 0, -1):
+                if rng.random() < 0.15:  # days without a reading
+                    continue
+                for r in range(readings_per_day):
+                    # Random walk with occasional promos and outliers
+                    price = max(1.0, price + rng.gauss(0, base * 0.02))
+                    shown = price * (0.7 if rng.random() < 0.05 else 1.0)
+                    if rng.random() < 0.01:
+                        shown = shown * 3
+                    history.append({
+                        "price": round(shown, 2),
+                        "timestamp": now - timedelta(days=d, hours=r * 24 / readings_per_day, minutes=rng.randint(0, 59)),
+                    })
+            product = Product(
+                bernabei_code=f"bench-{i}", name=f"Bench Wine {i}",
+                product_link=f"https://www.bernabei.it/bench-{i}", slug=f"bench-{i}",
+                current_price=round(price, 2), last_checked_at=now,
+            )
+            session.add(product)
+            session.flush()
+            for h in history:
+                h["product_id"] = product.id
+            session.execute(insert(PriceHistory), history)
+        session.commit()
+    return engine
+
+def legacy_scores(engine):
+    scores = {}
+    with Session(engine) as session:
+        for p in session.exec(select(Product)).all():
+            history = session.exec(select(PriceHistory).where(PriceHistory.product_id == p.id)).all()
+            if not history or not p.current_price:
+                continue
+            history_data = [{"timestamp": h.timestamp, "price": h.price} for h in history]
+            scores[p.id] = calculate_convenience_score(history_data, p.current_price)
+    return scores
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=300)
+    parser.add_argument("--days", type=int, default=400)
+    parser.add_argument("--readings-per-day", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = build_db(os.path.join(tmp, "bench.db"), args.products, args.days, args.readings_per_day)
+        t0 = datetime.utcnow()
+
+        start = time.perf_counter()
+        expected = legacy_scores(engine)
+        legacy_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        score_catalog(engine, t0=t0)
+        batch_time = time.perf_counter() - start
+
+        with Session(engine) as session:
+            actual = dict(session.exec(select(Product.id, Product.convenience_score)).all())
+        engine.dispose()
+
+    max_diff = max((abs(expected[k] - (actual.get(k) or 0.0)) for k in expected), default=0.0)
+    print(f"products: {args.products}, days: {args.days}, readings/day: {args.readings_per_day}")
+    print(f"per-product pandas path: {legacy_time:8.3f}s")
+    print(f"batch engine:            {batch_time:8.3f}s  ({legacy_time / batch_time:.1f}x)")
+    print(f"max score difference:    {max_diff:.3f}")
+    if max_diff > 0.1:
+        print("FAIL: batch scores differ from calculate_convenience_score by more than 0.1")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
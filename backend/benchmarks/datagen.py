@@ -0,0 +1,184 @@
+"""
+Deterministic synthetic catalog for the benchmarks.
+
+Same seed, same database: products with realistic slugs, a share of gen_
+hash codes (items whose ID couldn't be extracted), legacy duplicate variants
+of existing products (same link, different code, no slug, the rows
+consolidate_db.py merges), and M readings per product following a random
+walk with configurable volatility, promos and unreadable 0.0 prices.
+"""
+import hashlib
+import random
+import re
+from datetime import datetime, timedelta
+
+from sqlmodel import SQLModel, Session
+
+from migrations import run_migrations
+from product_stats import rebuild_product_stats
+from tags import backfill_tags
+from changes import backfill_change_seqs
+
+PRODUCERS = [
+    "Marchesi Antinori", "Gaja", "Tenuta San Guido", "Feudi di San Gregorio", "Ca' del Bosco", "Planeta",
+    "Masciarelli", "Donnafugata", "Cantina Tramin", "Bellavista", "Castello Banfi", "Allegrini",
+    "Moet & Chandon", "Veuve Clicquot", "Bollinger", "Ruinart", "Louis Roederer", "Taittinger",
+]
+WINES = [
+    "Barolo DOCG", "Chianti Classico Riserva", "Brunello di Montalcino", "Amarone della Valpolicella",
+    "Franciacorta Brut", "Vermentino di Gallura", "Primitivo di Manduria", "Montepulciano d'Abruzzo",
+    "Nero d'Avola", "Greco di Tufo", "Lugana", "Etna Rosso", "Sagrantino di Montefalco", "Bolgheri Rosso",
+    "Champagne Brut", "Champagne Rose", "Blanc de Blancs", "Prosecco Superiore",
+]
+SIZES = ["75 cl", "75 cl", "75 cl", "150 cl", "37,5 cl"]
+CATEGORIES = ["/vino-online/", "/champagne/"]
+TAGS = ["BEST PRICE", "POPULAR", "-20%", "-30%", "BIO", "Novità", "Special Price"]
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+def slugify(text):
+    return re.sub(r"[^a-z0-9]+", "-", text.lower()).strip("-")
+
+class CatalogGenerator:
+    """
+    params:
+    - products: number of distinct products
+    - readings: raw readings per product, spread over `days` days up to `now`
+    - volatility: daily relative standard deviation of the price random walk
+    - gen_ratio: share of products with a gen_ hash code and no link
+    - duplicate_ratio: share of products with a legacy duplicate row
+    """
+
+    def __init__(self, products=1000, readings=100, days=180, volatility=0.02,
+                 gen_ratio=0.02, duplicate_ratio=0.03, seed=42, now=None):
+        self.n_products = products
+        self.readings = readings
+        self.days = days
+        self.volatility = volatility
+        self.gen_ratio = gen_ratio
+        self.duplicate_ratio = duplicate_ratio
+        self.seed = seed
+        self.now = now or datetime(2025, 1, 1)
+        self.rng = random.Random(seed)
+        self.products = self._products()
+
+    def _products(self):
+        rng = self.rng
+        products = []
+        for i in range(self.n_products):
+            vintage = rng.choice(range(2010, 2023))
+            name = f"{rng.choice(PRODUCERS)} {rng.choice(WINES)} {vintage} {rng.choice(SIZES)}"
+            category = CATEGORIES[0] if rng.random() < 0.8 else CATEGORIES[1]
+            if rng.random() < self.gen_ratio:
+                # Name-hash ID, as built by listing_parsers when nothing else is found
+                name = f"{name} #{i}"
+                code = f"gen_{hashlib.md5(name.lower().encode()).hexdigest()[:10]}"
+                link, slug = "", None
+            else:
+                slug = f"{slugify(name)}-{i}"
+                code = slug
+                link = f"https://www.bernabei.it{category}{slug}"
+            products.append({
+                "bernabei_code": code, "name": name, "product_link": link, "slug": slug,
+                "image_url": f"https://www.bernabei.it/media/catalog/product/{i}.jpg" if link else None,
+                "category": category, "base_price": round(rng.lognormvariate(3.2, 0.7), 2),
+                "duplicate": bool(link) and rng.random() < self.duplicate_ratio,
+            })
+        return products
+
+    def _walk(self, rng, base_price, n):
+        """n (price, tags) readings of one product"""
+        price = base_price
+        out = []
+        for _ in range(n):
+            price = max(1.0, price * (1 + rng.gauss(0, self.volatility)))
+            shown = price
+            tags = []
+            if rng.random() < 0.08:
+                shown = price * rng.choice([0.7, 0.8, 0.85])
+                tags.append(rng.choice(TAGS[2:4]))
+            if rng.random() < 0.003:
+                shown = 0.0  # unreadable price
+            if rng.random() < 0.2:
+                tags.append(rng.choice(TAGS))
+            out.append((round(shown, 2), ",".join(tags)))
+        return out
+
+    def _timestamps(self, rng, n):
+        start = self.now - timedelta(days=self.days)
+        step = self.days * 86400 / max(n, 1)
+        return [start + timedelta(seconds=step * k + rng.uniform(0, step * 0.5)) for k in range(n)]
+
+    def build(self, engine):
+        """Create the schema (tables + migrations) and fill it. Returns row counts."""
+        SQLModel.metadata.create_all(engine)
+        run_migrations(engine)
+        rng = random.Random(self.seed + 1)
+        product_rows = []
+        for p in self.products:
+            product_rows.append((p["bernabei_code"], p["name"], p["product_link"], p["slug"], p["image_url"], p["category"]))
+            if p["duplicate"]:
+                # Legacy row for the same link: numeric code, no slug (lost the backfill)
+                product_rows.append((str(100000 + len(product_rows)), p["name"], p["product_link"], None, None, p["category"]))
+
+        readings = 0
+        with engine.begin() as conn:
+            conn.exec_driver_sql(
+                "INSERT INTO product (bernabei_code, name, product_link, slug, image_url, category) VALUES (?, ?, ?, ?, ?, ?)",
+                product_rows,
+            )
+            ids = [row[0] for row in conn.exec_driver_sql("SELECT id FROM product ORDER BY id").fetchall()]
+            bases = {}
+            k = 0
+            for p in self.products:
+                bases[ids[k]] = p["base_price"]
+                k += 1
+                if p["duplicate"]:
+                    bases[ids[k]] = p["base_price"]
+                    k += 1
+
+            last = []
+            for product_id, base_price in bases.items():
+                stamps = self._timestamps(rng, self.readings)
+                walk = self._walk(rng, base_price, self.readings)
+                conn.exec_driver_sql(
+                    "INSERT INTO pricehistory (product_id, price, ordinary_price, lowest_price_30_days, tags, timestamp) VALUES (?, ?, ?, ?, ?, ?)",
+                    [(product_id, price, round(base_price * 1.2, 2), None, tags, ts.strftime(TIMESTAMP_FORMAT))
+                     for (price, tags), ts in zip(walk, stamps)],
+                )
+                readings += len(walk)
+                last.append((walk[-1][0], stamps[-1].strftime(TIMESTAMP_FORMAT), product_id))
+            conn.exec_driver_sql("UPDATE product SET current_price = ?, last_checked_at = ? WHERE id = ?", last)
+
+        with Session(engine) as session:
+            # Tag strings into the dictionary, as migrated databases have them
+            backfill_tags(session)
+            backfill_change_seqs(session)
+            rebuild_product_stats(session)
+            session.commit()
+        return {"products": len(product_rows), "readings": readings}
+
+    def scraped_pages(self, pages, page_size=48, new_ratio=0.1):
+        """
+        Listing pages as the scraper hands them to save_products_to_db: mostly
+        known products with a new price, plus a share of new ones.
+        """
+        rng = random.Random(self.seed + 2)
+        for n in range(pages):
+            page = []
+            for j in range(page_size):
+                if rng.random() < new_ratio:
+                    name = f"{rng.choice(PRODUCERS)} {rng.choice(WINES)} Nuovo {n}-{j}"
+                    slug = f"{slugify(name)}-new"
+                    p = {"bernabei_code": slug, "name": name, "product_link": f"https://www.bernabei.it/vino-online/{slug}",
+                         "category": "/vino-online/", "base_price": 20.0}
+                else:
+                    p = rng.choice(self.products)
+                price = round(p["base_price"] * (1 + rng.gauss(0, self.volatility * 3)), 2)
+                page.append({
+                    "bernabei_code": p["bernabei_code"], "name": p["name"], "product_link": p["product_link"],
+                    "image_url": None, "price": price, "ordinary_price": round(p["base_price"] * 1.2, 2),
+                    "lowest_price_30_days": None, "tags": rng.choice(TAGS) if rng.random() < 0.3 else "",
+                    "category": p["category"],
+                })
+            yield page
@@ -0,0 +1,226 @@
+"""
+Benchmark the database hot paths on a synthetic catalog (benchmarks/datagen.py):
+
+    ingest       save_products_to_db, one listing page (48 items) per op
+    query        GET /products variants and the history endpoint, response cache bypassed
+    scoring      update_all_scores over the whole catalog (one op)
+    consolidate  consolidate_duplicates (one op)
+
+The catalog is generated once into a temporary SQLite file. Each stage runs in
+its own Python process on a fresh copy of it (the modules bind their engines to
+DB_PATH at import), so stages don't see each other's writes and peak RSS is
+per stage. Reports ops/s, items/s, p50/p95 latency and peak RSS, and writes
+them as JSON to --out; --compare prints the ratios against a previous file.
+
+Usage (from backend/):
+    python -m benchmarks.suite --products 5000 --readings 200 --out bench.json
+    python -m benchmarks.suite --stages ingest,query --compare bench.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+STAGES = ["ingest", "query", "scoring", "consolidate"]
+
+# (label, path) of the GET requests of the query stage, {id} is a product id
+QUERY_REQUESTS = [
+    ("products_all", "/products"),
+    ("products_page_score", "/products?limit=50"),
+    ("products_page_price", "/products?limit=50&sort=price&order=asc"),
+    ("products_category", "/products?category=/vino-online/&limit=50"),
+    ("products_discount", "/products?min_discount=10&limit=50"),
+    ("products_search", "/products?q=barolo&limit=50"),
+    ("products_tag", "/products?tag=BIO&limit=50"),
+    ("products_fulltext", "/products/search?q=brunello riserva 20&limit=20"),
+    ("history_raw", "/products/{id}/history"),
+    ("history_daily", "/products/{id}/history?resolution=daily"),
+    ("history_chart", "/history?ids={id}&points=300"),
+]
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, round(pct / 100 * (len(ordered) - 1)))]
+
+def summarize(latencies, items_per_op=1):
+    total = sum(latencies)
+    return {
+        "ops": len(latencies),
+        "ops_per_s": round(len(latencies) / total, 2) if total else None,
+        "items_per_s": round(len(latencies) * items_per_op / total, 1) if total else None,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "total_s": round(total, 3),
+    }
+
+def timed(func, *args):
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        func(*args)
+    return time.perf_counter() - start
+
+def peak_rss_mb():
+    # ru_maxrss is in KiB on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+# --- stages, run in the child process -------------------------------------------------
+
+def stage_ingest(args, generator):
+    from main import save_products_to_db
+
+    latencies = [timed(save_products_to_db, page) for page in generator.scraped_pages(args.pages, args.page_size)]
+    return {"ingest": summarize(latencies, args.page_size)}
+
+def stage_query(args, generator):
+    from fastapi.testclient import TestClient
+    from main import app
+    from response_cache import cache
+
+    client = TestClient(app)
+    product_ids = [row["id"] for row in client.get("/products?limit=500").json()]
+    results = {}
+    for label, path in QUERY_REQUESTS:
+        latencies = []
+        for i in range(args.queries):
+            cache.clear()  # measure the handler, not the response cache
+            url = path.format(id=product_ids[i % len(product_ids)])
+            start = time.perf_counter()
+            response = client.get(url)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                raise RuntimeError(f"GET {url} returned {response.status_code}")
+        results[f"query_{label}"] = summarize(latencies)
+    return results
+
+def stage_scoring(args, generator):
+    from main import update_all_scores
+
+    return {"scoring": summarize([timed(update_all_scores)], generator.n_products)}
+
+def stage_consolidate(args, generator):
+    from consolidate_db import consolidate_duplicates
+
+    return {"consolidate": summarize([timed(consolidate_duplicates)], generator.n_products)}
+
+def run_stage(args):
+    from benchmarks.datagen import CatalogGenerator
+
+    generator = CatalogGenerator(args.products, args.readings, volatility=args.volatility, seed=args.seed)
+    results = globals()[f"stage_{args.stage}"](args, generator)
+    for metrics in results.values():
+        metrics["peak_rss_mb"] = peak_rss_mb()
+    json.dump(results, sys.stdout)
+
+# --- driver ---------------------------------------------------------------------------
+
+def generate(args, path):
+    from database import create_sqlite_engine
+    from benchmarks.datagen import CatalogGenerator
+
+    engine = create_sqlite_engine(path)
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        counts = CatalogGenerator(args.products, args.readings, volatility=args.volatility, seed=args.seed).build(engine)
+    engine.dispose()
+    print(f"generated {counts['products']} products, {counts['readings']} readings in {time.perf_counter() - start:.1f}s")
+    return counts
+
+def run_in_child(args, stage, template, workdir):
+    path = os.path.join(workdir, f"{stage}.db")
+    shutil.copyfile(template, path)
+    command = [
+        sys.executable, "-m", "benchmarks.suite", "--stage", stage,
+        "--products", str(args.products), "--readings", str(args.readings),
+        "--volatility", str(args.volatility), "--seed", str(args.seed),
+        "--pages", str(args.pages), "--page-size", str(args.page_size), "--queries", str(args.queries),
+    ]
+    env = dict(os.environ, DB_PATH=path, PAGE_ARCHIVE_DIR="")
+    proc = subprocess.run(command, env=env, capture_output=True, text=True)
+    if proc.returncode != 0:
+        print(proc.stderr, file=sys.stderr)
+        raise RuntimeError(f"stage {stage} failed")
+    return json.loads(proc.stdout)
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+def compare(results, baseline_path):
+    """Print the ratios against a previous run. Returns the benchmarks more than 20% slower at p50."""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)["results"]
+    regressions = []
+    print(f"\n{'benchmark':<28} {'p50 old':>10} {'p50 new':>10} {'ratio':>7}")
+    for name, metrics in results.items():
+        old = baseline.get(name)
+        if not old:
+            continue
+        ratio = metrics["p50_ms"] / old["p50_ms"] if old["p50_ms"] else float("inf")
+        print(f"{name:<28} {old['p50_ms']:>10.2f} {metrics['p50_ms']:>10.2f} {ratio:>6.2f}x")
+        if ratio > 1.2:
+            regressions.append(name)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=2000)
+    parser.add_argument("--readings", type=int, default=100, help="readings per product")
+    parser.add_argument("--volatility", type=float, default=0.02, help="relative std dev of each price step")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--pages", type=int, default=50, help="listing pages saved by the ingest stage")
+    parser.add_argument("--page-size", type=int, default=48)
+    parser.add_argument("--queries", type=int, default=30, help="requests per query variant")
+    parser.add_argument("--stages", default=",".join(STAGES), help="comma separated subset of " + ",".join(STAGES))
+    parser.add_argument("--out", help="write the results as JSON to this file")
+    parser.add_argument("--compare", help="JSON results of a previous run; exit 1 on a >20%% p50 regression")
+    parser.add_argument("--stage", choices=STAGES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.stage:
+        run_stage(args)
+        return
+
+    stages = [s for s in args.stages.split(",") if s]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f"unknown stage(s): {', '.join(sorted(unknown))}")
+
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        template = os.path.join(workdir, "catalog.db")
+        counts = generate(args, template)
+        for stage in stages:
+            results.update(run_in_child(args, stage, template, workdir))
+
+    print(f"\n{'benchmark':<28} {'ops':>5} {'ops/s':>10} {'items/s':>10} {'p50 ms':>10} {'p95 ms':>10} {'rss MB':>8}")
+    for name, m in results.items():
+        print(f"{name:<28} {m['ops']:>5} {m['ops_per_s']:>10} {m['items_per_s']:>10} "
+              f"{m['p50_ms']:>10.2f} {m['p95_ms']:>10.2f} {m['peak_rss_mb']:>8}")
+
+    if args.out:
+        params = {k: getattr(args, k) for k in ("products", "readings", "volatility", "seed", "pages", "page_size", "queries")}
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump({
+                "meta": {"commit": git_commit(), "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                         "python": sys.version.split()[0], "params": params, "rows": counts},
+                "results": results,
+            }, f, indent=2)
+        print(f"\nresults written to {args.out}")
+
+    if args.compare:
+        regressions = compare(results, args.compare)
+        if regressions:
+            print(f"FAIL: p50 regressed by more than 20% on {', '.join(regressions)}")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,15 @@
 import logging
-from sqlmodel import Session, select, create_engine
+from sqlmodel import Session, select
 from models import Product, PriceHistory
-from database import sqlite_file_name as DB_NAME
+from database import sqlite_file_name as DB_NAME, create_sqlite_engine
+from scraper import normalize_slug
+from product_stats import rebuild_product_stats
+from tags import rebuild_product_tags
+from history_store import merge_daily_rollups
+from changes import reserve_change_seqs, record_deletion
+from migrations import run_migrations
+from response_cache import bump_generation
+from datetime import datetime
 import os
 
 # Setup logging
@@ -16,32 +24,34 @@ if not os.path.exists(DB_NAME):
     elif os.path.exists(f"backend/{DB_NAME}"):
         DB_NAME = f"backend/{DB_NAME}"
 
-sqlite_url = f"sqlite:///{DB_NAME}"
-# Increase timeout to 60 seconds to avoid "database is locked" errors
-# if the scraper is running concurrently.
-connect_args = {"check_same_thread": False, "timeout": 60}
-engine = create_engine(sqlite_url, connect_args=connect_args)
+# Writer engine (WAL, busy_timeout, BEGIN IMMEDIATE): safe to run while the scraper is writing
+engine = create_sqlite_engine(DB_NAME)
 
 def consolidate_duplicates():
     logger.info("Starting database consolidation...")
     
     with Session(engine) as session:
-        # Get all products
-        products = session.exec(select(Product)).all()
-        logger.info(f"Found {len(products)} total products.")
+        # Products with a canonical slug are already unique (unique index on Product.slug).
+        # Only rows without one can be duplicates: legacy rows, or rows that lost
+        # a slug collision during the backfill.
+        orphans = session.exec(select(Product).where(Product.slug == None)).all()
+        logger.info(f"Found {len(orphans)} products without a canonical slug.")
         
         # Group by a "Key" that represents identity regardless of unstable ID
-        # Key = (Normalized Name, Normalized Link Slug)
+        # Key = canonical link slug, or normalized name for products without a link
         grouped = {}
         
-        for p in products:
-            # key based on link slug for stability
-            if p.product_link:
-                slug = p.product_link.split('?')[0].strip('/').split('/')[-1]
-                key = slug
+        for p in orphans:
+            slug = normalize_slug(p.product_link)
+            if slug:
+                key = ("slug", slug)
+                if key not in grouped:
+                    # Indexed lookup of the product that already owns this slug
+                    owner = session.exec(select(Product).where(Product.slug == slug)).first()
+                    grouped[key] = [owner] if owner else []
             else:
                 # fallback to name
-                key = p.name.strip().lower()
+                key = ("name", p.name.strip().lower())
             
             if key not in grouped:
                 grouped[key] = []
@@ -49,8 +59,9 @@ def consolidate_duplicates():
             
         duplicates_found = 0
         deleted_count = 0
+        slugs_assigned = 0
         
-        for key, group in grouped.items():
+        for (kind, key), group in grouped.items():
             if len(group) > 1:
                 duplicates_found += 1
                 logger.info(f"Found duplicate group for key '{key}': {len(group)} entries.")
@@ -89,19 +100,43 @@ def consolidate_duplicates():
                         # Refresh 'other' so it knows its children are gone
                         session.refresh(other)
 
-                    # Delete duplicate product
+                    # Compacted history follows the raw readings
+                    merge_daily_rollups(session, other.id, master.id)
+
+                    # Delete duplicate product; change feed clients learn where it went
+                    record_deletion(session, other.id, merged_into=master.id)
                     session.delete(other)
                     deleted_count += 1
+                
+                # Deletes must hit the DB before the slug moves to the master (unique index)
+                session.flush()
+                
+                # Master's aggregates now cover the merged history; drop the others'
+                rebuild_product_stats(session, [p.id for p in group])
+                rebuild_product_tags(session, [p.id for p in group])
+                if kind == "slug" and master.slug != key:
+                    master.slug = key
+                # Merged history: new aggregates for the master
+                master.change_seq = reserve_change_seqs(session, 1)
+                session.add(master)
                     
-                    # Commit per group to keep transaction size manageable and save progress
-                    session.commit()
+                # Commit per group to keep transaction size manageable and save progress
+                bump_generation(session)
+                session.commit()
+            elif kind == "slug" and group[0].slug is None:
+                # No duplicate, just give it its canonical slug
+                group[0].slug = key
+                group[0].change_seq = reserve_change_seqs(session, 1)
+                session.add(group[0])
+                slugs_assigned += 1
         
+        bump_generation(session)
         session.commit()
-        logger.info(f"Consolidation complete. Found {duplicates_found} duplicate groups. Deleted {deleted_count} duplicate products.")
+        logger.info(f"Consolidation complete. Found {duplicates_found} duplicate groups. Deleted {deleted_count} duplicate products. Assigned {slugs_assigned} missing slugs.")
 
 if __name__ == "__main__":
-    from datetime import datetime
     try:
+        run_migrations(engine)
         consolidate_duplicates()
     except Exception as e:
         logger.error(f"Error during consolidation: {e}")
@@ -0,0 +1,196 @@
+"""
+Durable crawl progress: a crawl_run row per scrape cycle and a
+crawl_checkpoint row per category, updated after every saved page.
+
+A run that didn't complete (blocked, failed, or the process died mid-crawl)
+is resumed by the next scrape job from each category's next_page, so a
+restart or deploy doesn't throw the cycle's progress away.
+"""
+import os
+from datetime import datetime, timedelta
+
+from sqlmodel import Session, select
+
+from models import CrawlRun, CrawlCheckpoint
+
+# Unfinished runs older than this are abandoned and a new cycle starts from page 1
+CRAWL_RESUME_MAX_AGE_HOURS = float(os.getenv("CRAWL_RESUME_MAX_AGE_HOURS", 48))
+
+UNFINISHED = ("running", "blocked", "failed")
+
+def _checkpoints(session, run_id):
+    return session.exec(
+        select(CrawlCheckpoint).where(CrawlCheckpoint.run_id == run_id).order_by(CrawlCheckpoint.category_index)
+    ).all()
+
+def start_or_resume_run(engine, categories, mode):
+    """
+    The run to crawl now: the latest unfinished one, or a new one.
+    Returns (run_id, started_at, resume_pages) with resume_pages
+    {category_index: first page} for the categories still to crawl.
+    """
+    now = datetime.utcnow()
+    with Session(engine) as session:
+        run = session.exec(
+            select(CrawlRun).where(CrawlRun.status.in_(UNFINISHED)).order_by(CrawlRun.id.desc())
+        ).first()
+        if run and run.started_at < now - timedelta(hours=CRAWL_RESUME_MAX_AGE_HOURS):
+            print(f"Abandoning crawl run {run.id} started at {run.started_at}: too old to resume.", flush=True)
+            run.status = "abandoned"
+            run.finished_at = now
+            session.add(run)
+            run = None
+
+        if run:
+            print(f"Resuming crawl run {run.id} ({run.status}: {run.termination_reason}), "
+                  f"{run.pages} pages saved so far.", flush=True)
+            run.status = "running"
+            run.resume_count += 1
+            run.resumed_at = now
+            run.pages_at_resume = run.pages
+        else:
+            run = CrawlRun(mode=mode, started_at=now, updated_at=now, resumed_at=now)
+        run.updated_at = now
+        run.termination_reason = None
+        session.add(run)
+        session.flush()
+
+        # Categories added since the run started are crawled too
+        existing = {cp.category: cp for cp in _checkpoints(session, run.id)}
+        resume_pages = {}
+        for i, category in enumerate(categories):
+            cp = existing.get(category)
+            if cp is None:
+                cp = CrawlCheckpoint(run_id=run.id, category=category, category_index=i)
+            cp.category_index = i
+            session.add(cp)
+            if cp.status != "done":
+                resume_pages[i] = cp.next_page
+        session.commit()
+        return run.id, run.started_at, resume_pages
+
+def record_page(engine, run_id, category, items):
+    """One more page of `category` saved (called right after the page's commit)"""
+    now = datetime.utcnow()
+    with Session(engine) as session:
+        cp = session.get(CrawlCheckpoint, (run_id, category))
+        run = session.get(CrawlRun, run_id)
+        if cp is None or run is None:
+            return
+        cp.status = "running"
+        cp.started_at = cp.started_at or now
+        cp.updated_at = now
+        cp.next_page += 1
+        cp.pages += 1
+        cp.items += items
+        run.updated_at = now
+        run.pages += 1
+        run.items += items
+        session.add(cp)
+        session.add(run)
+        session.commit()
+
+def finish_category(engine, run_id, category):
+    now = datetime.utcnow()
+    with Session(engine) as session:
+        cp = session.get(CrawlCheckpoint, (run_id, category))
+        if cp is None:
+            return
+        cp.status = "done"
+        cp.started_at = cp.started_at or now
+        cp.updated_at = cp.finished_at = now
+        session.add(cp)
+        session.commit()
+
+def stop_run(engine, run_id, status, reason=None, resume_pages=None, failed_writes=()):
+    """
+    End the current segment of a run.
+    status "completed" closes it; "blocked"/"failed" leave it to be resumed.
+    resume_pages ({category_index: page}, from BlockingError.resume_pages)
+    are the categories left to crawl: they resume from there, the others are done.
+    Categories in failed_writes lost a page: they keep their checkpoint (the
+    first page not saved) whatever resume_pages says.
+    """
+    now = datetime.utcnow()
+    with Session(engine) as session:
+        run = session.get(CrawlRun, run_id)
+        run.status = status
+        run.termination_reason = reason
+        run.updated_at = now
+        if status == "completed":
+            run.finished_at = now
+        for cp in _checkpoints(session, run_id):
+            lost_page = cp.category in failed_writes
+            if status == "completed" or (resume_pages is not None and cp.category_index not in resume_pages and not lost_page):
+                cp.status = "done"
+            else:
+                if resume_pages is not None and not lost_page:
+                    cp.next_page = resume_pages[cp.category_index]
+                if cp.status == "running":
+                    cp.status = status
+            if cp.status == "done" and cp.finished_at is None:
+                cp.finished_at = now
+            session.add(cp)
+        session.add(run)
+        session.commit()
+
+def _expected_pages(session, category, run_id):
+    """Pages saved for `category` by the last completed run before `run_id`, None if there's none"""
+    return session.exec(
+        select(CrawlCheckpoint.next_page - 1)
+        .join(CrawlRun, CrawlRun.id == CrawlCheckpoint.run_id)
+        .where(CrawlCheckpoint.category == category, CrawlRun.status == "completed", CrawlRun.id < run_id)
+        .order_by(CrawlRun.id.desc())
+    ).first()
+
+def _seconds_per_page(run, now):
+    pages = run.pages - run.pages_at_resume
+    end = run.finished_at or (now if run.status == "running" else run.updated_at)
+    if pages <= 0:
+        return None
+    return (end - run.resumed_at).total_seconds() / pages
+
+def crawl_status(session):
+    """Latest run with per-category progress and, while it's running, an ETA"""
+    run = session.exec(select(CrawlRun).order_by(CrawlRun.id.desc())).first()
+    if run is None:
+        return {"run": None, "categories": [], "remaining_pages": None, "seconds_per_page": None, "eta": None}
+
+    now = datetime.utcnow()
+    categories = []
+    remaining = 0
+    for cp in _checkpoints(session, run.id):
+        expected = _expected_pages(session, cp.category, run.id)
+        done_pages = cp.next_page - 1
+        if cp.status == "done":
+            left = 0
+        elif expected is None:
+            left = None
+        else:
+            # At least the page we're on
+            left = max(expected - done_pages, 1)
+        remaining = None if remaining is None or left is None else remaining + left
+        categories.append({
+            **cp.model_dump(exclude={"run_id"}),
+            "expected_pages": expected,
+            "remaining_pages": left,
+        })
+
+    # Measured on the current segment, or on the last completed run before any page is saved
+    seconds_per_page = _seconds_per_page(run, now)
+    if seconds_per_page is None:
+        previous = session.exec(
+            select(CrawlRun).where(CrawlRun.status == "completed", CrawlRun.id < run.id).order_by(CrawlRun.id.desc())
+        ).first()
+        seconds_per_page = _seconds_per_page(previous, now) if previous else None
+
+    eta = None
+    if run.status == "running" and remaining is not None and seconds_per_page is not None:
+        eta = now + timedelta(seconds=remaining * seconds_per_page)
+    return {
+        "run": run.model_dump(),
+        "categories": categories,
+        "remaining_pages": remaining,
+        "seconds_per_page": round(seconds_per_page, 1) if seconds_per_page is not None else None,
+        "eta": eta,
+    }
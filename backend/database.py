@@ -4,16 +4,70 @@ from sqlmodel import SQLModel, create_engine, Session
 sqlite_file_name = os.getenv("DB_PATH", "bernabei.db")
 sqlite_url = f"sqlite:///{sqlite_file_name}"
 
-from sqlalchemy import text
+from sqlalchemy import text, event
 
-connect_args = {"check_same_thread": False}
-engine = create_engine(sqlite_url, echo=False, connect_args=connect_args)
+# Per-connection tuning, applied to every connection of both engines
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", 30000))
+SQLITE_MMAP_SIZE_MB = int(os.getenv("SQLITE_MMAP_SIZE_MB", 256))
+SQLITE_CACHE_SIZE_MB = int(os.getenv("SQLITE_CACHE_SIZE_MB", 32))
+# How long a writer waits for the single writer connection before giving up
+SQLITE_WRITER_WAIT_SECONDS = int(os.getenv("SQLITE_WRITER_WAIT_SECONDS", 300))
+
+def create_sqlite_engine(path, read_only=False):
+    """
+    SQLite engine with WAL journaling.
+
+    read_only=False: the writer engine. One connection, so writers in this
+    process queue up in the pool instead of fighting over the database lock,
+    and transactions start with BEGIN IMMEDIATE so they never fail halfway
+    upgrading a read lock (e.g. against a maintenance script in another process).
+
+    read_only=True: a pool of query_only connections for the API. In WAL mode
+    they read the last committed snapshot and never wait for a page write.
+    """
+    connect_args = {"check_same_thread": False}
+    if read_only:
+        sqlite_engine = create_engine(f"sqlite:///{path}", echo=False, connect_args=connect_args)
+    else:
+        sqlite_engine = create_engine(
+            f"sqlite:///{path}", echo=False, connect_args=connect_args,
+            pool_size=1, max_overflow=0, pool_timeout=SQLITE_WRITER_WAIT_SECONDS,
+        )
+
+    # pysqlite opens transactions lazily on its own, which breaks SAVEPOINT handling.
+    # Disable that and let SQLAlchemy emit BEGIN itself so begin_nested() works.
+    @event.listens_for(sqlite_engine, "connect")
+    def _configure_connection(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        if not read_only:
+            # Persistent, stored in the database file; set by the writer only
+            cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE_MB * 1024 * 1024}")
+        cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_MB * 1024}")
+        if read_only:
+            cursor.execute("PRAGMA query_only=ON")
+        cursor.close()
+
+    @event.listens_for(sqlite_engine, "begin")
+    def _emit_begin(conn):
+        conn.exec_driver_sql("BEGIN" if read_only else "BEGIN IMMEDIATE")
+
+    return sqlite_engine
+
+# Scraper, background jobs and maintenance scripts write through `engine`;
+# API handlers read through `read_engine` (see get_session).
+engine = create_sqlite_engine(sqlite_file_name)
+read_engine = create_sqlite_engine(sqlite_file_name, read_only=True)
 
 def create_db_and_tables():
     SQLModel.metadata.create_all(engine)
 
 def get_session():
-    with Session(engine) as session:
+    # Read-only: API handlers must not write (writes go through `engine`)
+    with Session(read_engine) as session:
         yield session
 
 def verify_db_persistence():
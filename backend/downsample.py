@@ -0,0 +1,36 @@
+"""
+Largest-Triangle-Three-Buckets downsampling (Steinarsson, 2013) for charts.
+
+Keeps the first and last points and, from each of threshold - 2 equal buckets
+in between, the point forming the largest triangle with the previously kept
+point and the average of the next bucket. Spikes and dips survive, unlike
+with averaging or taking every n-th point.
+"""
+import numpy as np
+
+def lttb(x, y, threshold):
+    """Indices of the points to keep, ascending. x must be sorted."""
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return list(range(n))
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+
+    every = (n - 2) / (threshold - 2)
+    kept = [0]
+    a = 0
+    for i in range(threshold - 2):
+        # Average of the next bucket (the last point for the last bucket)
+        next_start = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        # Twice the triangle areas, enough to compare them
+        areas = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(areas.argmax())
+        kept.append(a)
+    kept.append(n - 1)
+    return kept
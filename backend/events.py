@@ -0,0 +1,160 @@
+"""
+Live events for GET /events (Server-Sent Events).
+
+Writers (the scrape pipeline's DB thread, the scoring job) publish events
+after their transaction commits; the broker fans them out to every connected
+client through a bounded per-client queue. A client that falls behind by more
+than EVENTS_CLIENT_BUFFER events is dropped: it gets a final `dropped` event
+and should catch up with /products/changes from the last event id it saw,
+then reconnect. Publishing never blocks a writer.
+
+Event ids are the products' change_seq (see changes.py), so the last id a
+client received is a valid `since` for /products/changes.
+"""
+import asyncio
+import json
+import os
+import threading
+from datetime import datetime
+
+from metrics import EVENTS_CLIENTS, EVENTS_PUBLISHED, EVENTS_DROPPED_CLIENTS
+
+# Events buffered per client before it's dropped as too slow
+EVENTS_CLIENT_BUFFER = int(os.getenv("EVENTS_CLIENT_BUFFER", 1000))
+# Comment line sent on idle connections so proxies don't time them out
+EVENTS_KEEPALIVE_SECONDS = float(os.getenv("EVENTS_KEEPALIVE_SECONDS", 15))
+# Score updates bigger than this are announced with one scores_updated summary
+EVENTS_MAX_SCORE_EVENTS = int(os.getenv("EVENTS_MAX_SCORE_EVENTS", 500))
+
+class Subscriber:
+    """One /events connection: a bounded queue on the event loop serving it"""
+
+    def __init__(self, loop, maxsize):
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize)
+        self.dropped = False
+
+    def _offer(self, event):
+        # Runs on self.loop
+        if self.dropped:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.dropped = True
+            EVENTS_DROPPED_CLIENTS.inc()
+            # Make room for the notice; the client resyncs from its last event id anyway
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait({"type": "dropped", "data": {"reason": f"more than {self.queue.maxsize} events behind"}})
+
+class EventBroker:
+    def __init__(self, client_buffer=None):
+        self.client_buffer = client_buffer or EVENTS_CLIENT_BUFFER
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._order_lock = threading.Lock()
+
+    @property
+    def active(self):
+        """Whether anyone is listening: writers skip building events otherwise"""
+        return bool(self._subscribers)
+
+    def ordered(self):
+        """
+        Hold around a writer's commit and its publish calls. Writers commit in
+        change_seq order (one writer connection); this keeps the events in that
+        order too, so a client's last event id is always a safe resync point.
+        """
+        return self._order_lock
+
+    def subscribe(self):
+        """Call from the event loop that will consume the subscriber's queue"""
+        subscriber = Subscriber(asyncio.get_running_loop(), self.client_buffer)
+        with self._lock:
+            self._subscribers.add(subscriber)
+            EVENTS_CLIENTS.set(len(self._subscribers))
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+            EVENTS_CLIENTS.set(len(self._subscribers))
+
+    def publish(self, event_type, data, event_id=None):
+        """Thread-safe and non-blocking: hands the event to each client's loop"""
+        event = {"type": event_type, "data": data, "id": event_id}
+        EVENTS_PUBLISHED.inc(type=event_type)
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.loop.call_soon_threadsafe(subscriber._offer, event)
+            except RuntimeError:
+                # Its loop is closed: the connection is gone
+                self.unsubscribe(subscriber)
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+def format_sse(event):
+    lines = [f"event: {event['type']}"]
+    if event.get("id") is not None:
+        lines.append(f"id: {event['id']}")
+    lines.append("data: " + json.dumps(event["data"], default=_json_default, separators=(",", ":")))
+    return "\n".join(lines) + "\n\n"
+
+async def stream(subscriber, is_disconnected):
+    """SSE text of a subscriber's events until it disconnects or is dropped"""
+    # Reconnect delay hint for EventSource
+    yield "retry: 5000\n\n"
+    while True:
+        try:
+            event = await asyncio.wait_for(subscriber.queue.get(), EVENTS_KEEPALIVE_SECONDS)
+        except asyncio.TimeoutError:
+            if await is_disconnected():
+                return
+            yield ": keepalive\n\n"
+            continue
+        yield format_sse(event)
+        if event["type"] == "dropped":
+            return
+
+# --- events of the writers ------------------------------------------------------------
+
+def publish_page_events(new_products, price_changes, all_time_lows):
+    """
+    Events of one committed page (save_products_to_db):
+    - product_created: {"id", "name", "price", "category"}
+    - price_changed: {"id", "name", "old_price", "new_price"}
+    - all_time_low: {"id", "name", "price", "previous_low"}
+    Each list holds (change_seq, data) pairs. Events go out in change_seq order.
+    """
+    events = [
+        (change_seq, order, kind, data)
+        for order, (kind, pairs) in enumerate((
+            ("product_created", new_products), ("price_changed", price_changes), ("all_time_low", all_time_lows),
+        ))
+        for change_seq, data in pairs
+    ]
+    for change_seq, _, kind, data in sorted(events, key=lambda e: e[:2]):
+        broker.publish(kind, data, event_id=change_seq)
+
+def publish_score_events(changes):
+    """
+    score_updated {"id", "old_score", "new_score"} per rescored product, or one
+    scores_updated {"count", "cursor"} summary for a large rescoring.
+    `changes` holds (change_seq, product id, old score, new score).
+    """
+    if not changes:
+        return
+    if len(changes) > EVENTS_MAX_SCORE_EVENTS:
+        last_seq = max(c[0] for c in changes)
+        broker.publish("scores_updated", {"count": len(changes), "cursor": last_seq}, event_id=last_seq)
+        return
+    for change_seq, product_id, old_score, new_score in sorted(changes):
+        broker.publish("score_updated", {"id": product_id, "old_score": old_score, "new_score": new_score}, event_id=change_seq)
+
+broker = EventBroker()
@@ -1,50 +1,103 @@
 import csv
-from sqlmodel import Session, select
-from database import engine
-from models import Product, PriceHistory
-from datetime import datetime
-
-def export_to_csv(filename="bernabei_products.csv"):
-    with Session(engine) as session:
-        statement = select(Product)
-        products = session.exec(statement).all()
-        
-        with open(filename, mode='w', newline='', encoding='utf-8') as file:
-            writer = csv.writer(file, delimiter=';') # Use semicolon for Excel compatibility in IT locale
-            
-            # Header
-            writer.writerow([
-                "Bernabei Code", "Name", "Current Price", "Ordinary Price", 
-                "Lowest Price 30 Days", "Tags", "Category", 
-                "Last Checked", "Link", "Image URL"
-            ])
-            
-            for product in products:
-                # Get latest history for details
-                statement_history = select(PriceHistory)\
-                    .where(PriceHistory.product_id == product.id)\
-                    .order_by(PriceHistory.timestamp.desc())
-                latest_history = session.exec(statement_history).first()
-                
-                tags = latest_history.tags if latest_history else ""
-                ord_price = str(latest_history.ordinary_price).replace('.', ',') if latest_history and latest_history.ordinary_price else ""
-                low_price = str(latest_history.lowest_price_30_days).replace('.', ',') if latest_history and latest_history.lowest_price_30_days else ""
-                curr_price = str(product.current_price).replace('.', ',') if product.current_price else ""
-                
-                writer.writerow([
-                    product.bernabei_code,
-                    product.name,
-                    curr_price,
-                    ord_price,
-                    low_price,
-                    tags,
-                    product.category,
-                    product.last_checked_at,
-                    product.product_link,
-                    product.image_url
-                ])
-                
-        print(f"Exported {len(products)} products to {filename}")
+import io
+import sys
+import zlib
+from sqlalchemy import text, DateTime
+from sqlmodel import Session
+from database import read_engine
+from tags import tags_sql
+
+EXPORT_HEADER = [
+    "Bernabei Code", "Name", "Current Price", "Ordinary Price",
+    "Lowest Price 30 Days", "Tags", "Category",
+    "Last Checked", "Link", "Image URL"
+]
+
+# Every product with its latest raw reading, in one query: the correlated
+# subquery is an index seek on ix_pricehistory_product_timestamp per product.
+# Products whose raw readings were all compacted fall back to product_stats
+# (rollups don't keep tags).
+EXPORT_QUERY = text(f"""
+    SELECT p.bernabei_code, p.name, p.current_price,
+           CASE WHEN h.id IS NULL THEN s.last_ordinary_price ELSE h.ordinary_price END AS ordinary_price,
+           CASE WHEN h.id IS NULL THEN s.lowest_price_30_days ELSE h.lowest_price_30_days END AS lowest_price_30_days,
+           {tags_sql("h")} AS tags, p.category, p.last_checked_at, p.product_link, p.image_url
+    FROM product p
+    LEFT JOIN pricehistory h ON h.id = (
+        SELECT id FROM pricehistory
+        WHERE product_id = p.id
+        ORDER BY timestamp DESC, id DESC
+        LIMIT 1
+    )
+    LEFT JOIN product_stats s ON s.product_id = p.id
+    ORDER BY p.id
+""").columns(last_checked_at=DateTime)
+
+def format_decimal(value):
+    # Italian locale: comma decimal separator, empty for missing/zero prices
+    return str(value).replace('.', ',') if value else ""
+
+def iter_export_rows(session, batch_size=1000):
+    """CSV rows (header first), streamed from the database in batches"""
+    yield EXPORT_HEADER
+    result = session.connection().execution_options(stream_results=True).execute(EXPORT_QUERY)
+    while True:
+        batch = result.fetchmany(batch_size)
+        if not batch:
+            return
+        for code, name, curr_price, ord_price, low_price, tags, category, last_checked, link, image_url in batch:
+            yield [
+                code,
+                name,
+                format_decimal(curr_price),
+                format_decimal(ord_price),
+                format_decimal(low_price),
+                tags or "",
+                category,
+                last_checked,
+                link,
+                image_url
+            ]
+
+def iter_export(delimiter=';', compress=False, rows_per_chunk=500):
+    """
+    The export file as a stream of byte chunks, in constant memory.
+    Opens its own read session so it can outlive a request handler.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=delimiter) # Semicolon by default for Excel compatibility in IT locale
+    # gzip container (wbits=31) produced incrementally
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+
+    def drain():
+        data = buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+        return compressor.compress(data) if compressor else data
+
+    with Session(read_engine) as session:
+        for i, row in enumerate(iter_export_rows(session), start=1):
+            writer.writerow(row)
+            if i % rows_per_chunk == 0:
+                chunk = drain()
+                if chunk:
+                    yield chunk
+
+    tail = drain()
+    if compressor:
+        tail += compressor.flush()
+    if tail:
+        yield tail
+
+def export_to_csv(filename="bernabei_products.csv", delimiter=';'):
+    rows = 0
+    with Session(read_engine) as session, open(filename, mode='w', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file, delimiter=delimiter)
+        for row in iter_export_rows(session):
+            writer.writerow(row)
+            rows += 1
+    print(f"Exported {rows - 1} products to {filename}")
 
 if __name__ == "__main__":
-    export_to_csv("bernabei_export.csv")
+    filename = sys.argv[1] if len(sys.argv) > 1 else "bernabei_export.csv"
+    export_to_csv(filename, delimiter='\t' if filename.endswith('.tsv') else ';')
@@ -0,0 +1,420 @@
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import text, DateTime
+from sqlmodel import Session
+
+from models import HistoryPoint
+from response_cache import bump_generation
+from tags import tags_sql
+from downsample import lttb
+
+# Raw readings newer than this stay untouched; older ones are rolled up per day
+# and deleted, with their per-reading tags. Opt-in: 0 (the default) keeps every
+# raw reading forever and doesn't start the compactor.
+RAW_RETENTION_DAYS = int(os.getenv("HISTORY_RAW_RETENTION_DAYS", 0))
+# How often the background compactor runs, and how it paces itself
+COMPACT_INTERVAL_HOURS = float(os.getenv("HISTORY_COMPACT_INTERVAL_HOURS", 6))
+COMPACT_BATCH_PRODUCTS = int(os.getenv("HISTORY_COMPACT_BATCH_PRODUCTS", 200))
+COMPACT_PAUSE_SECONDS = float(os.getenv("HISTORY_COMPACT_PAUSE_SECONDS", 0.5))
+# "full": one raw row per reading. "rle": a reading identical to the product's
+# latest row only extends that row's last_seen/seen_count.
+HISTORY_STORAGE = os.getenv("HISTORY_STORAGE", "full")
+# Longest span of a run (rle): a run opened this many days ago is closed even if
+# nothing changed, so its row is final and can be exported (parquet_export.py)
+RUN_MAX_DAYS = float(os.getenv("HISTORY_RUN_MAX_DAYS", 7))
+
+# Fields whose change starts a new run
+RUN_FIELDS = ("price", "ordinary_price", "lowest_price_30_days", "tag_mask", "tags")
+
+# Latest raw row of each product, one index seek on ix_pricehistory_product_timestamp each
+OPEN_RUNS_QUERY = text("""
+    SELECT h.id, h.product_id, h.price, h.ordinary_price, h.lowest_price_30_days, h.tag_mask, h.tags,
+           h.timestamp, COALESCE(h.last_seen, h.timestamp) AS last_seen, h.seen_count
+    FROM json_each(:ids) j
+    JOIN pricehistory h ON h.id = (
+        SELECT id FROM pricehistory WHERE product_id = j.value ORDER BY timestamp DESC, id DESC LIMIT 1
+    )
+""").columns(timestamp=DateTime, last_seen=DateTime)
+
+# Merging into an existing (product, day) row keeps the aggregates exact,
+# e.g. when late readings for an already compacted day are compacted again.
+MERGE_ON_CONFLICT = """
+ON CONFLICT(product_id, day) DO UPDATE SET
+    min_price = CASE WHEN min_price IS NULL THEN excluded.min_price
+                     WHEN excluded.min_price IS NULL THEN min_price
+                     ELSE MIN(min_price, excluded.min_price) END,
+    max_price = CASE WHEN max_price IS NULL THEN excluded.max_price
+                     WHEN excluded.max_price IS NULL THEN max_price
+                     ELSE MAX(max_price, excluded.max_price) END,
+    first_price = CASE WHEN excluded.first_seen < first_seen THEN excluded.first_price ELSE first_price END,
+    last_price = CASE WHEN excluded.last_seen >= last_seen THEN excluded.last_price ELSE last_price END,
+    ordinary_price = CASE WHEN excluded.last_seen >= last_seen THEN excluded.ordinary_price ELSE ordinary_price END,
+    lowest_price_30_days = CASE WHEN excluded.last_seen >= last_seen THEN excluded.lowest_price_30_days ELSE lowest_price_30_days END,
+    price_sum = price_sum + excluded.price_sum,
+    positive_count = positive_count + excluded.positive_count,
+    reading_count = reading_count + excluded.reading_count,
+    first_seen = MIN(first_seen, excluded.first_seen),
+    last_seen = MAX(last_seen, excluded.last_seen)
+"""
+
+DAILY_COLUMNS = """product_id, day, min_price, max_price, first_price, last_price, ordinary_price,
+    lowest_price_30_days, price_sum, positive_count, reading_count, first_seen, last_seen"""
+
+def _readings_before(x):
+    """SQL: how many readings of a run (see RUN_DAYS) are older than julian day `x`"""
+    # The seen_count readings of a run are taken as evenly spread from its first
+    # to its last sighting (as in _expand_run); ceil() spelled with CAST
+    return f"""(CASE WHEN step IS NULL OR step = 0 THEN CASE WHEN {x} > t0 THEN n ELSE 0 END
+        ELSE MIN(n, MAX(0, CAST(({x} - t0) / step AS INTEGER) + (({x} - t0) / step > CAST(({x} - t0) / step AS INTEGER))))
+        END)"""
+
+def _sql_datetime(jd):
+    """SQL: julian day as text in the format SQLAlchemy stores DATETIME columns in"""
+    return f"(strftime('%Y-%m-%d %H:%M:%f', {jd}) || '000')"
+
+# Raw rows split per day: one row for each day a run (HISTORY_STORAGE=rle) has
+# readings in, with `readings` the number of them and first_seen/last_seen the
+# first and last of that day. Rows within a single day (every full-storage row)
+# pass straight through; only runs across midnight go through the recursion.
+# CTEs for a WITH RECURSIVE clause; {where} filters pricehistory rows (alias h).
+RUN_DAYS = f"""
+run_days(id, product_id, price, ordinary_price, lowest_price_30_days, n, t0, step,
+         run_first_seen, run_last_seen, day) AS (
+    SELECT h.id, h.product_id, h.price, h.ordinary_price, h.lowest_price_30_days, h.seen_count,
+           julianday(h.timestamp),
+           (julianday(h.last_seen) - julianday(h.timestamp)) / MAX(h.seen_count - 1, 1),
+           h.timestamp, h.last_seen, date(h.timestamp)
+    FROM pricehistory h
+    WHERE {{where}} AND h.seen_count > 1 AND date(h.last_seen) > date(h.timestamp)
+    UNION ALL
+    SELECT id, product_id, price, ordinary_price, lowest_price_30_days, n, t0, step,
+           run_first_seen, run_last_seen, date(day, '+1 day')
+    FROM run_days
+    WHERE day < date(run_last_seen)
+),
+run_day_counts AS (
+    SELECT *, {_readings_before("julianday(day)")} AS lo, {_readings_before("julianday(day, '+1 day')")} AS hi
+    FROM run_days
+),
+raw_days AS (
+    SELECT h.id, h.product_id, date(h.timestamp) AS day, h.price, h.ordinary_price, h.lowest_price_30_days,
+           h.seen_count AS readings, h.timestamp AS first_seen, COALESCE(h.last_seen, h.timestamp) AS last_seen
+    FROM pricehistory h
+    WHERE {{where}} AND (h.seen_count = 1 OR date(h.last_seen) = date(h.timestamp))
+    UNION ALL
+    SELECT id, product_id, day, price, ordinary_price, lowest_price_30_days, hi - lo,
+           CASE WHEN lo = 0 THEN run_first_seen ELSE {_sql_datetime("t0 + lo * step")} END,
+           CASE WHEN hi = n THEN run_last_seen ELSE {_sql_datetime("t0 + (hi - 1) * step")} END
+    FROM run_day_counts
+    WHERE hi > lo
+)
+"""
+
+# Raw readings aggregated per product per day (see RUN_DAYS).
+# {where} filters pricehistory rows (alias h), {day_where} the days (alias raw_days).
+RAW_DAILY_SELECT = """
+WITH RECURSIVE """ + RUN_DAYS + """
+SELECT product_id, day,
+       MIN(CASE WHEN price > 0 THEN price END) AS min_price,
+       MAX(CASE WHEN price > 0 THEN price END) AS max_price,
+       first_price, last_price, ordinary_price, lowest_price_30_days,
+       SUM(CASE WHEN price > 0 THEN price * readings ELSE 0 END) AS price_sum,
+       SUM((price > 0) * readings) AS positive_count,
+       SUM(readings) AS reading_count,
+       MIN(first_seen) AS first_seen,
+       MAX(last_seen) AS last_seen
+FROM (
+    SELECT product_id, day, price, readings, first_seen, last_seen,
+           FIRST_VALUE(price) OVER day_asc AS first_price,
+           FIRST_VALUE(price) OVER day_desc AS last_price,
+           FIRST_VALUE(ordinary_price) OVER day_desc AS ordinary_price,
+           FIRST_VALUE(lowest_price_30_days) OVER day_desc AS lowest_price_30_days
+    FROM raw_days
+    WHERE {day_where}
+    WINDOW day_asc AS (PARTITION BY product_id, day ORDER BY first_seen, id),
+           day_desc AS (PARTITION BY product_id, day ORDER BY last_seen DESC, id DESC)
+)
+GROUP BY product_id, day
+"""
+
+# Runs that started before :cutoff and go on after it lose their readings
+# before it (already rolled up); the last sighting always stays.
+# {where} filters pricehistory rows (alias h).
+TRIM_RUNS_UPDATE = f"""
+UPDATE pricehistory SET
+    seen_count = r.n - r.lo,
+    timestamp = CASE WHEN r.n - r.lo = 1 THEN r.run_last_seen ELSE {_sql_datetime("r.t0 + r.lo * r.step")} END
+FROM (
+    SELECT id, n, t0, step, run_last_seen, MIN(n - 1, {_readings_before("julianday(:cutoff)")}) AS lo
+    FROM (
+        SELECT h.id, h.seen_count AS n, julianday(h.timestamp) AS t0,
+               CASE WHEN h.seen_count > 1
+                    THEN (julianday(COALESCE(h.last_seen, h.timestamp)) - julianday(h.timestamp)) / (h.seen_count - 1) END AS step,
+               COALESCE(h.last_seen, h.timestamp) AS run_last_seen
+        FROM pricehistory h
+        WHERE {{where}}
+    )
+) r
+WHERE pricehistory.id = r.id
+"""
+
+def _run_key(reading):
+    return tuple(reading.get(f) or None for f in RUN_FIELDS)
+
+def extend_runs(session, history_rows):
+    """
+    Run-length encode a page of readings (HISTORY_STORAGE=rle).
+    A reading identical (RUN_FIELDS) to its product's latest row, not older
+    than it and less than RUN_MAX_DAYS after the row was opened, extends that
+    row; anything else opens a new row. Runs cross midnight: the daily
+    rollups, scores and compaction split them per day (RUN_DAYS).
+
+    Returns (new_rows, run_updates, extensions):
+    - new_rows: rows to insert, with last_seen/seen_count set
+    - run_updates: {"id", "last_seen", "seen_count"} for existing rows to update
+    - extensions: the readings absorbed into a run, still to be counted in product_stats
+    """
+    if not history_rows:
+        return [], [], []
+    ids = "[" + ",".join(str(int(i)) for i in {r["product_id"] for r in history_rows}) + "]"
+    runs = {
+        row.product_id: dict(row._mapping)
+        for row in session.exec(OPEN_RUNS_QUERY.bindparams(ids=ids)).all()
+    }
+
+    new_rows, updated, extensions = [], {}, []
+    for reading in history_rows:
+        run = runs.get(reading["product_id"])
+        if (run is not None and _run_key(run) == _run_key(reading)
+                and reading["timestamp"] - run["timestamp"] < timedelta(days=RUN_MAX_DAYS)
+                and reading["timestamp"] >= run["last_seen"]):
+            run["last_seen"] = reading["timestamp"]
+            run["seen_count"] += 1
+            if run.get("id") is not None:
+                updated[run["id"]] = run
+            extensions.append(reading)
+            continue
+        row = dict(reading, last_seen=reading["timestamp"], seen_count=1)
+        new_rows.append(row)
+        # Later duplicates of the page extend the new row before it's inserted
+        runs[reading["product_id"]] = row
+
+    run_updates = [{"id": r["id"], "last_seen": r["last_seen"], "seen_count": r["seen_count"]} for r in updated.values()]
+    return new_rows, run_updates, extensions
+
+def compaction_cutoff(now=None, retention_days=None):
+    """Start of the oldest day that must stay raw. Only whole days before it are compacted."""
+    retention_days = RAW_RETENTION_DAYS if retention_days is None else retention_days
+    now = now or datetime.utcnow()
+    return datetime.combine((now - timedelta(days=retention_days)).date(), datetime.min.time())
+
+def compact_batch(session, product_ids, cutoff):
+    """
+    Roll up the raw readings older than cutoff for a batch of products, then
+    delete them. A run that goes on past the cutoff keeps its later readings:
+    it's trimmed to start at the first of them. Returns the raw rows deleted or trimmed.
+    """
+    ids = "[" + ",".join(str(int(i)) for i in product_ids) + "]"
+    where = "h.product_id IN (SELECT value FROM json_each(:ids)) AND h.timestamp < :cutoff"
+    params = {"ids": ids, "cutoff": cutoff.strftime("%Y-%m-%d %H:%M:%S.%f")}
+
+    session.exec(text(
+        f"INSERT INTO pricehistory_daily ({DAILY_COLUMNS}) "
+        + RAW_DAILY_SELECT.format(where=where, day_where="day < date(:cutoff)")
+        + MERGE_ON_CONFLICT
+    ).bindparams(**params))
+    trimmed = session.exec(text(
+        TRIM_RUNS_UPDATE.format(where=where + " AND COALESCE(h.last_seen, h.timestamp) >= :cutoff")
+    ).bindparams(**params))
+    deleted = session.exec(text(
+        "DELETE FROM pricehistory WHERE product_id IN (SELECT value FROM json_each(:ids)) "
+        "AND COALESCE(last_seen, timestamp) < :cutoff"
+    ).bindparams(**params))
+    return trimmed.rowcount + deleted.rowcount
+
+def compact_history(engine, retention_days=None, batch_products=None, pause_seconds=None):
+    """
+    One compaction pass over the catalog, in bounded batches of products.
+    Each batch is its own short transaction, with a pause in between so the
+    scraper can take the write lock.
+    """
+    retention_days = RAW_RETENTION_DAYS if retention_days is None else retention_days
+    batch_products = batch_products or COMPACT_BATCH_PRODUCTS
+    pause_seconds = COMPACT_PAUSE_SECONDS if pause_seconds is None else pause_seconds
+    if retention_days <= 0:
+        return 0
+
+    cutoff = compaction_cutoff(retention_days=retention_days)
+    last_id = 0
+    compacted = 0
+    while True:
+        with Session(engine) as session:
+            product_ids = [r[0] for r in session.exec(
+                text("SELECT id FROM product WHERE id > :after ORDER BY id LIMIT :n").bindparams(after=last_id, n=batch_products)
+            ).all()]
+            if not product_ids:
+                break
+            batch_count = compact_batch(session, product_ids, cutoff)
+            if batch_count:
+                # History responses change shape (raw readings become daily points)
+                bump_generation(session)
+            session.commit()
+        compacted += batch_count
+        last_id = product_ids[-1]
+        time.sleep(pause_seconds)
+    return compacted
+
+def compact_forever(engine):
+    """Background compactor loop, started by the API process"""
+    if RAW_RETENTION_DAYS <= 0:
+        print("History compaction disabled (set HISTORY_RAW_RETENTION_DAYS to enable it).", flush=True)
+        return
+    while True:
+        try:
+            start = time.time()
+            count = compact_history(engine)
+            print(f"History compaction: rolled up {count} raw rows older than {RAW_RETENTION_DAYS} days in {time.time() - start:.1f}s.", flush=True)
+        except Exception as e:
+            print(f"Error in history compaction: {e}", flush=True)
+        time.sleep(COMPACT_INTERVAL_HOURS * 3600)
+
+def merge_daily_rollups(session, from_product_id, to_product_id):
+    """Move a product's rollup rows onto another product (duplicate consolidation)"""
+    session.exec(text(
+        f"INSERT INTO pricehistory_daily ({DAILY_COLUMNS}) "
+        f"SELECT :to_id, day, min_price, max_price, first_price, last_price, ordinary_price, "
+        f"lowest_price_30_days, price_sum, positive_count, reading_count, first_seen, last_seen "
+        f"FROM pricehistory_daily WHERE product_id = :from_id AND true "
+        + MERGE_ON_CONFLICT
+    ).bindparams(from_id=from_product_id, to_id=to_product_id))
+    session.exec(text("DELETE FROM pricehistory_daily WHERE product_id = :from_id").bindparams(from_id=from_product_id))
+
+def _daily_point(product_id, row):
+    day, min_p, max_p, first_p, last_p, ordinary, lowest, count, first_seen, last_seen = row
+    return HistoryPoint(
+        product_id=product_id,
+        # The daily minimum is the reference price of a day (same as the score)
+        price=min_p if min_p is not None else 0.0,
+        ordinary_price=ordinary,
+        lowest_price_30_days=lowest,
+        timestamp=first_seen,
+        last_seen=last_seen,
+        min_price=min_p,
+        max_price=max_p,
+        reading_count=count,
+    )
+
+def _expand_run(point):
+    """The seen_count readings of a run, spread evenly from its first to its last sighting"""
+    count = point.reading_count or 1
+    if count == 1 or point.last_seen is None:
+        return [point]
+    step = (point.last_seen - point.timestamp) / (count - 1)
+    return [
+        point.model_copy(update={"timestamp": point.timestamp + step * k, "last_seen": None, "reading_count": 1})
+        for k in range(count)
+    ]
+
+def load_history(session, product_id, resolution="raw", expand=False):
+    """
+    Full history of a product across both tiers, oldest first.
+    resolution="raw": raw rows (a run of identical readings is one point with
+    last_seen and reading_count), plus one point per compacted day.
+    resolution="daily": one point per day for the whole range.
+    expand=True turns each raw run back into reading_count points.
+    """
+    rollup_query = text("""
+        SELECT day, min_price, max_price, first_price, last_price, ordinary_price,
+               lowest_price_30_days, reading_count, first_seen, last_seen
+        FROM pricehistory_daily WHERE product_id = :pid ORDER BY day
+    """).bindparams(pid=product_id)
+    points = [_daily_point(product_id, r) for r in session.exec(rollup_query).all()]
+
+    if resolution == "daily":
+        raw_daily = text(
+            "SELECT day, min_price, max_price, first_price, last_price, ordinary_price, "
+            "lowest_price_30_days, reading_count, first_seen, last_seen FROM ("
+            + RAW_DAILY_SELECT.format(where="h.product_id = :pid", day_where="true")
+            + ") ORDER BY day"
+        ).bindparams(pid=product_id)
+        raw_points = [_daily_point(product_id, r) for r in session.exec(raw_daily).all()]
+    else:
+        raw = text(f"""
+            SELECT h.id, h.price, h.ordinary_price, h.lowest_price_30_days, {tags_sql("h")}, h.timestamp,
+                   COALESCE(h.last_seen, h.timestamp) AS last_seen, h.seen_count
+            FROM pricehistory h WHERE h.product_id = :pid ORDER BY h.timestamp
+        """).bindparams(pid=product_id).columns(timestamp=DateTime, last_seen=DateTime)
+        raw_points = [
+            HistoryPoint(id=r[0], product_id=product_id, price=r[1], ordinary_price=r[2],
+                         lowest_price_30_days=r[3], tags=r[4], timestamp=r[5],
+                         last_seen=r[6], reading_count=r[7])
+            for r in session.exec(raw).all()
+        ]
+        if expand:
+            raw_points = [p for point in raw_points for p in _expand_run(point)]
+
+    # Rollup days are all older than the raw tier, except for late or replayed
+    # readings, so a stable sort keeps this cheap.
+    points.extend(raw_points)
+    points.sort(key=lambda p: p.timestamp)
+    return points
+
+def load_chart_series(session, product_ids, points=300):
+    """
+    Price series of several products for charts, in one query per tier:
+    {product_id: {"timestamps": [epoch ms], "prices": [...], "ordinary_prices": [...], "total_points": n}}.
+    Compacted days contribute their minimum, a run (HISTORY_STORAGE=rle) its
+    first and last sighting, and unreadable 0.0 prices are left out. Each
+    series is downsampled to `points` with LTTB on the price.
+    """
+    ids = "[" + ",".join(str(int(i)) for i in product_ids) + "]"
+    series = {product_id: [] for product_id in product_ids}
+    rollups = text("""
+        SELECT d.product_id, d.first_seen, d.min_price, d.ordinary_price
+        FROM pricehistory_daily d
+        WHERE d.product_id IN (SELECT value FROM json_each(:ids)) AND d.min_price IS NOT NULL
+        ORDER BY d.product_id, d.day
+    """).bindparams(ids=ids).columns(first_seen=DateTime)
+    for product_id, first_seen, price, ordinary in session.exec(rollups).all():
+        series[product_id].append((first_seen, price, ordinary))
+    raw = text("""
+        SELECT h.product_id, h.timestamp, COALESCE(h.last_seen, h.timestamp) AS last_seen, h.price, h.ordinary_price
+        FROM pricehistory h
+        WHERE h.product_id IN (SELECT value FROM json_each(:ids)) AND h.price > 0
+        ORDER BY h.product_id, h.timestamp
+    """).bindparams(ids=ids).columns(timestamp=DateTime, last_seen=DateTime)
+    for product_id, timestamp, last_seen, price, ordinary in session.exec(raw).all():
+        series[product_id].append((timestamp, price, ordinary))
+        if last_seen > timestamp:
+            # Keep the run flat up to its last sighting
+            series[product_id].append((last_seen, price, ordinary))
+
+    epoch = datetime(1970, 1, 1)
+    result = {}
+    for product_id, rows in series.items():
+        # Rollup days precede the raw tier except for late readings: a stable sort is cheap
+        rows.sort(key=lambda r: r[0])
+        seconds = [(r[0] - epoch).total_seconds() for r in rows]
+        keep = lttb(seconds, [r[1] for r in rows], points)
+        result[product_id] = {
+            "timestamps": [round(seconds[i] * 1000) for i in keep],
+            "prices": [rows[i][1] for i in keep],
+            "ordinary_prices": [rows[i][2] for i in keep],
+            "total_points": len(rows),
+        }
+    return result
+
+if __name__ == "__main__":
+    from database import engine, create_db_and_tables
+    from migrations import run_migrations
+
+    if RAW_RETENTION_DAYS <= 0:
+        print("Nothing to do: set HISTORY_RAW_RETENTION_DAYS to roll up and delete older raw readings.")
+        sys.exit(0)
+    create_db_and_tables()
+    run_migrations(engine)
+    count = compact_history(engine, pause_seconds=0)
+    print(f"Compacted {count} raw rows older than {RAW_RETENTION_DAYS} days.")
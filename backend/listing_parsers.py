@@ -0,0 +1,305 @@
+import hashlib
+import os
+import re
+from datetime import datetime
+
+from bs4 import BeautifulSoup
+
+from metrics import PARSE_ERRORS
+
+# Optional fast backend (pip install selectolax)
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:
+    LexborHTMLParser = None
+
+BASE_URL = "https://www.bernabei.it"
+
+# "soup" (BeautifulSoup, html.parser), "selectolax", or "auto": selectolax when installed
+SCRAPER_PARSER = os.getenv("SCRAPER_PARSER", "auto")
+
+def parse_price(price_str):
+    if not price_str: return None
+    # Remove euro sign and non-breaking spaces, replace comma with dot
+    clean_str = re.sub(r'[^\d,\.]', '', price_str).replace(',', '.')
+    # Remove trailing dots if any (e.g. from thousand separators if used differently)
+    # Euro standard for Italy is 1.000,00 but usually simple sites use 1000,00
+    try:
+        return float(clean_str)
+    except ValueError:
+        return None
+
+def normalize_slug(product_link):
+    """
+    Canonical product slug used for identity checks (Product.slug).
+    url: https://www.bernabei.it/vino-bianco/Chardonnay/?foo=1 -> chardonnay
+    """
+    if not product_link:
+        return None
+    # Remove query params / fragment and trailing slash, keep last path segment
+    clean_link = product_link.split('?')[0].split('#')[0].strip().strip('/')
+    slug = clean_link.split('/')[-1].strip().lower()
+    return slug or None
+
+def normalize_tags(tags):
+    """
+    Unique tag names in order of appearance, whitespace collapsed.
+    Accepts a list or a comma-separated string (stored readings, archive replays).
+    "BEST PRICE, BEST PRICE,Special Price" -> ["BEST PRICE", "Special Price"]
+    """
+    if not tags:
+        return []
+    if isinstance(tags, str):
+        tags = tags.split(",")
+    unique = []
+    for tag in tags:
+        tag = re.sub(r"\s+", " ", tag).strip()
+        if tag and tag not in unique:
+            unique.append(tag)
+    return unique
+
+def product_id_from(product_link, cart_onclick, price_ids):
+    # Strategy 1: URL Slug (Most reliable for stability if URL doesn't change)
+    # The slug as written in the link, case and all: existing bernabei_code
+    # values were derived this way. Identity checks use normalize_slug instead.
+    if product_link:
+        # url: https://www.bernabei.it/vino-bianco/chardonnay -> chardonnay
+        clean_link = product_link.split('?')[0]
+        if clean_link.endswith('/'):
+            clean_link = clean_link[:-1]
+        slug = clean_link.split('/')[-1]
+        if slug:
+            return slug
+
+    # Strategy 2: the add-to-cart button contains the product ID in onclick
+    # onclick=".../product/19132/..."
+    match = re.search(r'/product/(\d+)/', cart_onclick or '')
+    if match:
+        return match.group(1)
+
+    # Strategy 3: Check price id "product-price-19132..."
+    for price_id in price_ids:
+        match = re.search(r'product-price-(\d+)', price_id)
+        if match:
+            return match.group(1)
+
+    return None
+
+def absolute_image_url(image_url):
+    # Handle relative URLs
+    if image_url and not image_url.startswith('http') and not image_url.startswith('data:'):
+        if image_url.startswith('//'):
+            return f"https:{image_url}"
+        return f"{BASE_URL}{image_url}" if image_url.startswith('/') else f"{BASE_URL}/{image_url}"
+    return image_url
+
+def build_product(name, link, cart_onclick, price_ids, image_url, current_price, ordinary_price, lowest_price, tags):
+    """Product dict from the raw strings of one listing item, shared by all backends"""
+    if link and not link.startswith('http'):
+        link = f"{BASE_URL}{link}"
+
+    p_id = product_id_from(link, cart_onclick, price_ids)
+    if not p_id:
+        # Fallback to deterministic hash of name (normalized)
+        # We sanitize the name to avoid minor diffs causing new IDs
+        clean_name = re.sub(r'\s+', ' ', name).strip().lower()
+        p_id = f"gen_{hashlib.md5(clean_name.encode()).hexdigest()[:10]}"
+        print(f"⚠️ WARNING: Could not extract ID for '{name}', using hash: {p_id}", flush=True)
+
+    return {
+        "bernabei_code": p_id,
+        "name": name,
+        "product_link": link,
+        "image_url": absolute_image_url(image_url),
+        "price": parse_price(current_price),
+        "ordinary_price": parse_price(ordinary_price),
+        "lowest_price_30_days": parse_price(lowest_price),
+        "tags": ",".join(normalize_tags(tags)),
+        "timestamp": datetime.utcnow()
+    }
+
+class SoupListingParser:
+    """Reference implementation: BeautifulSoup with the stdlib html.parser"""
+    name = "soup"
+
+    TAG_CLASSES = re.compile(r'promo-label|ico-product|label')
+    PRICE_IDS = re.compile(r'product-price-')
+
+    def parse(self, html_content):
+        soup = BeautifulSoup(html_content, 'html.parser')
+        page_products = []
+        for product in soup.find_all('li', class_='item'):
+            try:
+                item = self._parse_item(product)
+            except Exception as e:
+                print(f"Error parsing product: {e}", flush=True)
+                PARSE_ERRORS.inc(kind="item")
+                continue
+            if item:
+                page_products.append(item)
+        return page_products
+
+    def _parse_item(self, product):
+        # Name & Link
+        title_elem = product.find('h3', class_='item-title')
+        if not title_elem: return None
+
+        link_elem = title_elem.find('a')
+        if not link_elem: return None
+
+        name = link_elem.get_text(strip=True)
+        link = link_elem.get('href', '')
+
+        # ID hints, only used when the link has no slug
+        btn = product.find('button', class_='btn-cart')
+        cart_onclick = btn.get('onclick', '') if btn else ''
+        price_ids = [p['id'] for p in product.find_all(id=self.PRICE_IDS)]
+
+        # Image, handling lazy loading (data-src, data-original)
+        img_elem = product.find('img')
+        image_url = None
+        if img_elem:
+            image_url = img_elem.get('data-src') or img_elem.get('data-original') or img_elem.get('src')
+
+        # Prices
+        current_price = lowest_price = ordinary_price = None
+        price_box = product.find('div', class_='price-box')
+        if price_box:
+            # Current Price
+            special_price_elem = price_box.find('p', class_='special-price')
+            if special_price_elem:
+                current_price = special_price_elem.find('span', class_='price').get_text(strip=True)
+            else:
+                regular_price_elem = price_box.find('span', class_='regular-price')
+                if regular_price_elem:
+                    current_price = regular_price_elem.find('span', class_='price').get_text(strip=True)
+
+            # Lowest Price (Comparative)
+            prev_price_elem = price_box.find('p', class_='previous-price')
+            if prev_price_elem:
+                lowest_price = prev_price_elem.find('span', class_='price').get_text(strip=True)
+
+            # Old/Ordinary Price
+            old_price_elem = price_box.find('p', class_='old-price')
+            if old_price_elem:
+                ordinary_price = old_price_elem.find('span', class_='price').get_text(strip=True)
+
+        # Tags
+        tags = []
+        for label in product.find_all(class_=self.TAG_CLASSES):
+            txt = label.get_text(strip=True)
+            if txt: tags.append(txt)
+
+        return build_product(name, link, cart_onclick, price_ids, image_url,
+                             current_price, ordinary_price, lowest_price, tags)
+
+class SelectolaxListingParser:
+    """
+    Same extraction with CSS selectors on selectolax's Lexbor parser.
+    Must produce exactly the same dicts as SoupListingParser, see
+    benchmarks/bench_parsers.py.
+    """
+    name = "selectolax"
+
+    # Same matches as the soup class regex: a substring of the class attribute.
+    # :is() rather than a selector list, which returns a node once per matching selector.
+    TAG_SELECTOR = ':is([class*="promo-label"], [class*="ico-product"], [class*="label"])'
+
+    @staticmethod
+    def _text(node):
+        # get_text(strip=True): every text node stripped, joined without separator
+        return node.text(deep=True, separator='', strip=True)
+
+    @staticmethod
+    def _descendants(node, selector):
+        # Unlike bs4's find_all, css() also matches the node itself
+        return [n for n in node.css(selector) if n.mem_id != node.mem_id]
+
+    def parse(self, html_content):
+        tree = LexborHTMLParser(html_content)
+        page_products = []
+        for product in tree.css('li.item'):
+            try:
+                item = self._parse_item(product)
+            except Exception as e:
+                print(f"Error parsing product: {e}", flush=True)
+                PARSE_ERRORS.inc(kind="item")
+                continue
+            if item:
+                page_products.append(item)
+        return page_products
+
+    def _parse_item(self, product):
+        text = self._text
+
+        title_elem = product.css_first('h3.item-title')
+        if not title_elem: return None
+
+        link_elem = title_elem.css_first('a')
+        if not link_elem: return None
+
+        name = text(link_elem)
+        link = link_elem.attributes.get('href') or ''
+
+        btn = product.css_first('button.btn-cart')
+        cart_onclick = (btn.attributes.get('onclick') or '') if btn else ''
+        price_ids = [p.attributes['id'] for p in self._descendants(product, '[id*="product-price-"]')]
+
+        img_elem = product.css_first('img')
+        image_url = None
+        if img_elem:
+            attrs = img_elem.attributes
+            image_url = attrs.get('data-src') or attrs.get('data-original') or attrs.get('src')
+
+        current_price = lowest_price = ordinary_price = None
+        price_box = product.css_first('div.price-box')
+        if price_box:
+            special_price_elem = price_box.css_first('p.special-price')
+            if special_price_elem:
+                current_price = text(special_price_elem.css_first('span.price'))
+            else:
+                regular_price_elem = price_box.css_first('span.regular-price')
+                if regular_price_elem:
+                    current_price = text(regular_price_elem.css_first('span.price'))
+
+            prev_price_elem = price_box.css_first('p.previous-price')
+            if prev_price_elem:
+                lowest_price = text(prev_price_elem.css_first('span.price'))
+
+            old_price_elem = price_box.css_first('p.old-price')
+            if old_price_elem:
+                ordinary_price = text(old_price_elem.css_first('span.price'))
+
+        tags = []
+        for label in self._descendants(product, self.TAG_SELECTOR):
+            txt = text(label)
+            if txt: tags.append(txt)
+
+        return build_product(name, link, cart_onclick, price_ids, image_url,
+                             current_price, ordinary_price, lowest_price, tags)
+
+PARSERS = {
+    "soup": SoupListingParser,
+    "selectolax": SelectolaxListingParser,
+}
+
+def get_parser(name=None):
+    name = name or SCRAPER_PARSER
+    if name == "auto":
+        name = "selectolax" if LexborHTMLParser is not None else "soup"
+    if name not in PARSERS:
+        raise ValueError(f"Unknown listing parser '{name}', expected one of {sorted(PARSERS)} or 'auto'")
+    if name == "selectolax" and LexborHTMLParser is None:
+        raise ImportError("SCRAPER_PARSER=selectolax but selectolax is not installed")
+    return PARSERS[name]()
+
+_default_parser = None
+
+def parse_product_list(html_content, parser=None):
+    """Extract the product dicts from one listing page's HTML"""
+    global _default_parser
+    if parser is None:
+        if _default_parser is None:
+            _default_parser = get_parser()
+        parser = _default_parser
+    return parser.parse(html_content)
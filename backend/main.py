@@ -1,356 +1,787 @@
-from fastapi import FastAPI, HTTPException, Depends, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Depends, BackgroundTasks, Query, Request, Response
 from sqlmodel import Session, select
-from typing import List, Optional
-from database import create_db_and_tables, get_session, verify_db_persistence, engine
-from models import Product, PriceHistory, ProductRead
-from scraper import scrape_category_page, BlockingError
-from analytics import calculate_convenience_score
+from sqlalchemy import insert, update
+from typing import List, Literal, Optional
+from database import create_db_and_tables, get_session, verify_db_persistence, engine, read_engine
+from models import (
+    Product, PriceHistory, ProductStats, ProductRead, ProductSearchHit, ProductChanges, ProductDeletion, HistoryPoint,
+)
+from scraper import scrape_category_page, normalize_slug, BlockingError
+from listing_parsers import normalize_tags
+from async_crawler import crawl_categories
+from pipeline import ScrapePipeline
+from scoring import score_catalog
+from product_stats import apply_readings, stats_upsert_statement
+from history_store import load_history, load_chart_series, compact_forever, extend_runs, HISTORY_STORAGE
+from tags import encode_readings, sync_product_tags
+from search import search_products, highlight
+from changes import stamp_changes, changes_since, CHANGES_DEFAULT_LIMIT
+from events import broker, publish_page_events, stream as event_stream
+from migrations import run_migrations
+from pacing import pacer
+from crawl_state import start_or_resume_run, record_page, finish_category, stop_run, crawl_status
+from export_to_csv import iter_export
+from response_cache import ResponseCacheMiddleware, bump_generation
+from metrics import (
+    REGISTRY, CONTENT_TYPE, MetricsMiddleware, SCRAPE_CYCLES,
+    SAVE_BATCH_SECONDS, SAVED_ITEMS, SCORING_SECONDS, SCORED_PRODUCTS,
+)
 from datetime import datetime
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
+from fastapi.responses import StreamingResponse
 import os
+import json
+import base64
+import math
 
-from threading import Thread
+from threading import Thread, Lock
 import time
 
 app = FastAPI(title="Bernabei Price Tracker")
 
+# Added first so it runs inside CORS and cached responses still get CORS headers
+app.add_middleware(ResponseCacheMiddleware, engine=read_engine)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
 
+# Outermost: times every request, cache hits and CORS preflights included
+app.add_middleware(MetricsMiddleware)
+
 # Function to run scraping in an infinite loop
 def scrape_forever():
-    current_cat_idx = 0
-    current_page = 1
-    
+    # Progress lives in crawl_run/crawl_checkpoint: every job (also after a
+    # restart) resumes the unfinished run where it stopped
     while True:
+        # Also finishes a cooldown interrupted by a restart
+        _cool_down(pacer.cooldown_remaining())
         try:
-            print(f"Starting scraping cycle from Category Index {current_cat_idx}, Page {current_page}...", flush=True)
-            run_scrape_job(start_category_idx=current_cat_idx, start_page=current_page)
-            print("Scraping cycle finished. Restarting in 60 seconds...", flush=True)
-            
-            # Reset state on successful completion
-            current_cat_idx = 0
-            current_page = 1
+            if run_scrape_job():
+                print("Scraping cycle finished. Restarting in 60 seconds...", flush=True)
+                SCRAPE_CYCLES.inc(result="completed")
             
         except BlockingError as e:
             print(f"Scraper blocked at Category Index {getattr(e, 'category_index', 0)}, Page {e.page_number}!", flush=True)
-            print("Sleeping for 30 minutes before resuming...", flush=True)
-            
-            # Save state to resume later
-            current_cat_idx = getattr(e, 'category_index', 0)
-            current_page = e.page_number
-            
-            time.sleep(1800)
+            SCRAPE_CYCLES.inc(result="blocked")
+            # Adaptive: longer after consecutive blocks, shorter after healthy crawling
+            pacer.start_cooldown()
             continue
         except Exception as e:
             print(f"Error in scraping loop: {e}", flush=True)
+            SCRAPE_CYCLES.inc(result="error")
         
         # Wait a bit before restarting to avoid hammering if job crashes immediately
         time.sleep(60)
 
-def ensure_convenience_score_column():
-    """Manually add column if missing because SQLModel create_all doesn't alter existing tables"""
-    from sqlalchemy import text
-    with Session(engine) as session:
-        try:
-            # Try selecting the column to see if it exists
-            session.exec(text("SELECT convenience_score FROM product LIMIT 1"))
-        except Exception:
-            print("Adding missing 'convenience_score' column to product table...", flush=True)
-            try:
-                session.exec(text("ALTER TABLE product ADD COLUMN convenience_score FLOAT"))
-                session.commit()
-            except Exception as e:
-                print(f"Error adding column: {e}", flush=True)
+def _cool_down(seconds):
+    if seconds <= 0:
+        return
+    print(f"Cooling down for {seconds / 60:.1f} minutes before resuming...", flush=True)
+    time.sleep(seconds)
+    pacer.end_cooldown()
 
 @app.on_event("startup")
 def on_startup():
     create_db_and_tables()
     verify_db_persistence()
-    ensure_convenience_score_column()
+    # Columns and indexes create_all can't add to existing tables
+    run_migrations(engine)
+    # Pacing state (delay, cooldown) carries over from before the restart
+    pacer.attach(engine)
     
     # Initialize Continuous Scraper in Background Thread
     scraper_thread = Thread(target=scrape_forever, daemon=True)
     scraper_thread.start()
     print("Continuous scraper thread started.", flush=True)
 
+    # Roll old raw readings up into pricehistory_daily in the background
+    compactor_thread = Thread(target=compact_forever, args=(engine,), daemon=True)
+    compactor_thread.start()
+
 
 @app.post("/scrape")
 def scrape_products(background_tasks: BackgroundTasks):
+    if scrape_lock.locked():
+        raise HTTPException(status_code=409, detail="A scraping job is already running")
+    # A manual trigger must not cut short the backoff after a block
+    remaining = math.ceil(pacer.cooldown_remaining())
+    if remaining > 0:
+        raise HTTPException(
+            status_code=429,
+            detail=f"Scraper is cooling down after a block, retry in {remaining} seconds",
+            headers={"Retry-After": str(remaining)},
+        )
     background_tasks.add_task(run_scrape_job)
     return {"message": "Scraping job started in background"}
 
+@app.get("/scrape/pacing")
+def get_scrape_pacing():
+    # Adaptive delay/cooldown controller state (see pacing.py)
+    return pacer.snapshot()
+
+@app.get("/scrape/status")
+def get_scrape_status(session: Session = Depends(get_session)):
+    # Latest crawl run, per-category checkpoints and ETA (see crawl_state.py)
+    return dict(crawl_status(session), job_running=scrape_lock.locked())
+
+@app.get("/scrape/pipeline")
+def get_scrape_pipeline():
+    # Queue depths and per-stage timings of the fetch/parse/write pipeline
+    return scrape_pipeline.stats()
+
+@app.get("/metrics")
+def get_metrics():
+    # Prometheus text format, see metrics.py for the metric definitions
+    return Response(content=REGISTRY.render(), media_type=CONTENT_TYPE)
+
+@app.get("/events")
+async def get_events(request: Request):
+    # Server-Sent Events: product_created, price_changed, all_time_low, score_updated (see events.py)
+    subscriber = broker.subscribe()
+
+    async def body():
+        try:
+            async for chunk in event_stream(subscriber, request.is_disconnected):
+                yield chunk
+        finally:
+            broker.unsubscribe(subscriber)
+
+    return StreamingResponse(
+        body(), media_type="text/event-stream",
+        # No caching or proxy buffering: events must reach the client as they're published
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 # Helper function to save a batch of products to DB
 # This is called by the scraper after each page
-def save_products_to_db(products_data: List[dict]):
+def _bulk_execute(session, statement, rows, label_key=None, returning=False):
+    """
+    Run an ORM bulk INSERT/UPDATE for a list of rows inside a savepoint.
+    If the batch fails, retry row by row (one savepoint each) so a single bad
+    row doesn't take down the whole page. Returns the rows that were written;
+    with returning=True the new primary key is stored in row["id"].
+    """
+    if not rows:
+        return []
+    try:
+        with session.begin_nested():
+            if returning:
+                ids = session.scalars(statement, rows).all()
+                for row, new_id in zip(rows, ids):
+                    row["id"] = new_id
+            else:
+                session.execute(statement, rows)
+        return rows
+    except Exception as e:
+        print(f"Bulk write failed ({e}), retrying row by row...", flush=True)
+
+    written = []
+    for row in rows:
+        try:
+            with session.begin_nested():
+                if returning:
+                    row["id"] = session.scalars(statement, [row]).one()
+                else:
+                    session.execute(statement, [row])
+            written.append(row)
+        except Exception as e:
+            print(f"Error saving row {row.get(label_key) if label_key else ''}: {e}", flush=True)
+    return written
+
+@SAVE_BATCH_SECONDS.time()
+def save_products_to_db(products_data: List[dict], checked_at: Optional[datetime] = None):
+    """
+    Upsert one scraped page and append a PriceHistory row per item (with
+    HISTORY_STORAGE=rle, an unchanged reading extends the product's open run
+    instead, see history_store.extend_runs).
+    The whole page is resolved with one query per identity key (bernabei_code,
+    link slug, name), written with bulk statements and committed once.
+    checked_at overrides the reading time (archive replay uses the fetch time).
+    """
     if not products_data: return
-    
+    SAVED_ITEMS.inc(len(products_data))
+
+    now = checked_at or datetime.utcnow()
+
     with Session(engine) as session:
+        # 1. Resolve the whole page in bulk
+        # Identity precedence is unchanged: Bernabei Code, then canonical URL slug
+        # (prevents "soft duplicates" when ID extraction changes), then exact name.
+        # All three are indexed lookups.
+        for p_data in products_data:
+            p_data["slug"] = normalize_slug(p_data.get("product_link"))
+
+        codes = {p.get("bernabei_code") for p in products_data if p.get("bernabei_code")}
+        by_code = {}
+        if codes:
+            for p in session.exec(select(Product).where(Product.bernabei_code.in_(codes))).all():
+                by_code[p.bernabei_code] = p
+
+        # Slugs of the whole page, so we also know who owns a slug we might assign
+        by_slug = {}
+        wanted_slugs = {p["slug"] for p in products_data if p["slug"]}
+        if wanted_slugs:
+            for p in session.exec(select(Product).where(Product.slug.in_(wanted_slugs))).all():
+                by_slug[p.slug] = p
+
+        missing = [p for p in products_data if p.get("bernabei_code") not in by_code and p["slug"] not in by_slug]
+        by_name = {}
+        wanted_names = {p.get("name") for p in missing if p.get("name")}
+        if wanted_names:
+            for p in session.exec(select(Product).where(Product.name.in_(wanted_names))).all():
+                by_name.setdefault(p.name, p)
+
+        # 2. Plan product inserts/updates in memory
+        updates = {} # product id -> update row
+        previous = {} # product id -> Product as loaded, before this page's update
+        new_rows = [] # insert rows
+        new_by_key = {} # ("code"|"slug"|"name", value) -> insert row, dedupes within the page
+        readings = [] # (product id or insert row, p_data)
+
         for p_data in products_data:
             try:
-                # Improved Deduplication Logic
-                # 1. Try finding by Bernabei Code (ID)
-                statement = select(Product).where(Product.bernabei_code == p_data["bernabei_code"])
-                existing_product = session.exec(statement).first()
-                
-                # 2. If not found by ID, try finding by CLEAN URL SLUG
-                # This prevents "soft duplicates" where ID extraction fails or changes slightly
-                if not existing_product:
-                    products = session.exec(select(Product)).all()
-                    
-                    # Extract current slug
-                    current_link = p_data.get("product_link", "")
-                    current_slug = None
-                    if current_link:
-                         current_slug = current_link.split('?')[0].strip('/').split('/')[-1]
-
-                    if current_slug:
-                        # Scan existing products for same slug
-                        # This is slightly slower but safer against duplicates
-                        # Given dataset size (<10k), it's acceptable for now or we can index slug
-                        for p in products:
-                            if p.product_link:
-                                p_slug = p.product_link.split('?')[0].strip('/').split('/')[-1]
-                                if p_slug == current_slug:
-                                    existing_product = p
-                                    break
-                
-                # 3. If still not found, try by Exact Name match (fallback for no-link items)
+                slug = p_data["slug"]
+                existing_product = by_code.get(p_data.get("bernabei_code"))
+                if not existing_product and slug:
+                    existing_product = by_slug.get(slug)
                 if not existing_product and p_data.get("name"):
-                    statement = select(Product).where(Product.name == p_data.get("name"))
-                    existing_product = session.exec(statement).first()
-                
+                    existing_product = by_name.get(p_data.get("name"))
+
                 if not existing_product:
-                    existing_product = Product(
-                        bernabei_code=p_data.get("bernabei_code"),
-                        name=p_data.get("name"),
-                        product_link=p_data.get("product_link"),
-                        image_url=p_data.get("image_url"),
-                        # Category might be missing in p_data so defaulting to empty string
-                        category=p_data.get("category", ""), 
-                        current_price=p_data.get("price") or 0.0,
-                        last_checked_at=datetime.utcnow()
-                    )
-                    session.add(existing_product)
-                    session.commit()
-                    session.refresh(existing_product)
-                else:
-                    # Update existing product
-                    existing_product.last_checked_at = datetime.utcnow()
-                    
-                    # If we found it by slug/name but the incoming data has a better ID (not a hash), update ID?
-                    # Let's keep existing ID stable unless it lacks one.
-                    # Or maybe update image/price
-                    if p_data.get("image_url"): existing_product.image_url = p_data.get("image_url")
-                    
-                    current_p = p_data.get("price")
-                    if current_p is not None:
-                         existing_product.current_price = current_p
-                         
-                    # Also update link if changed (e.g. redirect)
-                    if p_data.get("product_link"):
-                        existing_product.product_link = p_data.get("product_link")
-
-                    session.add(existing_product)
-                    session.commit()
-                    session.refresh(existing_product)
-                
-                # Add Price History
-                # Add Price History Logic
-                # Rules:
-                # 1. New Product -> Add
-                # 2. No reading today -> Add
-                # 3. Price changed -> Add
-                
-                # Get last history entry
-                last_history = session.exec(
-                    select(PriceHistory)
-                    .where(PriceHistory.product_id == existing_product.id)
-                    .order_by(PriceHistory.timestamp.desc())
-                ).first()
-                
-                # User request: "vorrei conservare nel database tutte le rilevazioni"
-                # We save every reading regardless of price change or date.
-                should_add_history = True
-                
-                # if not last_history:
-                #     should_add_history = True
-                # else:
-                #     # Check price change
-                #     if last_history.price != (p_data.get("price") or 0.0):
-                #             should_add_history = True
-                #     else:
-                #         # Check if we have a reading today
-                #         last_date = last_history.timestamp.date()
-                #         today_date = datetime.utcnow().date()
-                #         if last_date != today_date:
-                #             should_add_history = True
-                
-                if should_add_history:
-                    history = PriceHistory(
-                        product_id=existing_product.id,
-                        price=p_data.get("price") or 0.0,
-                        ordinary_price=p_data.get("ordinary_price"),
-                        lowest_price_30_days=p_data.get("lowest_price_30_days"),
-                        tags=p_data.get("tags"),
-                        timestamp=datetime.utcnow()
-                    )
-                    session.add(history)
-                    session.commit()
+                    keys = [("code", p_data.get("bernabei_code")), ("slug", slug), ("name", p_data.get("name"))]
+                    keys = [k for k in keys if k[1]]
+                    row = next((new_by_key[k] for k in keys if k in new_by_key), None)
+                    if row is None:
+                        row = {
+                            "bernabei_code": p_data.get("bernabei_code"),
+                            "name": p_data.get("name"),
+                            "product_link": p_data.get("product_link"),
+                            "slug": slug,
+                            "image_url": p_data.get("image_url"),
+                            # Category might be missing in p_data so defaulting to empty string
+                            "category": p_data.get("category", ""),
+                            "current_price": p_data.get("price") or 0.0,
+                            "last_checked_at": now,
+                        }
+                        new_rows.append(row)
+                        for k in keys:
+                            new_by_key[k] = row
+                    readings.append((row, p_data))
+                    continue
+
+                # Update existing product
+                # Keep the existing ID stable, refresh image/price/link (e.g. redirect)
+                row = updates.setdefault(existing_product.id, {"id": existing_product.id})
+                previous.setdefault(existing_product.id, (existing_product.name, existing_product.current_price))
+                row["last_checked_at"] = now
+                if p_data.get("image_url"): row["image_url"] = p_data.get("image_url")
+                if p_data.get("price") is not None: row["current_price"] = p_data.get("price")
+                if p_data.get("product_link"): row["product_link"] = p_data.get("product_link")
+
+                # Follow the link's slug unless another product already owns it
+                owner = by_slug.get(slug)
+                if slug and existing_product.slug != slug and (owner is None or owner.id == existing_product.id):
+                    if existing_product.slug: by_slug.pop(existing_product.slug, None)
+                    row["slug"] = slug
+                    by_slug[slug] = existing_product
+                readings.append((existing_product.id, p_data))
             except Exception as e:
                 print(f"Error saving product {p_data.get('name')}: {e}", flush=True)
 
-def update_all_scores():
-    """Background task to update convenience scores for all products"""
-    print("Starting batch update of Convenience Scores...", flush=True)
-    try:
-        with Session(engine) as session:
-            products = session.exec(select(Product)).all()
-            count = 0
-            for p in products:
-                # Fetch history
-                history = session.exec(select(PriceHistory).where(PriceHistory.product_id == p.id)).all()
-                if not history:
+        # 3. Write everything with bulk statements
+        # Every product of the page changed (last_checked_at at least): one sequence number each
+        stamp_changes(session, new_rows + list(updates.values()))
+        inserted = _bulk_execute(
+            session,
+            insert(Product).returning(Product.id, sort_by_parameter_order=True),
+            new_rows,
+            label_key="name",
+            returning=True,
+        )
+        inserted_ids = {id(row) for row in inserted}
+
+        _bulk_execute(session, update(Product), list(updates.values()), label_key="id")
+
+        # User request: "vorrei conservare nel database tutte le rilevazioni"
+        # Every reading is kept: as its own row, or counted in a run (rle).
+        history_rows = []
+        for target, p_data in readings:
+            if isinstance(target, dict):
+                if id(target) not in inserted_ids:
                     continue
-                
-                # Convert to format expected by analytics
-                history_data = [{"timestamp": h.timestamp, "price": h.price} for h in history]
-                
-                # Calculate Score
-                current_price = p.current_price or 0.0
-                if current_price > 0:
-                    try:
-                        score = calculate_convenience_score(history_data, current_price)
-                        
-                        # Update if changed
-                        if p.convenience_score != score:
-                            p.convenience_score = score
-                            session.add(p)
-                            count += 1
-                    except Exception as loop_e:
-                        print(f"Error calculating score for {p.bernabei_code}: {loop_e}", flush=True)
+                product_id = target["id"]
+            else:
+                product_id = target
+            history_rows.append({
+                "product_id": product_id,
+                "price": p_data.get("price") or 0.0,
+                "ordinary_price": p_data.get("ordinary_price"),
+                "lowest_price_30_days": p_data.get("lowest_price_30_days"),
+                "tags": p_data.get("tags"),
+                "timestamp": now,
+                "last_seen": now,
+                "seen_count": 1,
+            })
+        # Tags go through the dictionary: tag_mask, plus the product's current tags
+        tag_ids = encode_readings(session, history_rows)
+        product_tags = {row["product_id"]: tag_ids[id(row)] for row in history_rows}
+        extensions = []
+        if HISTORY_STORAGE == "rle":
+            history_rows, run_updates, extensions = extend_runs(session, history_rows)
+            _bulk_execute(session, update(PriceHistory), run_updates, label_key="id")
+        written = _bulk_execute(session, insert(PriceHistory), history_rows, label_key="product_id")
+
+        # Keep the per-product aggregates in step, in the same transaction
+        stats_rows = apply_readings(session, written + extensions)
+        events = _page_events(session, inserted, updates, previous, stats_rows) if broker.active else None
+        _bulk_execute(session, stats_upsert_statement(), stats_rows, label_key="product_id")
+        sync_product_tags(session, product_tags)
+
+        # Invalidate cached API responses
+        bump_generation(session)
 
+        with broker.ordered():
             session.commit()
-            print(f"Convenience Scores updated for {count} products.", flush=True)
+            if events:
+                publish_page_events(*events)
+
+def _page_events(session, inserted, updates, previous, stats_rows):
+    """(new products, price changes, all-time lows) of a page for publish_page_events, before the stats upsert"""
+    old_lows = dict(session.exec(
+        select(ProductStats.product_id, ProductStats.min_price).where(ProductStats.product_id.in_(list(updates)))
+    ).all()) if updates else {}
+
+    new_products = [
+        (row["change_seq"], {"id": row["id"], "name": row["name"], "price": row["current_price"], "category": row["category"]})
+        for row in inserted
+    ]
+    price_changes = []
+    for product_id, row in updates.items():
+        name, old_price = previous[product_id]
+        new_price = row.get("current_price")
+        if new_price is not None and new_price != old_price:
+            price_changes.append((row["change_seq"], {"id": product_id, "name": name, "old_price": old_price, "new_price": new_price}))
+    all_time_lows = []
+    for stats in stats_rows:
+        product_id = stats["product_id"]
+        old_low = old_lows.get(product_id)
+        # A first reading isn't a new low
+        if product_id in updates and old_low is not None and stats["min_price"] is not None and stats["min_price"] < old_low:
+            all_time_lows.append((updates[product_id]["change_seq"], {
+                "id": product_id, "name": previous[product_id][0], "price": stats["min_price"], "previous_low": old_low,
+            }))
+    return new_products, price_changes, all_time_lows
+
+def update_all_scores(since=None):
+    """
+    Background task to update convenience scores.
+    With `since`, only products checked from that time on (i.e. touched in
+    the latest scrape cycle) are rescored.
+    """
+    print("Starting batch update of Convenience Scores...", flush=True)
+    try:
+        with SCORING_SECONDS.time():
+            count = score_catalog(engine, since=since, read_engine=read_engine)
+        SCORED_PRODUCTS.set(count)
+        print(f"Convenience Scores updated for {count} products.", flush=True)
     except Exception as e:
         print(f"Error in batch update scores: {e}", flush=True)
 
-def run_scrape_job(start_category_idx=0, start_page=1):
-    # Categories to scrape
-    categories = ["/vino-online/", "/champagne/"]
-    
-    for i, cat in enumerate(categories):
-        # Skip categories we've already done
-        if i < start_category_idx:
-            continue
-            
+# "sequential" (default): one category after the other with scrape_category_page
+# "async": all categories concurrently under one shared per-host rate budget
+SCRAPER_MODE = os.getenv("SCRAPER_MODE", "sequential")
+
+# Categories to scrape
+CATEGORIES = ["/vino-online/", "/champagne/"]
+
+# Shared by every scrape job: parse process pool + the single DB writer thread
+scrape_pipeline = ScrapePipeline()
+
+# One scrape job at a time (scrape_forever and POST /scrape share the crawl run)
+scrape_lock = Lock()
+
+def category_saver(cat, run_id=None, failed_writes=None):
+    # Define a closure to pass category info
+    # We'll create a wrapper function to inject the category
+    # failed_writes: set collecting the categories of the run with a page that failed to save
+    def save_callback_wrapper(batch, checked_at=None):
+        # Inject category into each item
+        for item in batch:
+            item['category'] = cat
         try:
-            # Determine start page for this category
-            # If we are resuming the same category where we stopped, use start_page.
-            # Otherwise (new category), start from 1.
-            current_start_page = start_page if i == start_category_idx else 1
-            
-            # Scrape logic...
-            print(f"Starting scrape for {cat} from page {current_start_page}", flush=True)
-            
-            # Define a closure or partial to pass category info if needed
-            # We'll create a wrapper function to inject the category
-            def save_callback_wrapper(batch):
-                # Inject category into each item
-                for item in batch:
-                    item['category'] = cat
-                save_products_to_db(batch)
-            
-            # Pass the callback and start_page to the scraper
-            scrape_category_page(cat, save_callback=save_callback_wrapper, start_page=current_start_page)
-            
+            save_products_to_db(batch, checked_at=checked_at)
+        except Exception:
+            if failed_writes is not None:
+                failed_writes.add(cat)
+            raise
+        if run_id is not None and not (failed_writes and cat in failed_writes):
+            # Checkpoint once the page is committed: a restart resumes after it.
+            # After a failed write the checkpoint stays on the lost page, so the
+            # resumed run fetches it again (later pages are saved twice, harmlessly).
+            record_page(engine, run_id, cat, len(batch))
+    return save_callback_wrapper
+
+def run_scrape_job():
+    """
+    One pass over CATEGORIES, resuming the unfinished crawl run if there is one
+    (see crawl_state.py). Returns False if another job is already running or
+    the pacer's cooldown isn't over.
+    Raises BlockingError when blocked; the run is left to be resumed.
+    """
+    if not scrape_lock.acquire(blocking=False):
+        print("A scraping job is already running, skipping.", flush=True)
+        return False
+    try:
+        remaining = pacer.cooldown_remaining()
+        if remaining > 0:
+            print(f"Cooling down for another {remaining / 60:.1f} minutes, skipping.", flush=True)
+            return False
+        categories = CATEGORIES
+        # Products checked after the run started are the ones touched by this cycle
+        run_id, cycle_started_at, resume_pages = start_or_resume_run(engine, categories, SCRAPER_MODE)
+        print(f"Starting crawl run {run_id} from pages {resume_pages}...", flush=True)
+        failed_writes = set()
+
+        try:
+            try:
+                _crawl(categories, resume_pages, run_id, failed_writes)
+            finally:
+                # Pages already fetched still get written, even when blocked
+                scrape_pipeline.drain()
         except BlockingError as e:
-            print(f"BlockingError in category {cat} at page {e.page_number}. Stopping job to trigger cooldown.", flush=True)
-            # Attach the current category index to the exception so the main loop knows where to resume
-            e.category_index = i
-            raise e
+            stop_run(engine, run_id, "blocked", reason=f"{e.status_code} at {categories[e.category_index]} page {e.page_number}",
+                     resume_pages=e.resume_pages, failed_writes=failed_writes)
+            raise
         except Exception as e:
-            print(f"Error scraping category {cat}: {e}", flush=True)
+            stop_run(engine, run_id, "failed", reason=str(e))
+            raise
+        if failed_writes:
+            # Left to be resumed from the first page that wasn't saved
+            for cat in categories:
+                if cat not in failed_writes:
+                    finish_category(engine, run_id, cat)
+            stop_run(engine, run_id, "failed", reason=f"page writes failed in {', '.join(sorted(failed_writes))}")
+        else:
+            stop_run(engine, run_id, "completed", reason="finished")
+    finally:
+        scrape_lock.release()
             
-    print("Scraping job completed.", flush=True)
+    stages = scrape_pipeline.stats()["stages"]
+    print("Scraping job completed. Stage averages: " + ", ".join(
+        f"{name} {s['avg_seconds']}s" for name, s in stages.items()), flush=True)
     
     # Trigger Score Update after full scrape
     try:
-        update_all_scores()
+        update_all_scores(since=cycle_started_at)
     except Exception as e:
         print(f"Failed to run score update after scrape: {e}", flush=True)
+    return True
 
-@app.get("/products", response_model=List[ProductRead])
-def get_products(session: Session = Depends(get_session)):
-    # Optimized query to avoid N+1 problem
-    # We fetch products and aggregated history stats in one go.
-    from sqlalchemy import text
-    
-    query = text("""
-    SELECT 
-        p.id, p.bernabei_code, p.name, p.product_link, p.image_url, 
-        p.category, p.current_price, p.last_checked_at, p.convenience_score,
-        MIN(h.price) as min_price,
-        AVG(h.price) as avg_price,
-        MAX(h.price) as max_price
-    FROM product p
-    LEFT JOIN pricehistory h ON p.id = h.product_id AND h.price > 0
-    GROUP BY p.id
-    """)
+def _crawl(categories, resume_pages, run_id, failed_writes):
+    # Fetch stage: the sequential or async crawler feeds scrape_pipeline
+    if SCRAPER_MODE == "async":
+        print(f"Starting async crawl of {len(resume_pages)} categories from pages {resume_pages}", flush=True)
+        try:
+            crawl_categories(categories, resume_pages, lambda cat: category_saver(cat, run_id, failed_writes), pipeline=scrape_pipeline)
+        except BlockingError as e:
+            print(f"BlockingError in category {categories[e.category_index]} at page {e.page_number}. Stopping job to trigger cooldown.", flush=True)
+            raise
+    else:
+        for i, cat in enumerate(categories):
+            if i not in resume_pages:
+                continue
+                
+            try:
+                current_start_page = resume_pages[i]
+                print(f"Starting scrape for {cat} from page {current_start_page}", flush=True)
+                
+                # Pass the callback and start_page to the scraper
+                scrape_category_page(cat, save_callback=category_saver(cat, run_id, failed_writes), start_page=current_start_page,
+                                     pipeline=scrape_pipeline)
+                
+            except BlockingError as e:
+                print(f"BlockingError in category {cat} at page {e.page_number}. Stopping job to trigger cooldown.", flush=True)
+                # Attach where to resume: this category at the blocked page, the later ones where they are
+                e.category_index = i
+                e.resume_pages = {j: page for j, page in resume_pages.items() if j > i}
+                e.resume_pages[i] = e.page_number
+                raise e
+            except Exception as e:
+                print(f"Error scraping category {cat}: {e}", flush=True)
+
+            # Checkpoint the category once its pages are all written
+            scrape_pipeline.drain()
+            if cat not in failed_writes:
+                finish_category(engine, run_id, cat)
+
+# Columns selected for every ProductRead, see _product_read()
+PRODUCT_READ_COLUMNS = """
+    p.id, p.bernabei_code, p.name, p.product_link, p.slug, p.image_url, 
+    p.category, p.current_price, p.last_checked_at, p.convenience_score,
+    s.min_price,
+    s.price_sum / NULLIF(s.price_count, 0) as avg_price,
+    s.max_price
+"""
+
+# SQL versions of the flags computed in _product_read(), used for filtering/sorting
+# COALESCE: a NULL current_price is "not lowest", so NOT ... still matches it
+IS_LOWEST_SQL = "COALESCE(p.current_price > 0 AND s.min_price IS NOT NULL AND p.current_price <= s.min_price, 0)"
+DISCOUNT_SQL = (
+    "(CASE WHEN p.current_price > 0 AND s.min_price IS NOT NULL AND s.max_price > p.current_price "
+    "THEN (s.max_price - p.current_price) * 100.0 / s.max_price ELSE 0 END)"
+)
+
+# Sort keys for /products. NULLs are mapped to a sentinel so keyset comparisons
+# work; the expressions match the keyset indexes created by migration 4 (migrations.py).
+PRODUCT_SORT_KEYS = {
+    "score": "COALESCE(p.convenience_score, -1)",
+    "price": "COALESCE(p.current_price, 0)",
+    "last_checked": "COALESCE(p.last_checked_at, '')",
+    "discount": DISCOUNT_SQL, # Computed from product_stats, not indexable
+}
+
+def _product_read(row):
+    # Unpack row
+    # Order matches PRODUCT_READ_COLUMNS
+    p_id, code, name, link, slug, img, cat, curr, last_check, score, min_p, avg_p, max_p = row[:13]
     
-    results = session.exec(query).all()
+    # Determine stats
+    is_lowest = False
+    is_price_ok = False
+    discount = 0.0
     
-    products_read = []
-    for row in results:
-        # Unpack row
-        # Order matches SELECT
-        p_id, code, name, link, img, cat, curr, last_check, score, min_p, avg_p, max_p = row
-        
-        # Determine stats
-        is_lowest = False
-        is_price_ok = False
-        discount = 0.0
+    if curr and min_p is not None:
+        if curr <= min_p:
+            is_lowest = True
         
-        if curr and min_p is not None:
-            if curr <= min_p:
-                is_lowest = True
+        if avg_p and curr < avg_p:
+            is_price_ok = True
             
-            if avg_p and curr < avg_p:
-                is_price_ok = True
-                
-            if max_p and max_p > curr:
-                discount = ((max_p - curr) / max_p) * 100
-        
-        # Build Read Model
-        p_read = ProductRead(
-            id=p_id,
-            bernabei_code=code,
-            name=name,
-            product_link=link,
-            image_url=img,
-            category=cat,
-            current_price=curr,
-            last_checked_at=last_check,
-            convenience_score=round(score, 1) if score is not None else None,
-            is_price_ok=is_price_ok,
-            is_lowest_all_time=is_lowest,
-            discount_percentage=round(discount, 0)
+        if max_p and max_p > curr:
+            # Same expression as DISCOUNT_SQL, so filters agree with what is shown
+            discount = (max_p - curr) * 100.0 / max_p
+    
+    # Build Read Model
+    return ProductRead(
+        id=p_id,
+        bernabei_code=code,
+        name=name,
+        product_link=link,
+        slug=slug,
+        image_url=img,
+        category=cat,
+        current_price=curr,
+        last_checked_at=last_check,
+        convenience_score=round(score, 1) if score is not None else None,
+        is_price_ok=is_price_ok,
+        is_lowest_all_time=is_lowest,
+        # Half up, like SQLite's ROUND() in the min_discount filter
+        discount_percentage=float(math.floor(discount + 0.5))
+    )
+
+def _encode_cursor(sort_value, product_id):
+    raw = json.dumps([sort_value, product_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def _decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        sort_value, product_id = json.loads(raw)
+        return sort_value, int(product_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+@app.get("/products", response_model=List[ProductRead])
+def get_products(
+    response: Response,
+    category: Optional[str] = None,
+    q: Optional[str] = Query(None, description="Case-insensitive substring of the product name"),
+    min_score: Optional[float] = None,
+    max_score: Optional[float] = None,
+    is_lowest_all_time: Optional[bool] = None,
+    min_discount: Optional[float] = None,
+    tag: Optional[List[str]] = Query(None, description="Tag of the latest reading (see /tags); repeat to require several"),
+    sort: Optional[Literal["score", "discount", "price", "last_checked"]] = Query(None, description="Defaults to score when paginating"),
+    order: Literal["asc", "desc"] = "desc",
+    limit: Optional[int] = Query(None, ge=1, le=500, description="Page size. Omit to get the whole catalog."),
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor header of the previous page"),
+    session: Session = Depends(get_session),
+):
+    # Price aggregates are maintained in product_stats on every write,
+    # so this never touches the history table.
+    from sqlalchemy import text
+
+    where = []
+    params = {}
+    if category is not None:
+        where.append("p.category = :category")
+        params["category"] = category
+    if q:
+        where.append("p.name LIKE :q ESCAPE '\\'")
+        params["q"] = "%" + q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+    if min_score is not None:
+        where.append("p.convenience_score >= :min_score")
+        params["min_score"] = min_score
+    if max_score is not None:
+        where.append("p.convenience_score <= :max_score")
+        params["max_score"] = max_score
+    if is_lowest_all_time is not None:
+        where.append(IS_LOWEST_SQL if is_lowest_all_time else f"NOT {IS_LOWEST_SQL}")
+    if min_discount is not None:
+        # Against the displayed (rounded) percentage: "10%" matches min_discount=10
+        where.append(f"ROUND({DISCOUNT_SQL}) >= :min_discount")
+        params["min_discount"] = min_discount
+    for i, name in enumerate(normalize_tags(tag)):
+        # Index lookups on tag.name and product_tag (tag_id, product_id), no LIKE over tags
+        where.append(
+            f"p.id IN (SELECT pt.product_id FROM product_tag pt JOIN tag t ON t.id = pt.tag_id WHERE t.name = :tag{i})"
+        )
+        params[f"tag{i}"] = name
+
+    paginated = limit is not None
+    sort_sql = PRODUCT_SORT_KEYS[sort or "score"]
+    direction = "DESC" if order == "desc" else "ASC"
+
+    if paginated and cursor:
+        # Keyset pagination: continue strictly after the last row of the previous page
+        params["cursor_value"], params["cursor_id"] = _decode_cursor(cursor)
+        comparison = "<" if order == "desc" else ">"
+        # The first term lets SQLite seek the index instead of scanning from the start
+        where.append(
+            f"{sort_sql} {comparison}= :cursor_value "
+            f"AND ({sort_sql} {comparison} :cursor_value OR p.id {comparison} :cursor_id)"
         )
-        products_read.append(p_read)
-        
-    return products_read
 
-@app.get("/products/{product_id}/history", response_model=List[PriceHistory])
-def get_product_history(product_id: int, session: Session = Depends(get_session)):
-    statement = select(PriceHistory).where(PriceHistory.product_id == product_id).order_by(PriceHistory.timestamp)
-    history = session.exec(statement).all()
-    return history
+    query = f"""
+    SELECT {PRODUCT_READ_COLUMNS}, {sort_sql} AS sort_value
+    FROM product p
+    LEFT JOIN product_stats s ON s.product_id = p.id
+    {"WHERE " + " AND ".join(where) if where else ""}
+    """
+    if paginated or sort:
+        query += f" ORDER BY sort_value {direction}, p.id {direction}"
+    else:
+        # Legacy whole-catalog response: id order, whichever index the filters pick
+        query += " ORDER BY p.id"
+    if paginated:
+        # Fetch one extra row to know whether there is a next page
+        query += " LIMIT :limit"
+        params["limit"] = limit + 1
+
+    results = session.exec(text(query).bindparams(**params)).all()
+
+    if paginated and len(results) > limit:
+        results = results[:limit]
+        last = results[-1]
+        response.headers["X-Next-Cursor"] = _encode_cursor(last[-1], last[0])
+
+    return [_product_read(row) for row in results]
+
+# Declared before /products/{product_id} so "search" isn't taken for an id
+@app.get("/products/search", response_model=List[ProductSearchHit])
+def search(
+    q: str = Query(..., description="Words of the name, slug or category; the last one matches as a prefix"),
+    category: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100),
+    session: Session = Depends(get_session),
+):
+    rows = search_products(session, PRODUCT_READ_COLUMNS, q, limit=limit, category=category)
+    return [
+        ProductSearchHit(**_product_read(row).model_dump(), rank=row[-2], snippet=highlight(row[-1]))
+        for row in rows
+    ]
+
+@app.get("/products/changes", response_model=ProductChanges)
+def get_product_changes(
+    since: int = Query(0, ge=0, description="cursor of the previous response; 0 for the whole catalog"),
+    limit: int = Query(CHANGES_DEFAULT_LIMIT, ge=1, le=5000),
+    session: Session = Depends(get_session),
+):
+    # Products changed (saved, rescored, merged into) or deleted after `since`, oldest first
+    rows, tombstones, cursor, has_more = changes_since(session, PRODUCT_READ_COLUMNS, since, limit)
+    return ProductChanges(
+        changed=[_product_read(row) for row in rows],
+        deleted=[ProductDeletion(id=product_id, merged_into=merged_into) for product_id, merged_into, _ in tombstones],
+        cursor=cursor,
+        has_more=has_more,
+    )
+
+@app.get("/tags")
+def get_tags(session: Session = Depends(get_session)):
+    """Tag dictionary with the number of products currently showing each tag"""
+    from sqlalchemy import text
+
+    rows = session.exec(text("""
+        SELECT t.id, t.name, COUNT(pt.product_id) AS products
+        FROM tag t LEFT JOIN product_tag pt ON pt.tag_id = t.id
+        GROUP BY t.id
+        ORDER BY products DESC, t.name
+    """)).all()
+    return [{"id": r[0], "name": r[1], "products": r[2]} for r in rows]
+
+def _export_response(extension, delimiter, compress):
+    filename = f"bernabei_export.{extension}" + (".gz" if compress else "")
+    if compress:
+        media_type = "application/gzip"
+    else:
+        media_type = ("text/csv" if extension == "csv" else "text/tab-separated-values") + "; charset=utf-8"
+    # Rows are streamed from the database as they are written: constant memory
+    return StreamingResponse(
+        iter_export(delimiter=delimiter, compress=compress),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+@app.get("/export.csv")
+def export_csv(gzip: bool = False):
+    # Same layout as export_to_csv.py: semicolons and comma decimals (IT locale)
+    return _export_response("csv", ";", gzip)
+
+@app.get("/export.tsv")
+def export_tsv(gzip: bool = False):
+    return _export_response("tsv", "\t", gzip)
+
+@app.get("/products/{product_id}/history", response_model=List[HistoryPoint])
+def get_product_history(
+    product_id: int,
+    resolution: Literal["raw", "daily"] = "raw",
+    expand: bool = Query(False, description="One point per reading instead of one per run (HISTORY_STORAGE=rle)"),
+    session: Session = Depends(get_session),
+):
+    # Merges recent raw readings with the compacted daily rollup
+    return load_history(session, product_id, resolution=resolution, expand=expand)
+
+# Product ids per /history request
+MAX_HISTORY_IDS = 100
+
+@app.get("/history")
+def get_histories(
+    ids: str = Query(..., description="Comma-separated product ids, e.g. 1,2,3"),
+    points: int = Query(300, ge=3, le=5000, description="Max points per product, downsampled with LTTB"),
+    session: Session = Depends(get_session),
+):
+    """
+    Chart series of several products in one round trip, as columns:
+    {"points": 300, "products": {"1": {"timestamps": [epoch ms], "prices": [...], "ordinary_prices": [...], "total_points": n}}}
+    Unknown ids and products without history get empty columns.
+    """
+    try:
+        product_ids = list(dict.fromkeys(int(i) for i in ids.split(",") if i.strip()))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="ids must be comma-separated integers")
+    if not product_ids:
+        raise HTTPException(status_code=400, detail="ids is empty")
+    if len(product_ids) > MAX_HISTORY_IDS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_HISTORY_IDS} ids per request")
+    series = load_chart_series(session, product_ids, points=points)
+    return {"points": points, "products": {str(product_id): columns for product_id, columns in series.items()}}
 
 @app.get("/products/{product_id}", response_model=Product)
 def get_product_details(product_id: int, session: Session = Depends(get_session)):
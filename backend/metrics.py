@@ -0,0 +1,241 @@
+"""
+In-process metrics registry (counters, gauges, histograms) served on /metrics
+in the Prometheus text exposition format (version 0.0.4), without the
+prometheus_client dependency.
+
+Every metric the app exports is declared at the bottom of this module, so the
+names and labels are documented in one place. Values live in the API process:
+the parse pool processes don't report here directly (see pipeline.py).
+"""
+import contextlib
+import math
+import threading
+import time
+
+from starlette.middleware.base import BaseHTTPMiddleware
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; from a fast indexed query to a slow page fetch through a proxy
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if value == -math.inf:
+        return "-Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        (REGISTRY if registry is None else registry).register(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {_escape(self.documentation)}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._samples(key, value))
+        return lines
+
+    def _samples(self, key, value):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"]
+
+class Counter(_Metric):
+    """Monotonic count, e.g. pages fetched. Names end in _total."""
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        if amount < 0:
+            raise ValueError("counters can only increase")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+class Gauge(_Metric):
+    """Value that goes up and down, e.g. cooldown state"""
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+class Histogram(_Metric):
+    """Distribution of observations (durations, sizes) in cumulative buckets"""
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=None):
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        super().__init__(name, documentation, labelnames, registry)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["counts"][i] += 1
+                    break
+            state["sum"] += value
+            state["count"] += 1
+
+    def time(self, **labels):
+        """Context manager / decorator observing the elapsed seconds"""
+        return _Timer(self, labels)
+
+    def count(self, **labels):
+        with self._lock:
+            state = self._values.get(self._key(labels))
+            return state["count"] if state else 0
+
+    def _samples(self, key, state):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, state["counts"]):
+            cumulative += count
+            le = _format_labels(self.labelnames, key, [("le", _format_value(float(bound)))])
+            lines.append(f"{self.name}_bucket{le} {cumulative}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(state['sum'])}")
+        lines.append(f"{self.name}_count{labels} {state['count']}")
+        return lines
+
+class _Timer(contextlib.ContextDecorator):
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def _recreate_cm(self):
+        # Used as a decorator, each call gets its own timer: concurrent calls don't share _start
+        return _Timer(self.histogram, self.labels)
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self._start, **self.labels)
+        return False
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+
+    def render(self):
+        """All metrics in the Prometheus text format"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+class MetricsMiddleware(BaseHTTPMiddleware):
+    """
+    Request count and latency per endpoint. Endpoints are labelled with their
+    route template (/products/{product_id}), not the raw path, so the number
+    of series stays bounded. Streaming responses are timed up to their headers.
+    """
+
+    async def dispatch(self, request, call_next):
+        start = time.perf_counter()
+        status = 500
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            return response
+        finally:
+            route = request.scope.get("route")
+            endpoint = getattr(route, "path", None) or ("static" if route is not None else "unmatched")
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, method=request.method, endpoint=endpoint)
+            HTTP_REQUESTS.inc(method=request.method, endpoint=endpoint, status=status)
+
+# --- metrics exported by the app ------------------------------------------------------
+
+# Scraper (scraper.py, async_crawler.py; mode is sequential or async)
+FETCH_SECONDS = Histogram("scraper_fetch_seconds", "Duration of listing page requests", ["mode"])
+FETCH_RESPONSES = Counter(
+    "scraper_fetch_responses_total", "Listing page responses by HTTP status (error: no response)", ["mode", "status"]
+)
+PAGE_ITEMS = Histogram(
+    "scraper_page_items", "Products parsed from one listing page", buckets=(0, 1, 12, 24, 36, 47, 48, 60, 100)
+)
+PARSE_ERRORS = Counter(
+    "scraper_parse_errors_total", "Listing items (kind=item) or whole pages (kind=page) that failed to parse", ["kind"]
+)
+SCRAPE_CYCLES = Counter("scraper_cycles_total", "Scrape cycles of scrape_forever by outcome", ["result"])
+COOLDOWN_ACTIVE = Gauge("scraper_cooldown_active", "1 while the scraper is cooling down after a block")
+COOLDOWN_UNTIL = Gauge(
+    "scraper_cooldown_until_timestamp_seconds", "Unix time the current cooldown ends (0 when not cooling down)"
+)
+COOLDOWN_ACTIVE.set(0)
+COOLDOWN_UNTIL.set(0)
+PAGE_DELAY_SECONDS = Gauge("scraper_page_delay_seconds", "Current delay between two page requests (pacing.py)")
+
+# Database writes and scoring (main.py)
+SAVE_BATCH_SECONDS = Histogram("db_save_batch_seconds", "Duration of save_products_to_db for one page")
+SAVED_ITEMS = Counter("db_saved_items_total", "Products passed to save_products_to_db")
+SCORING_SECONDS = Histogram(
+    "scoring_duration_seconds", "Duration of a convenience score update",
+    buckets=(0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0),
+)
+SCORED_PRODUCTS = Gauge("scoring_last_products", "Products rescored by the last score update")
+
+# Live events (events.py)
+EVENTS_CLIENTS = Gauge("events_clients", "Clients connected to /events")
+EVENTS_PUBLISHED = Counter("events_published_total", "Events published to /events by type", ["type"])
+EVENTS_DROPPED_CLIENTS = Counter("events_dropped_clients_total", "/events clients dropped for falling behind")
+EVENTS_CLIENTS.set(0)
+
+# API
+HTTP_REQUEST_SECONDS = Histogram("http_request_duration_seconds", "API request latency", ["method", "endpoint"])
+HTTP_REQUESTS = Counter("http_requests_total", "API requests by endpoint and status", ["method", "endpoint", "status"])
@@ -0,0 +1,281 @@
+"""
+Versioned schema migrations.
+
+SQLModel's create_all only creates missing tables; it never adds columns or
+indexes to existing ones. Every such change is a numbered migration here,
+applied once per database and recorded in the schema_version table.
+
+Migrations run at API startup and from the CLI:
+    python migrations.py            # apply pending migrations
+    python migrations.py status     # applied / pending versions
+    python migrations.py verify     # EXPLAIN QUERY PLAN checks, exit 1 on failure
+
+Each migration can list `checks`: (query, index) pairs asserting that SQLite's
+plan for a real query pattern searches the given index (and doesn't sort in a
+temp b-tree). `verify` runs them against the live database.
+"""
+import sys
+from datetime import datetime
+
+from sqlalchemy import text, update
+from sqlmodel import Session, select
+
+from models import Product
+from listing_parsers import normalize_slug
+from product_stats import rebuild_product_stats
+from tags import backfill_tags
+from search import create_product_fts
+from changes import backfill_change_seqs
+from response_cache import bump_generation
+
+MIGRATIONS = []
+
+def migration(version, name, checks=()):
+    def register(func):
+        MIGRATIONS.append({"version": version, "name": name, "apply": func, "checks": list(checks)})
+        MIGRATIONS.sort(key=lambda m: m["version"])
+        return func
+    return register
+
+def _has_column(session, table, column):
+    return any(row[1] == column for row in session.exec(text(f"PRAGMA table_info({table})")).all())
+
+@migration(1, "product.convenience_score column")
+def add_convenience_score_column(session):
+    if not _has_column(session, "product", "convenience_score"):
+        print("Adding missing 'convenience_score' column to product table...", flush=True)
+        session.exec(text("ALTER TABLE product ADD COLUMN convenience_score FLOAT"))
+
+@migration(2, "product.slug column, unique index and backfill")
+def add_product_slug_column(session):
+    if not _has_column(session, "product", "slug"):
+        print("Adding missing 'slug' column to product table...", flush=True)
+        session.exec(text("ALTER TABLE product ADD COLUMN slug VARCHAR"))
+    session.exec(text("CREATE UNIQUE INDEX IF NOT EXISTS ix_product_slug ON product (slug)"))
+    backfill_product_slugs(session)
+
+def backfill_product_slugs(session):
+    """
+    Fill Product.slug for rows that don't have one yet.
+    When several legacy rows share a slug only the preferred one gets it
+    (real code over gen_ hash, then most recently checked); the others keep
+    NULL until consolidate_db.py merges them.
+    """
+    rows = session.exec(
+        select(Product.id, Product.bernabei_code, Product.product_link, Product.last_checked_at)
+        .where(Product.slug == None)
+    ).all()
+    if not rows:
+        return 0
+
+    candidates = {}
+    for p_id, code, link, last_checked in rows:
+        slug = normalize_slug(link)
+        if slug:
+            candidates.setdefault(slug, []).append((not (code or "").startswith(("gen_", "unknown_")), last_checked or datetime.min, p_id))
+
+    taken = set(session.exec(select(Product.slug).where(Product.slug != None)).all())
+    assignments = [
+        {"id": max(group)[2], "slug": slug}
+        for slug, group in candidates.items() if slug not in taken
+    ]
+    for i in range(0, len(assignments), 500):
+        session.execute(update(Product), assignments[i:i + 500])
+    print(f"Backfilled slug for {len(assignments)} products ({len(rows) - len(assignments)} left for consolidation).", flush=True)
+    return len(assignments)
+
+@migration(3, "populate product_stats from existing history")
+def populate_product_stats(session):
+    has_stats = session.exec(text("SELECT 1 FROM product_stats LIMIT 1")).first()
+    has_history = session.exec(text("SELECT 1 FROM pricehistory LIMIT 1")).first()
+    if has_history and not has_stats:
+        print("Building product_stats from price history...", flush=True)
+        # Databases from before migration 7 have no run columns yet
+        rebuild_product_stats(session, run_columns=_has_column(session, "pricehistory", "seen_count"))
+
+# /products keyset sorts (see PRODUCT_SORT_KEYS in main.py)
+PRODUCTS_BY_SCORE = "SELECT p.id FROM product p ORDER BY COALESCE(p.convenience_score, -1) DESC, p.id DESC LIMIT 50"
+PRODUCTS_BY_CATEGORY_SCORE = (
+    "SELECT p.id FROM product p LEFT JOIN product_stats s ON s.product_id = p.id "
+    "WHERE p.category = '/vino-online/' "
+    "AND COALESCE(p.convenience_score, -1) <= 5 AND (COALESCE(p.convenience_score, -1) < 5 OR p.id < 100) "
+    "ORDER BY COALESCE(p.convenience_score, -1) DESC, p.id DESC LIMIT 50"
+)
+PRODUCTS_BY_PRICE = "SELECT p.id FROM product p ORDER BY COALESCE(p.current_price, 0) ASC, p.id ASC LIMIT 50"
+PRODUCTS_BY_LAST_CHECKED = (
+    "SELECT p.id FROM product p "
+    "WHERE COALESCE(p.last_checked_at, '') <= '2024-01-01 00:00:00.000000' "
+    "AND (COALESCE(p.last_checked_at, '') < '2024-01-01 00:00:00.000000' OR p.id < 100) "
+    "ORDER BY COALESCE(p.last_checked_at, '') DESC, p.id DESC LIMIT 50"
+)
+
+@migration(4, "product keyset indexes", checks=[
+    (PRODUCTS_BY_SCORE, "ix_product_score_keyset"),
+    (PRODUCTS_BY_CATEGORY_SCORE, "ix_product_category_score_keyset"),
+    (PRODUCTS_BY_PRICE, "ix_product_price_keyset"),
+    (PRODUCTS_BY_LAST_CHECKED, "ix_product_last_checked_keyset"),
+])
+def add_product_keyset_indexes(session):
+    for ddl in [
+        "CREATE INDEX IF NOT EXISTS ix_product_score_keyset ON product (COALESCE(convenience_score, -1), id)",
+        "CREATE INDEX IF NOT EXISTS ix_product_category_score_keyset ON product (category, COALESCE(convenience_score, -1), id)",
+        "CREATE INDEX IF NOT EXISTS ix_product_price_keyset ON product (COALESCE(current_price, 0), id)",
+        "CREATE INDEX IF NOT EXISTS ix_product_last_checked_keyset ON product (COALESCE(last_checked_at, ''), id)",
+    ]:
+        session.exec(text(ddl))
+
+# History of one product in time order (history API, "last reading" lookups,
+# exports) and the compactor's per-product range deletes
+HISTORY_BY_PRODUCT = "SELECT id, price, timestamp FROM pricehistory WHERE product_id = 1 ORDER BY timestamp"
+LAST_READING = "SELECT price FROM pricehistory WHERE product_id = 1 ORDER BY timestamp DESC LIMIT 1"
+HISTORY_BEFORE_CUTOFF = (
+    "SELECT id FROM pricehistory WHERE product_id IN (SELECT value FROM json_each('[1,2,3]')) "
+    "AND timestamp < '2024-01-01 00:00:00.000000'"
+)
+
+@migration(5, "pricehistory (product_id, timestamp) index", checks=[
+    (HISTORY_BY_PRODUCT, "ix_pricehistory_product_timestamp"),
+    (LAST_READING, "ix_pricehistory_product_timestamp"),
+    (HISTORY_BEFORE_CUTOFF, "ix_pricehistory_product_timestamp"),
+])
+def add_pricehistory_product_timestamp_index(session):
+    session.exec(text(
+        "CREATE INDEX IF NOT EXISTS ix_pricehistory_product_timestamp ON pricehistory (product_id, timestamp)"
+    ))
+
+# Products touched since the start of a scrape cycle (score_catalog(since=...))
+PRODUCTS_CHECKED_SINCE = "SELECT p.id FROM product p WHERE p.last_checked_at >= '2024-01-01 00:00:00.000000'"
+
+@migration(6, "product.last_checked_at index", checks=[
+    (PRODUCTS_CHECKED_SINCE, "ix_product_last_checked_at"),
+])
+def add_product_last_checked_index(session):
+    session.exec(text("CREATE INDEX IF NOT EXISTS ix_product_last_checked_at ON product (last_checked_at)"))
+
+@migration(7, "pricehistory.last_seen and seen_count columns (run-length encoded history)")
+def add_pricehistory_run_columns(session):
+    # Existing rows are single readings: NULL last_seen reads as timestamp
+    if not _has_column(session, "pricehistory", "last_seen"):
+        session.exec(text("ALTER TABLE pricehistory ADD COLUMN last_seen DATETIME"))
+    if not _has_column(session, "pricehistory", "seen_count"):
+        session.exec(text("ALTER TABLE pricehistory ADD COLUMN seen_count INTEGER NOT NULL DEFAULT 1"))
+
+# /products?tag= (see main.get_products)
+PRODUCTS_WITH_TAG = "SELECT p.id FROM product p WHERE p.id IN (SELECT product_id FROM product_tag WHERE tag_id = 1)"
+
+@migration(8, "tag dictionary, pricehistory.tag_mask and product_tag backfill", checks=[
+    (PRODUCTS_WITH_TAG, "ix_product_tag_tag_product"),
+])
+def add_tag_dictionary(session):
+    if not _has_column(session, "pricehistory", "tag_mask"):
+        session.exec(text("ALTER TABLE pricehistory ADD COLUMN tag_mask INTEGER NOT NULL DEFAULT 0"))
+    session.exec(text("CREATE INDEX IF NOT EXISTS ix_product_tag_tag_product ON product_tag (tag_id, product_id)"))
+    converted = backfill_tags(session)
+    print(f"Moved the tags of {converted} readings into the tag dictionary.", flush=True)
+
+@migration(9, "product_fts full-text index and sync triggers")
+def add_product_fts(session):
+    create_product_fts(session)
+
+# /products/changes (see changes.changes_since)
+PRODUCTS_CHANGED_SINCE = "SELECT p.id FROM product p WHERE p.change_seq > 100 ORDER BY p.change_seq LIMIT 1000"
+
+@migration(10, "product.change_seq column and change feed backfill", checks=[
+    (PRODUCTS_CHANGED_SINCE, "ix_product_change_seq"),
+])
+def add_product_change_seq(session):
+    if not _has_column(session, "product", "change_seq"):
+        session.exec(text("ALTER TABLE product ADD COLUMN change_seq INTEGER NOT NULL DEFAULT 0"))
+    session.exec(text("CREATE INDEX IF NOT EXISTS ix_product_change_seq ON product (change_seq)"))
+    # Existing products are the feed's starting point: since=0 returns them all
+    count = backfill_change_seqs(session)
+    print(f"Numbered {count} existing products for the change feed.", flush=True)
+
+def ensure_schema_version_table(session):
+    session.exec(text(
+        "CREATE TABLE IF NOT EXISTS schema_version ("
+        "version INTEGER PRIMARY KEY, name TEXT NOT NULL, applied_at TEXT NOT NULL)"
+    ))
+    session.commit()
+
+def applied_versions(session):
+    ensure_schema_version_table(session)
+    return {row[0] for row in session.exec(text("SELECT version FROM schema_version")).all()}
+
+def run_migrations(engine):
+    """Apply pending migrations in order, each in its own transaction. Returns the versions applied."""
+    applied = []
+    with Session(engine) as session:
+        done = applied_versions(session)
+        for m in MIGRATIONS:
+            if m["version"] in done:
+                continue
+            print(f"Applying migration {m['version']}: {m['name']}...", flush=True)
+            try:
+                m["apply"](session)
+                # Backfills can change API output
+                bump_generation(session)
+                session.exec(text(
+                    "INSERT INTO schema_version (version, name, applied_at) VALUES (:v, :n, :t)"
+                ).bindparams(v=m["version"], n=m["name"], t=datetime.utcnow().isoformat()))
+                session.commit()
+            except Exception:
+                session.rollback()
+                print(f"Migration {m['version']} failed, schema left at the previous version.", flush=True)
+                raise
+            applied.append(m["version"])
+    return applied
+
+def explain(session, query):
+    """EXPLAIN QUERY PLAN details of a query, one string per plan step"""
+    return [row[-1] for row in session.exec(text(f"EXPLAIN QUERY PLAN {query}")).all()]
+
+def check_plan(session, query, index):
+    """(ok, plan): the plan searches `index` and needs no temp b-tree sort"""
+    plan = explain(session, query)
+    # "SEARCH ... USING [COVERING] INDEX ix" or an ordered "SCAN ... USING INDEX ix"
+    uses_index = any(f"INDEX {index}" in step for step in plan)
+    sorts = any("TEMP B-TREE" in step for step in plan)
+    return uses_index and not sorts, plan
+
+def verify_migrations(engine):
+    """Run every applied migration's EXPLAIN checks. Returns the number of failures."""
+    failures = 0
+    with Session(engine) as session:
+        done = applied_versions(session)
+        for m in MIGRATIONS:
+            if m["version"] not in done:
+                continue
+            for query, index in m["checks"]:
+                ok, plan = check_plan(session, query, index)
+                print(f"[{'OK' if ok else 'FAIL'}] migration {m['version']} uses {index}")
+                if not ok:
+                    failures += 1
+                    print(f"    query: {query}")
+                    for step in plan:
+                        print(f"    plan:  {step}")
+    return failures
+
+if __name__ == "__main__":
+    from database import engine, create_db_and_tables
+
+    command = sys.argv[1] if len(sys.argv) > 1 else "upgrade"
+    create_db_and_tables()
+    if command == "upgrade":
+        applied = run_migrations(engine)
+        print(f"Applied {len(applied)} migration(s)." if applied else "Schema is up to date.")
+    elif command == "status":
+        with Session(engine) as session:
+            done = applied_versions(session)
+        for m in MIGRATIONS:
+            print(f"{m['version']:>3}  {'applied' if m['version'] in done else 'pending':<8} {m['name']}")
+    elif command == "verify":
+        run_migrations(engine)
+        failures = verify_migrations(engine)
+        if failures:
+            print(f"FAIL: {failures} query plan check(s) don't use their index")
+            sys.exit(1)
+        print("All query plans use their indexes.")
+    else:
+        print(__doc__)
+        sys.exit(2)
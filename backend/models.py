@@ -1,11 +1,12 @@
 from typing import Optional, List
-from datetime import datetime
+from datetime import date, datetime
 from sqlmodel import Field, SQLModel, Relationship
 
 class ProductBase(SQLModel):
     bernabei_code: str = Field(index=True, unique=True) # Unique ID from site
     name: str = Field(index=True)
     product_link: str
+    slug: Optional[str] = Field(default=None, index=True, unique=True) # Normalized link slug (identity key)
     image_url: Optional[str] = None
     category: Optional[str] = None
     current_price: Optional[float] = None
@@ -14,6 +15,8 @@ class ProductBase(SQLModel):
 
 class Product(ProductBase, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
+    # Sequence number of the product's last change, for /products/changes (see changes.py)
+    change_seq: int = Field(default=0, index=True, sa_column_kwargs={"server_default": "0"})
     price_history: List["PriceHistory"] = Relationship(back_populates="product")
 
 class ProductRead(ProductBase):
@@ -24,13 +27,178 @@ class ProductRead(ProductBase):
     discount_percentage: float = 0.0
     convenience_score: Optional[float] = None
 
+class ProductSearchHit(ProductRead):
+    """One result of /products/search"""
+    rank: float # BM25, lower is a better match
+    snippet: str # HTML-escaped name with the matched terms in <mark>...</mark>
+
+class ProductDeletion(SQLModel):
+    id: int
+    merged_into: Optional[int] = None
+
+class ProductChanges(SQLModel):
+    """One page of /products/changes"""
+    changed: List[ProductRead]
+    deleted: List[ProductDeletion]
+    cursor: int # `since` of the next request
+    has_more: bool # More changes are waiting: ask again right away
+
 class PriceHistory(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     product_id: int = Field(foreign_key="product.id")
     price: float
     ordinary_price: Optional[float] = None
     lowest_price_30_days: Optional[float] = None
-    tags: Optional[str] = None # JSON string or comma-separated
-    timestamp: datetime = Field(default_factory=datetime.utcnow)
+    # Bit (id - 1) set for each Tag with id <= 63 (see tags.py). tags is only
+    # written when a reading has a tag beyond the mask: then it's the full list.
+    tag_mask: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
+    tags: Optional[str] = None # Comma-separated
+    timestamp: datetime = Field(default_factory=datetime.utcnow) # First observation of the row
+    # Run-length encoding (HISTORY_STORAGE=rle): identical readings extend the
+    # row instead of adding one. NULL last_seen means timestamp.
+    last_seen: Optional[datetime] = None
+    seen_count: int = Field(default=1, sa_column_kwargs={"server_default": "1"})
 
     product: Product = Relationship(back_populates="price_history")
+
+class ChangeSequence(SQLModel, table=True):
+    """Last sequence number handed out to a product change or tombstone, a single row"""
+    __tablename__ = "change_sequence"
+
+    id: int = Field(default=1, primary_key=True)
+    value: int = 0
+
+class DataGeneration(SQLModel, table=True):
+    """Bumped by every write that can change API output, keys the response cache (see response_cache.py); a single row"""
+    __tablename__ = "data_generation"
+
+    id: int = Field(default=1, primary_key=True)
+    value: int = 0
+
+class ProductTombstone(SQLModel, table=True):
+    """A product deleted by consolidate_db, kept for /products/changes clients"""
+    __tablename__ = "product_tombstone"
+
+    product_id: int = Field(primary_key=True)
+    merged_into: Optional[int] = None # Product that took over its history
+    change_seq: int = Field(index=True)
+    deleted_at: datetime
+
+class Tag(SQLModel, table=True):
+    """Dictionary of the listing tags ("BEST PRICE", "-20%"...), ids are never reused"""
+    id: Optional[int] = Field(default=None, primary_key=True)
+    name: str = Field(unique=True)
+
+class ProductTag(SQLModel, table=True):
+    """Tags of each product's latest reading, for /products?tag= (index on tag_id, product_id)"""
+    __tablename__ = "product_tag"
+
+    product_id: int = Field(foreign_key="product.id", primary_key=True)
+    tag_id: int = Field(foreign_key="tag.id", primary_key=True)
+
+class ProductStats(SQLModel, table=True):
+    """Per-product price aggregates, maintained on every PriceHistory insert (see product_stats.py)"""
+    __tablename__ = "product_stats"
+
+    product_id: int = Field(foreign_key="product.id", primary_key=True)
+    # Aggregates over positive prices (0.0 means the price couldn't be read)
+    min_price: Optional[float] = None
+    max_price: Optional[float] = None
+    price_sum: float = 0.0
+    price_count: int = 0
+    # Latest reading
+    last_price: Optional[float] = None
+    last_ordinary_price: Optional[float] = None
+    lowest_price_30_days: Optional[float] = None
+    last_reading_at: Optional[datetime] = None
+
+class PriceHistoryDaily(SQLModel, table=True):
+    """
+    Rollup of compacted raw readings, one row per product per day (see history_store.py).
+    min/max/sum only cover positive prices; reading_count covers every reading.
+    """
+    __tablename__ = "pricehistory_daily"
+
+    product_id: int = Field(foreign_key="product.id", primary_key=True)
+    day: date = Field(primary_key=True)
+    min_price: Optional[float] = None
+    max_price: Optional[float] = None
+    first_price: float
+    last_price: float
+    ordinary_price: Optional[float] = None # From the day's last reading
+    lowest_price_30_days: Optional[float] = None # From the day's last reading
+    price_sum: float = 0.0
+    positive_count: int = 0
+    reading_count: int = 0
+    first_seen: datetime
+    last_seen: datetime
+
+class CrawlRun(SQLModel, table=True):
+    """
+    One scrape cycle over the categories (see crawl_state.py).
+    Resumed after blocks, errors and restarts until it completes.
+    """
+    __tablename__ = "crawl_run"
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    mode: str # SCRAPER_MODE of the run
+    status: str = Field(default="running", index=True) # running, blocked, failed, completed, abandoned
+    termination_reason: Optional[str] = None # Why the last segment stopped
+    started_at: datetime
+    updated_at: datetime
+    finished_at: Optional[datetime] = None
+    # Current segment: since the last (re)start, for the page rate
+    resumed_at: datetime
+    resume_count: int = 0
+    pages_at_resume: int = 0
+    # Saved pages and items, all categories
+    pages: int = 0
+    items: int = 0
+
+class CrawlCheckpoint(SQLModel, table=True):
+    """Progress of one category in a crawl run, updated after every saved page"""
+    __tablename__ = "crawl_checkpoint"
+
+    run_id: int = Field(foreign_key="crawl_run.id", primary_key=True)
+    category: str = Field(primary_key=True)
+    category_index: int
+    status: str = "pending" # pending, running, blocked, done
+    next_page: int = 1 # First page not saved yet: where a resume starts
+    pages: int = 0
+    items: int = 0
+    started_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+class PacingState(SQLModel, table=True):
+    """Persisted state of the scrapers' adaptive pacing controller (see pacing.py), a single row"""
+    __tablename__ = "pacing_state"
+
+    id: int = Field(default=1, primary_key=True)
+    delay_seconds: float # Current delay between two page requests
+    cooldown_seconds: float # Length of the next cooldown after a block
+    cooldown_until: Optional[datetime] = None # End of the cooldown in progress
+    latency_fast: Optional[float] = None # Fetch latency EWMAs (seconds): recent...
+    latency_baseline: Optional[float] = None # ...and long-run
+    latency_samples: int = 0
+    healthy_streak: int = 0
+    pages: int = 0
+    backoffs: int = 0
+    blocks: int = 0
+    last_signal: Optional[str] = None # Last event that changed the delay
+    last_signal_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+
+class HistoryPoint(SQLModel):
+    """One point of /products/{id}/history: a raw reading or a daily aggregate"""
+    id: Optional[int] = None # PriceHistory id, None for daily points
+    product_id: int
+    price: float
+    ordinary_price: Optional[float] = None
+    lowest_price_30_days: Optional[float] = None
+    tags: Optional[str] = None
+    timestamp: datetime
+    last_seen: Optional[datetime] = None # Last observation of a run or day
+    min_price: Optional[float] = None # Daily points only
+    max_price: Optional[float] = None
+    reading_count: int = 1 # Observations: a run's seen_count, a day's readings
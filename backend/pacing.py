@@ -0,0 +1,200 @@
+"""
+Adaptive pacing of the requests to the site (AIMD).
+
+- Every healthy page (200, JSON listing, normal latency) shortens the delay
+  between two pages by a fixed step, down to the floor.
+- A throttling signal (429/503, a latency spike, a non-JSON listing) multiplies
+  the delay, up to the ceiling.
+- A 403 does the same and starts a cooldown. Consecutive blocks double the
+  cooldown (up to its ceiling); healthy pages bring it back down.
+
+The state is shared by both crawlers, survives scrape cycles and, once
+attached to the database (pacer.attach(engine) at API startup), restarts too.
+"""
+import os
+import random
+import threading
+from datetime import datetime, timedelta
+
+from sqlmodel import Session
+
+from models import PacingState
+from metrics import PAGE_DELAY_SECONDS, COOLDOWN_ACTIVE, COOLDOWN_UNTIL
+
+# Delay between two page requests. SCRAPER_DELAY_MIN/MAX (minutes) remain the defaults.
+PACING_DELAY_FLOOR_SECONDS = float(os.getenv("PACING_DELAY_FLOOR_SECONDS", int(os.getenv("SCRAPER_DELAY_MIN", 1)) * 60))
+PACING_DELAY_CEILING_SECONDS = float(os.getenv("PACING_DELAY_CEILING_SECONDS", int(os.getenv("SCRAPER_DELAY_MAX", 5)) * 60))
+# Additive decrease per healthy page, multiplicative increase per throttling signal
+PACING_DECREASE_SECONDS = float(os.getenv("PACING_DECREASE_SECONDS", 5))
+PACING_BACKOFF_FACTOR = float(os.getenv("PACING_BACKOFF_FACTOR", 2))
+# Each delay is randomized by +/- this fraction (still within floor and ceiling)
+PACING_JITTER = float(os.getenv("PACING_JITTER", 0.2))
+# Cooldown after a block
+PACING_COOLDOWN_FLOOR_SECONDS = float(os.getenv("PACING_COOLDOWN_FLOOR_SECONDS", 600))
+PACING_COOLDOWN_CEILING_SECONDS = float(os.getenv("PACING_COOLDOWN_CEILING_SECONDS", 4 * 3600))
+# Healthy pages that halve the next cooldown
+PACING_COOLDOWN_DECAY_PAGES = int(os.getenv("PACING_COOLDOWN_DECAY_PAGES", 20))
+# A fetch slower than this many times the long-run average (and than the minimum) is a spike
+PACING_LATENCY_FACTOR = float(os.getenv("PACING_LATENCY_FACTOR", 2.5))
+PACING_LATENCY_MIN_SECONDS = float(os.getenv("PACING_LATENCY_MIN_SECONDS", 2))
+# 429/503 answers in a row on one page before giving up and cooling down
+PACING_MAX_THROTTLE_RETRIES = int(os.getenv("PACING_MAX_THROTTLE_RETRIES", 3))
+
+THROTTLE_STATUSES = (429, 503)
+
+# EWMA weights of the recent and long-run fetch latency
+FAST_ALPHA = 0.3
+SLOW_ALPHA = 0.05
+# Latency samples before spikes are detected
+MIN_LATENCY_SAMPLES = 5
+
+def _clamp(value, low, high):
+    return max(low, min(high, value))
+
+class AdaptivePacer:
+    def __init__(self, floor=None, ceiling=None):
+        self.floor = PACING_DELAY_FLOOR_SECONDS if floor is None else floor
+        self.ceiling = max(self.floor, PACING_DELAY_CEILING_SECONDS if ceiling is None else ceiling)
+        self.state = PacingState(
+            delay_seconds=(self.floor + self.ceiling) / 2,
+            cooldown_seconds=PACING_COOLDOWN_FLOOR_SECONDS,
+        )
+        self._engine = None
+        self._lock = threading.Lock()
+        PAGE_DELAY_SECONDS.set(self.state.delay_seconds)
+
+    def attach(self, engine):
+        """Load the persisted state and save every change from now on"""
+        with Session(engine) as session:
+            saved = session.get(PacingState, 1)
+        with self._lock:
+            if saved is not None:
+                self.state = saved
+                # The configured bounds may have changed since
+                self.state.delay_seconds = _clamp(saved.delay_seconds, self.floor, self.ceiling)
+                self.state.cooldown_seconds = _clamp(
+                    saved.cooldown_seconds, PACING_COOLDOWN_FLOOR_SECONDS, PACING_COOLDOWN_CEILING_SECONDS
+                )
+            self._engine = engine
+            PAGE_DELAY_SECONDS.set(self.state.delay_seconds)
+        print(f"Pacing: delay {self.state.delay_seconds:.0f}s, next cooldown {self.state.cooldown_seconds:.0f}s "
+              f"(bounds {self.floor:.0f}-{self.ceiling:.0f}s).", flush=True)
+
+    def save(self):
+        """Persist the state (no-op until attached). Blocking: keep it off the event loop."""
+        if self._engine is None:
+            return
+        with self._lock:
+            state = PacingState(**self.state.model_dump())
+        with Session(self._engine) as session:
+            session.merge(state)
+            session.commit()
+
+    # --- signals from the crawlers -------------------------------------------------
+
+    def _signal(self, name):
+        self.state.last_signal = name
+        self.state.last_signal_at = self.state.updated_at = datetime.utcnow()
+        PAGE_DELAY_SECONDS.set(self.state.delay_seconds)
+
+    def _back_off(self, reason):
+        state = self.state
+        state.delay_seconds = _clamp(state.delay_seconds * PACING_BACKOFF_FACTOR, self.floor, self.ceiling)
+        state.healthy_streak = 0
+        state.backoffs += 1
+        self._signal(reason)
+        print(f"Pacing: backing off ({reason}), delay now {state.delay_seconds:.0f}s.", flush=True)
+
+    def _observe_latency(self, seconds):
+        """True if `seconds` is a spike against the long-run average"""
+        state = self.state
+        spike = (
+            state.latency_samples >= MIN_LATENCY_SAMPLES
+            and seconds > PACING_LATENCY_MIN_SECONDS
+            and seconds > state.latency_baseline * PACING_LATENCY_FACTOR
+        )
+        state.latency_fast = seconds if state.latency_fast is None else state.latency_fast + FAST_ALPHA * (seconds - state.latency_fast)
+        state.latency_baseline = seconds if state.latency_baseline is None else state.latency_baseline + SLOW_ALPHA * (seconds - state.latency_baseline)
+        state.latency_samples += 1
+        return spike
+
+    def record_page(self, fetch_seconds, is_json=True):
+        """A page fetched with a 200"""
+        with self._lock:
+            state = self.state
+            state.pages += 1
+            spike = self._observe_latency(fetch_seconds)
+            if not is_json:
+                self._back_off("non-JSON listing")
+            elif spike:
+                self._back_off(f"latency {fetch_seconds:.1f}s")
+            else:
+                state.delay_seconds = _clamp(state.delay_seconds - PACING_DECREASE_SECONDS, self.floor, self.ceiling)
+                state.healthy_streak += 1
+                if state.healthy_streak % PACING_COOLDOWN_DECAY_PAGES == 0:
+                    state.cooldown_seconds = max(PACING_COOLDOWN_FLOOR_SECONDS, state.cooldown_seconds / PACING_BACKOFF_FACTOR)
+                self._signal("healthy")
+
+    def record_throttle(self, status):
+        with self._lock:
+            self._back_off(f"HTTP {status}")
+
+    def record_block(self, status=403):
+        with self._lock:
+            self.state.blocks += 1
+            self._back_off(f"blocked (HTTP {status})")
+
+    def next_delay(self):
+        """Seconds to wait before the next page request"""
+        with self._lock:
+            delay = self.state.delay_seconds
+        return _clamp(delay * random.uniform(1 - PACING_JITTER, 1 + PACING_JITTER), self.floor, self.ceiling)
+
+    # --- cooldown --------------------------------------------------------------------
+
+    def start_cooldown(self):
+        """Start the cooldown after a block and return its length; the next one will be longer"""
+        with self._lock:
+            state = self.state
+            seconds = state.cooldown_seconds
+            state.cooldown_until = datetime.utcnow() + timedelta(seconds=seconds)
+            state.cooldown_seconds = min(PACING_COOLDOWN_CEILING_SECONDS, seconds * PACING_BACKOFF_FACTOR)
+            self._signal("cooldown")
+        self._publish_cooldown()
+        self.save()
+        return seconds
+
+    def cooldown_remaining(self):
+        """Seconds left of the cooldown in progress (also one started before a restart)"""
+        with self._lock:
+            until = self.state.cooldown_until
+        return max(0.0, (until - datetime.utcnow()).total_seconds()) if until else 0.0
+
+    def end_cooldown(self):
+        with self._lock:
+            self.state.cooldown_until = None
+        self._publish_cooldown()
+        self.save()
+
+    def _publish_cooldown(self):
+        until = self.state.cooldown_until
+        COOLDOWN_ACTIVE.set(1 if until else 0)
+        COOLDOWN_UNTIL.set((until - datetime(1970, 1, 1)).total_seconds() if until else 0)
+
+    def snapshot(self):
+        with self._lock:
+            state = self.state.model_dump(exclude={"id"})
+        return dict(
+            state,
+            cooldown_remaining_seconds=round(self.cooldown_remaining()),
+            bounds={
+                "delay_floor_seconds": self.floor,
+                "delay_ceiling_seconds": self.ceiling,
+                "cooldown_floor_seconds": PACING_COOLDOWN_FLOOR_SECONDS,
+                "cooldown_ceiling_seconds": PACING_COOLDOWN_CEILING_SECONDS,
+            },
+            persisted=self._engine is not None,
+        )
+
+# Shared by the sequential and async crawlers
+pacer = AdaptivePacer()
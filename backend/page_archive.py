@@ -0,0 +1,175 @@
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+# Opt-in: set to a directory to keep the raw productlist HTML of every fetched page.
+# Layout:
+#   <dir>/objects/ab/cdef....html.gz   gzip'd HTML, named by the sha256 of its content
+#   <dir>/manifest.jsonl               one line per fetch: sha256, category, page, fetched_at, size
+# Identical pages (same HTML on two fetches) are stored once.
+PAGE_ARCHIVE_DIR = os.getenv("PAGE_ARCHIVE_DIR")
+
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+
+class PageArchive:
+    def __init__(self, root):
+        self.root = root
+        self.objects_dir = os.path.join(root, "objects")
+        self.manifest_path = os.path.join(root, "manifest.jsonl")
+        self._lock = threading.Lock()
+        os.makedirs(self.objects_dir, exist_ok=True)
+
+    def _object_path(self, digest):
+        return os.path.join(self.objects_dir, digest[:2], digest[2:] + ".html.gz")
+
+    def put(self, category, page, html_content, fetched_at=None):
+        """Store one fetched page, returns its content hash"""
+        fetched_at = fetched_at or datetime.utcnow()
+        data = html_content.encode("utf-8")
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._object_path(digest)
+
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write then rename, so a crash never leaves a truncated object behind
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with gzip.open(tmp_path, "wb", compresslevel=6) as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+
+        entry = {
+            "sha256": digest,
+            "category": category,
+            "page": page,
+            "fetched_at": fetched_at.strftime(TIMESTAMP_FORMAT),
+            "size": len(data),
+        }
+        with self._lock, open(self.manifest_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+        return digest
+
+    def get(self, digest):
+        with gzip.open(self._object_path(digest), "rb") as f:
+            return f.read().decode("utf-8")
+
+    def entries(self, since=None, until=None, category=None):
+        """Manifest entries in fetch order, optionally filtered"""
+        if not os.path.exists(self.manifest_path):
+            return []
+        entries = []
+        with open(self.manifest_path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Partial last line after a crash
+                    continue
+                entry["fetched_at"] = datetime.strptime(entry["fetched_at"], TIMESTAMP_FORMAT)
+                if since and entry["fetched_at"] < since:
+                    continue
+                if until and entry["fetched_at"] >= until:
+                    continue
+                if category and entry["category"] != category:
+                    continue
+                entries.append(entry)
+        entries.sort(key=lambda e: e["fetched_at"])
+        return entries
+
+archive = PageArchive(PAGE_ARCHIVE_DIR) if PAGE_ARCHIVE_DIR else None
+
+def archive_page(category, page, html_content):
+    """Called by the scrapers for every fetched page. No-op unless PAGE_ARCHIVE_DIR is set."""
+    if archive is None or not html_content:
+        return
+    try:
+        archive.put(category, page, html_content)
+    except Exception as e:
+        # Never let the archive break a crawl
+        print(f"Error archiving {category} page {page}: {e}", flush=True)
+
+def replay(page_archive, save_callback_for, since=None, until=None, category=None, parse=None):
+    """
+    Re-parse archived pages and ingest them in fetch order, without network.
+    save_callback_for(category) -> callback(page_products, checked_at), so the
+    readings keep their original fetch time.
+    Returns (pages, products).
+    """
+    if parse is None:
+        from listing_parsers import parse_product_list as parse
+
+    pages = products = 0
+    # category -> (page, product count) of the previous archived page, to apply
+    # the scrapers' count stop rule: the short last page of a run is not saved
+    last_pages = {}
+    for entry in page_archive.entries(since=since, until=until, category=category):
+        try:
+            page_products = parse(page_archive.get(entry["sha256"]))
+        except Exception as e:
+            print(f"Error re-parsing {entry['category']} page {entry['page']} ({entry['sha256'][:12]}): {e}", flush=True)
+            continue
+
+        previous = last_pages.get(entry["category"])
+        last_pages[entry["category"]] = (entry["page"], len(page_products))
+        if not page_products:
+            continue
+        if previous and previous[0] == entry["page"] - 1 and previous[1] != len(page_products):
+            continue
+        for item in page_products:
+            item["timestamp"] = entry["fetched_at"]
+        save_callback_for(entry["category"])(page_products, entry["fetched_at"])
+        pages += 1
+        products += len(page_products)
+    return pages, products
+
+def _parse_date(value):
+    return datetime.fromisoformat(value)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Raw page archive tools")
+    parser.add_argument("--dir", default=PAGE_ARCHIVE_DIR, help="archive directory (default: PAGE_ARCHIVE_DIR)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("stats", help="summary of the archive")
+    replay_parser = sub.add_parser(
+        "replay",
+        help="re-parse archived pages and ingest them into DB_PATH (use a fresh DB to rebuild history)",
+    )
+    replay_parser.add_argument("--since", type=_parse_date, help="only pages fetched from this time (ISO format)")
+    replay_parser.add_argument("--until", type=_parse_date, help="only pages fetched before this time (ISO format)")
+    replay_parser.add_argument("--category", help="only this category, e.g. /vino-online/")
+    replay_parser.add_argument("--skip-scores", action="store_true", help="don't recompute convenience scores afterwards")
+    args = parser.parse_args()
+
+    if not args.dir:
+        parser.error("no archive directory: pass --dir or set PAGE_ARCHIVE_DIR")
+    page_archive = PageArchive(args.dir)
+
+    if args.command == "stats":
+        entries = page_archive.entries()
+        unique = {e["sha256"] for e in entries}
+        print(f"{len(entries)} fetches, {len(unique)} unique pages, {sum(e['size'] for e in entries) / 1e6:.1f} MB of HTML.")
+        if entries:
+            print(f"From {entries[0]['fetched_at']} to {entries[-1]['fetched_at']}.")
+    else:
+        # Imported here: main pulls in the whole app
+        from database import create_db_and_tables, engine
+        from migrations import run_migrations
+        from main import category_saver, update_all_scores
+
+        # Same schema as the API's (sequence counter, FTS triggers, tag dictionary...)
+        create_db_and_tables()
+        run_migrations(engine)
+        start = time.time()
+        pages, products = replay(
+            page_archive, category_saver, since=args.since, until=args.until, category=args.category
+        )
+        print(f"Replayed {pages} pages ({products} products) in {time.time() - start:.1f}s.")
+        if not args.skip_scores:
+            update_all_scores()
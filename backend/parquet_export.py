@@ -0,0 +1,189 @@
+"""
+Incremental Parquet export of the raw price history, for offline analysis.
+
+Layout (hive partitioning, readable by pyarrow.dataset, pandas, DuckDB, Spark...):
+    <dir>/month=2024-05/part-<first id>-<last id>.parquet
+
+Each run exports the pricehistory rows with an id above the high-water mark
+(_export_state.json), joined with the product attributes, in chunks of
+--chunk-rows readings. New files are written as .tmp, moved into place, and
+only then is the high-water mark advanced. Leftovers of a run that died
+halfway (.tmp files, parts starting above the mark) are discarded by the next
+run, which exports those readings again.
+
+With HISTORY_STORAGE=rle a row keeps changing (last_seen, seen_count) for up
+to HISTORY_RUN_MAX_DAYS after it was opened, so only rows older than that
+are exported; newer ones are picked up by a later run.
+
+With HISTORY_RAW_RETENTION_DAYS set, run it more often than that: older raw
+readings are rolled up into pricehistory_daily by the compactor and can't be
+exported any more.
+
+Usage (from backend/):
+    python parquet_export.py [--dir DIR] [--chunk-rows 50000]
+"""
+import argparse
+import glob
+import json
+import os
+import re
+import time
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from datetime import datetime, timedelta
+from sqlalchemy import text, DateTime
+from sqlmodel import Session
+
+from database import sqlite_file_name
+from history_store import HISTORY_STORAGE, RUN_MAX_DAYS
+from tags import tags_sql
+
+# Next to the database by default, so it lands on the same (persistent) volume
+PARQUET_EXPORT_DIR = os.getenv(
+    "PARQUET_EXPORT_DIR", os.path.join(os.path.dirname(os.path.abspath(sqlite_file_name)), "history_parquet")
+)
+PARQUET_CHUNK_ROWS = int(os.getenv("PARQUET_CHUNK_ROWS", 50000))
+
+SCHEMA = pa.schema([
+    ("reading_id", pa.int64()),
+    ("product_id", pa.int64()),
+    ("timestamp", pa.timestamp("us")),
+    ("last_seen", pa.timestamp("us")),
+    ("seen_count", pa.int64()),
+    ("price", pa.float64()),
+    ("ordinary_price", pa.float64()),
+    ("lowest_price_30_days", pa.float64()),
+    ("tags", pa.string()),
+    ("bernabei_code", pa.string()),
+    ("slug", pa.string()),
+    ("name", pa.string()),
+    ("category", pa.string()),
+    ("product_link", pa.string()),
+])
+
+# Keyset over the primary key: each chunk is an index range scan
+EXPORT_CHUNK_QUERY = text(f"""
+    SELECT h.id, h.product_id, h.timestamp, COALESCE(h.last_seen, h.timestamp) AS last_seen, h.seen_count, h.price, h.ordinary_price, h.lowest_price_30_days,
+           {tags_sql("h")} AS tags,
+           p.bernabei_code, p.slug, p.name, p.category, p.product_link,
+           substr(h.timestamp, 1, 7) AS month
+    FROM pricehistory h
+    JOIN product p ON p.id = h.product_id
+    WHERE h.id > :after AND h.id < :before
+    ORDER BY h.id
+    LIMIT :n
+""").columns(timestamp=DateTime, last_seen=DateTime)
+
+# First row that may still be extended (opened less than RUN_MAX_DAYS ago), see the module docstring
+FIRST_OPEN_ROW_QUERY = text("""
+    SELECT MIN(id) FROM pricehistory WHERE id > :after AND timestamp >= :open_since
+""")
+
+PART_NAME = re.compile(r"part-(\d+)-(\d+)\.parquet$")
+
+def _state_path(export_dir):
+    return os.path.join(export_dir, "_export_state.json")
+
+def high_water_mark(export_dir):
+    """Highest pricehistory id already exported"""
+    try:
+        with open(_state_path(export_dir), encoding="utf-8") as f:
+            return json.load(f)["last_id"]
+    except FileNotFoundError:
+        return 0
+
+def _save_high_water_mark(export_dir, last_id):
+    tmp_path = _state_path(export_dir) + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"last_id": last_id}, f)
+    os.replace(tmp_path, _state_path(export_dir))
+
+def _discard_unfinished(export_dir, after):
+    for path in glob.glob(os.path.join(export_dir, "month=*", "*")):
+        m = PART_NAME.search(os.path.basename(path))
+        if path.endswith(".tmp") or (m and int(m.group(1)) > after):
+            os.remove(path)
+
+def _columns(rows):
+    # zip() drops the trailing `month` column: it's the partition directory
+    columns = list(zip(*rows))
+    return pa.Table.from_arrays([pa.array(col, type=field.type) for col, field in zip(columns, SCHEMA)], schema=SCHEMA)
+
+def export_history(engine, export_dir=None, chunk_rows=None):
+    """
+    Append the readings newer than the high-water mark. Returns (rows, files).
+    Memory is bounded by one chunk: each month's rows of a chunk become a row
+    group of that month's new part file. Readings come in id (so roughly time)
+    order: a month's writer is closed as soon as a later month shows up, and
+    the rare older reading after that (e.g. an archive replay) starts a new part.
+    """
+    export_dir = export_dir or PARQUET_EXPORT_DIR
+    chunk_rows = chunk_rows or PARQUET_CHUNK_ROWS
+    os.makedirs(export_dir, exist_ok=True)
+    after = high_water_mark(export_dir)
+    _discard_unfinished(export_dir, after)
+    # month -> {"writer", "path", "dir", "first", "last"} of the part file being written
+    open_parts = {}
+    # Closed part files, published once the whole run succeeded
+    parts = []
+    exported = 0
+
+    try:
+        with Session(engine) as session:
+            before = None
+            if HISTORY_STORAGE == "rle":
+                open_since = (datetime.utcnow() - timedelta(days=RUN_MAX_DAYS)).strftime("%Y-%m-%d %H:%M:%S.%f")
+                before = session.exec(FIRST_OPEN_ROW_QUERY.bindparams(after=after, open_since=open_since)).scalar()
+            before = before or 2**63 - 1
+            while True:
+                rows = session.exec(EXPORT_CHUNK_QUERY.bindparams(after=after, before=before, n=chunk_rows)).all()
+                if not rows:
+                    break
+
+                by_month = {}
+                for row in rows:
+                    by_month.setdefault(row[-1], []).append(row)
+                for month, month_rows in sorted(by_month.items()):
+                    for earlier in [m for m in open_parts if m < month]:
+                        part = open_parts.pop(earlier)
+                        part["writer"].close()
+                        parts.append(part)
+                    part = open_parts.get(month)
+                    if part is None:
+                        month_dir = os.path.join(export_dir, f"month={month}")
+                        os.makedirs(month_dir, exist_ok=True)
+                        path = os.path.join(month_dir, f"part-{month_rows[0][0]}.parquet.tmp")
+                        part = open_parts[month] = {
+                            "writer": pq.ParquetWriter(path, SCHEMA, compression="zstd"),
+                            "path": path, "dir": month_dir, "first": month_rows[0][0],
+                        }
+                    part["writer"].write_table(_columns(month_rows))
+                    part["last"] = month_rows[-1][0]
+
+                exported += len(rows)
+                after = rows[-1][0]
+    finally:
+        for part in open_parts.values():
+            part["writer"].close()
+            parts.append(part)
+
+    # Publish, then advance the high-water mark
+    for part in parts:
+        os.replace(part["path"], os.path.join(part["dir"], f"part-{part['first']}-{part['last']}.parquet"))
+    if exported:
+        _save_high_water_mark(export_dir, after)
+    return exported, len(parts)
+
+if __name__ == "__main__":
+    from database import read_engine
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dir", default=PARQUET_EXPORT_DIR, help="export directory (default: PARQUET_EXPORT_DIR)")
+    parser.add_argument("--chunk-rows", type=int, default=PARQUET_CHUNK_ROWS, help="readings fetched and written per chunk")
+    args = parser.parse_args()
+
+    start = time.time()
+    rows, files = export_history(read_engine, args.dir, args.chunk_rows)
+    print(f"Exported {rows} readings into {files} new part file(s) under {args.dir} in {time.time() - start:.1f}s "
+          f"(high-water mark: reading {high_water_mark(args.dir)}).")
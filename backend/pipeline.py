@@ -0,0 +1,213 @@
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from listing_parsers import parse_product_list
+from metrics import PARSE_ERRORS
+
+# Parse processes (0 parses on the calling thread, no pool)
+PIPELINE_PARSE_WORKERS = int(os.getenv("PIPELINE_PARSE_WORKERS", 2))
+# Max pages waiting for or being parsed; fetchers block beyond that
+PIPELINE_PARSE_QUEUE = int(os.getenv("PIPELINE_PARSE_QUEUE", 4))
+# Max parsed pages waiting for the DB writer; fetchers block beyond that
+PIPELINE_WRITE_QUEUE = int(os.getenv("PIPELINE_WRITE_QUEUE", 8))
+
+def _timed_parse(html_content):
+    # Runs in a pool process; time it there so queueing isn't counted.
+    # The process's own metrics aren't served: hand its item errors back.
+    errors_before = PARSE_ERRORS.value(kind="item")
+    start = time.perf_counter()
+    products = parse_product_list(html_content)
+    return products, time.perf_counter() - start, PARSE_ERRORS.value(kind="item") - errors_before
+
+class StageTimer:
+    """Count and durations of one pipeline stage"""
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.last_seconds = None
+        self._lock = threading.Lock()
+
+    def record(self, seconds, error=False):
+        with self._lock:
+            self.count += 1
+            self.errors += int(error)
+            self.total_seconds += seconds
+            self.max_seconds = max(self.max_seconds, seconds)
+            self.last_seconds = seconds
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "count": self.count,
+                "errors": self.errors,
+                "total_seconds": round(self.total_seconds, 4),
+                "avg_seconds": round(self.total_seconds / self.count, 4) if self.count else None,
+                "max_seconds": round(self.max_seconds, 4),
+                "last_seconds": round(self.last_seconds, 4) if self.last_seconds is not None else None,
+            }
+
+class ScrapePipeline:
+    """
+    Fetch -> parse -> write stages for the scrapers.
+
+    - fetch: the crawlers themselves, which report their request times
+    - parse: a process pool, so BeautifulSoup/selectolax work doesn't hold the
+      API process's GIL; at most `parse_queue` raw pages in flight. A fetcher
+      submits a page and keeps going (the sequential scraper waits out its
+      pacing delay) until it needs the page's item count. A pool broken by a
+      dead worker is replaced.
+    - write: one writer thread that applies save callbacks in order, fed by a
+      bounded queue; the only thread of the scraper that touches SQLite
+
+    Both bounds block the caller when full, so a slow stage slows the fetchers
+    down instead of piling pages up in memory.
+    """
+
+    def __init__(self, parse_workers=None, parse_queue=None, write_queue=None):
+        self.parse_workers = PIPELINE_PARSE_WORKERS if parse_workers is None else parse_workers
+        self.parse_capacity = parse_queue or PIPELINE_PARSE_QUEUE
+        self.write_capacity = write_queue or PIPELINE_WRITE_QUEUE
+        self.stages = {"fetch": StageTimer(), "parse": StageTimer(), "write": StageTimer()}
+
+        self._parse_slots = threading.BoundedSemaphore(self.parse_capacity)
+        self._parse_in_flight = 0
+        self._parse_lock = threading.Lock()
+        self._write_queue = queue.Queue(maxsize=self.write_capacity)
+        self._pool = None
+        self._writer = None
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        with self._start_lock:
+            if self._writer is not None:
+                return
+            if self.parse_workers > 0:
+                self._pool = self._new_pool()
+            self._writer = threading.Thread(target=self._write_loop, name="pipeline-writer", daemon=True)
+            self._writer.start()
+
+    def _new_pool(self):
+        # spawn: the API process has threads, forking it isn't safe
+        return ProcessPoolExecutor(max_workers=self.parse_workers, mp_context=multiprocessing.get_context("spawn"))
+
+    def _replace_pool(self, broken):
+        """New pool in place of a broken one (once, however many parses saw it break)"""
+        with self._start_lock:
+            if self._pool is broken:
+                print("Parse pool broken (worker died), starting a new one.", flush=True)
+                broken.shutdown(wait=False)
+                self._pool = self._new_pool()
+            return self._pool
+
+    def record_fetch(self, seconds, error=False):
+        self.stages["fetch"].record(seconds, error)
+
+    def submit_parse(self, html_content):
+        """
+        Queue one listing page for parsing, returns a Future of its products.
+        Blocks while `parse_queue` pages are already in flight.
+        """
+        self.start()
+        self._parse_slots.acquire()
+        with self._parse_lock:
+            self._parse_in_flight += 1
+        result = Future()
+        if self._pool is None:
+            try:
+                # Item errors already counted in this process
+                products, seconds, _ = _timed_parse(html_content)
+                self._parse_done(result, products=products, seconds=seconds)
+            except Exception as e:
+                self._parse_done(result, error=e)
+        else:
+            self._submit_to_pool(self._pool, html_content, result, retry=True)
+        return result
+
+    def _submit_to_pool(self, pool, html_content, result, retry):
+        def on_done(future):
+            try:
+                products, seconds, item_errors = future.result()
+            except BrokenProcessPool as e:
+                if retry:
+                    # The page may not be what killed the worker: one more try on a new pool
+                    self._submit_to_pool(self._replace_pool(pool), html_content, result, retry=False)
+                else:
+                    self._replace_pool(pool)
+                    self._parse_done(result, error=e)
+                return
+            except Exception as e:
+                self._parse_done(result, error=e)
+                return
+            if item_errors:
+                PARSE_ERRORS.inc(item_errors, kind="item")
+            self._parse_done(result, products=products, seconds=seconds)
+
+        try:
+            future = pool.submit(_timed_parse, html_content)
+        except BrokenProcessPool as e:
+            if retry:
+                self._submit_to_pool(self._replace_pool(pool), html_content, result, retry=False)
+            else:
+                self._replace_pool(pool)
+                self._parse_done(result, error=e)
+            return
+        except Exception as e:
+            self._parse_done(result, error=e)
+            return
+        future.add_done_callback(on_done)
+
+    def _parse_done(self, result, products=None, seconds=0.0, error=None):
+        with self._parse_lock:
+            self._parse_in_flight -= 1
+        self._parse_slots.release()
+        if error is not None:
+            self.stages["parse"].record(seconds, error=True)
+            PARSE_ERRORS.inc(kind="page")
+            result.set_exception(error)
+        else:
+            self.stages["parse"].record(seconds)
+            result.set_result(products)
+
+    def write(self, save_callback, page_products, label=""):
+        """Queue one parsed page for the writer thread; blocks while the queue is full"""
+        self.start()
+        done = Future()
+        self._write_queue.put((save_callback, page_products, label, done))
+        return done
+
+    def _write_loop(self):
+        while True:
+            save_callback, page_products, label, done = self._write_queue.get()
+            start = time.perf_counter()
+            try:
+                save_callback(page_products)
+                self.stages["write"].record(time.perf_counter() - start)
+                print(f"Saved {len(page_products)} products{label} to DB.", flush=True)
+                done.set_result(len(page_products))
+            except Exception as e:
+                self.stages["write"].record(time.perf_counter() - start, error=True)
+                print(f"Error saving{label} to DB: {e}", flush=True)
+                done.set_exception(e)
+            finally:
+                self._write_queue.task_done()
+
+    def drain(self):
+        """Wait until every queued page has been written (end of a scrape job)"""
+        if self._writer is not None:
+            self._write_queue.join()
+
+    def stats(self):
+        return {
+            "parse_workers": self.parse_workers,
+            "parse_queue": {"depth": self._parse_in_flight, "capacity": self.parse_capacity},
+            "write_queue": {"depth": self._write_queue.qsize(), "capacity": self.write_capacity},
+            "stages": {name: timer.snapshot() for name, timer in self.stages.items()},
+        }
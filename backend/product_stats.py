@@ -0,0 +1,125 @@
+from sqlalchemy import text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlmodel import Session, select
+
+from models import ProductStats
+
+STAT_COLUMNS = [
+    "min_price", "max_price", "price_sum", "price_count",
+    "last_price", "last_ordinary_price", "lowest_price_30_days", "last_reading_at",
+]
+
+# Covers both history tiers: raw readings (a row counts seen_count times, see
+# history_store.extend_runs) and the pricehistory_daily rollup.
+# {seen_count} and {last_seen} are the raw run columns, see rebuild_product_stats.
+REBUILD_QUERY = """
+INSERT INTO product_stats (product_id, min_price, max_price, price_sum, price_count,
+                           last_price, last_ordinary_price, lowest_price_30_days, last_reading_at)
+SELECT p.id, agg.min_price, agg.max_price, COALESCE(agg.price_sum, 0), COALESCE(agg.price_count, 0),
+       last.price, last.ordinary_price, last.lowest_price_30_days, last.timestamp
+FROM product p
+LEFT JOIN (
+    SELECT product_id, MIN(min_price) AS min_price, MAX(max_price) AS max_price,
+           SUM(price_sum) AS price_sum, SUM(price_count) AS price_count
+    FROM (
+        SELECT product_id, MIN(price) AS min_price, MAX(price) AS max_price,
+               SUM(price * {seen_count}) AS price_sum, SUM({seen_count}) AS price_count
+        FROM pricehistory
+        WHERE price > 0
+        GROUP BY product_id
+        UNION ALL
+        SELECT product_id, MIN(min_price), MAX(max_price), SUM(price_sum), SUM(positive_count)
+        FROM pricehistory_daily
+        GROUP BY product_id
+    )
+    GROUP BY product_id
+) agg ON agg.product_id = p.id
+LEFT JOIN (
+    SELECT product_id, price, ordinary_price, lowest_price_30_days, timestamp,
+           ROW_NUMBER() OVER (PARTITION BY product_id ORDER BY timestamp DESC, tier, id DESC) AS rn
+    FROM (
+        SELECT product_id, price, ordinary_price, lowest_price_30_days,
+               {last_seen} AS timestamp, 0 AS tier, id
+        FROM pricehistory
+        UNION ALL
+        SELECT product_id, last_price, ordinary_price, lowest_price_30_days, last_seen, 1, 0
+        FROM pricehistory_daily
+    )
+) last ON last.product_id = p.id AND last.rn = 1
+{where}
+"""
+
+def stats_upsert_statement():
+    statement = sqlite_insert(ProductStats)
+    return statement.on_conflict_do_update(
+        index_elements=["product_id"],
+        set_={c: statement.excluded[c] for c in STAT_COLUMNS},
+    )
+
+def apply_readings(session, history_rows):
+    """
+    Fold fresh readings (inserted PriceHistory rows, or readings that
+    extended a run) into product_stats.
+    Must run inside the transaction that inserted them. Returns the upsert
+    rows (one per product), ready for stats_upsert_statement().
+    """
+    if not history_rows:
+        return []
+
+    product_ids = {h["product_id"] for h in history_rows}
+    stats = {
+        s.product_id: {"product_id": s.product_id, **{c: getattr(s, c) for c in STAT_COLUMNS}}
+        for s in session.exec(select(ProductStats).where(ProductStats.product_id.in_(product_ids))).all()
+    }
+
+    for h in history_rows:
+        row = stats.get(h["product_id"])
+        if row is None:
+            row = {"product_id": h["product_id"], **{c: None for c in STAT_COLUMNS}, "price_sum": 0.0, "price_count": 0}
+            stats[h["product_id"]] = row
+
+        price = h.get("price") or 0.0
+        if price > 0:
+            row["min_price"] = price if row["min_price"] is None else min(row["min_price"], price)
+            row["max_price"] = price if row["max_price"] is None else max(row["max_price"], price)
+            row["price_sum"] += price
+            row["price_count"] += 1
+
+        if row["last_reading_at"] is None or h["timestamp"] >= row["last_reading_at"]:
+            row["last_price"] = price
+            row["last_ordinary_price"] = h.get("ordinary_price")
+            row["lowest_price_30_days"] = h.get("lowest_price_30_days")
+            row["last_reading_at"] = h["timestamp"]
+
+    return list(stats.values())
+
+def rebuild_product_stats(session, product_ids=None, run_columns=True):
+    """
+    Recompute product_stats from scratch (all products, or only the given ids).
+    run_columns=False reads a pricehistory without last_seen/seen_count
+    (before migration 7): one reading per row.
+    """
+    columns = {"seen_count": "seen_count", "last_seen": "COALESCE(last_seen, timestamp)"} if run_columns \
+        else {"seen_count": "1", "last_seen": "timestamp"}
+    if product_ids is None:
+        session.exec(text("DELETE FROM product_stats"))
+        session.exec(text(REBUILD_QUERY.format(where="", **columns)))
+    else:
+        ids = "[" + ",".join(str(int(i)) for i in product_ids) + "]"
+        where = "WHERE p.id IN (SELECT value FROM json_each(:ids))"
+        session.exec(text("DELETE FROM product_stats WHERE product_id IN (SELECT value FROM json_each(:ids))").bindparams(ids=ids))
+        session.exec(text(REBUILD_QUERY.format(where=where, **columns)).bindparams(ids=ids))
+
+if __name__ == "__main__":
+    from database import engine, create_db_and_tables
+    from migrations import run_migrations
+    from response_cache import bump_generation
+
+    create_db_and_tables()
+    run_migrations(engine)
+    with Session(engine) as session:
+        rebuild_product_stats(session)
+        bump_generation(session)
+        session.commit()
+        count = session.exec(text("SELECT COUNT(*) FROM product_stats")).one()[0]
+    print(f"Rebuilt product_stats for {count} products.")
@@ -0,0 +1,115 @@
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from urllib.parse import urlencode
+
+from sqlalchemy import text
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.responses import Response
+
+# Max number of cached responses (LRU eviction)
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", 256))
+
+# Read endpoints whose output only changes when the data generation changes
+CACHED_PATHS = re.compile(r"^/(products(/\d+(/history)?)?|history)/?$")
+
+def bump_generation(session):
+    """
+    Call inside every write transaction that can change API output (page saves,
+    score updates, consolidation, compaction...), before it commits.
+    The counter lives in the database, so writes from maintenance scripts in
+    other processes invalidate the API's cache too.
+    """
+    # Databases built before the data_generation table have no row yet
+    session.exec(text("INSERT OR IGNORE INTO data_generation (id, value) VALUES (1, 0)"))
+    return session.exec(text("UPDATE data_generation SET value = value + 1 WHERE id = 1 RETURNING value")).scalar()
+
+def current_generation(engine):
+    """Generation of the last committed write, 0 before the first one"""
+    with engine.connect() as conn:
+        return conn.exec_driver_sql("SELECT value FROM data_generation WHERE id = 1").scalar() or 0
+
+class ResponseCache:
+    """Bounded LRU of rendered responses, each tagged with the data generation it was built from"""
+
+    def __init__(self, max_entries=RESPONSE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, generation):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry["generation"] != generation:
+                # Stale: built before the last write
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+cache = ResponseCache()
+
+def _etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return etag in [t.strip() for t in if_none_match.split(",")]
+
+class ResponseCacheMiddleware(BaseHTTPMiddleware):
+    """
+    Serves GET requests on the read endpoints from an in-process cache keyed on
+    the data generation (read from `engine` on every request), with strong
+    ETags and If-None-Match -> 304.
+    """
+
+    def __init__(self, app, engine):
+        super().__init__(app)
+        self.engine = engine
+
+    async def dispatch(self, request, call_next):
+        if request.method != "GET" or not CACHED_PATHS.match(request.url.path):
+            return await call_next(request)
+
+        # Canonical, encoded query: "a=1&b=2" and "b=2&a=1" share an entry, "a=1%26b%3D2" doesn't
+        key = request.url.path + "?" + urlencode(sorted(request.query_params.multi_items()))
+        generation = current_generation(self.engine)
+        if_none_match = request.headers.get("if-none-match")
+
+        entry = cache.get(key, generation)
+        if entry is None:
+            response = await call_next(request)
+            if response.status_code != 200:
+                return response
+            body = b"".join([chunk async for chunk in response.body_iterator])
+            headers = {
+                k: v for k, v in response.headers.items()
+                if k.lower() not in ("content-length", "etag", "cache-control")
+            }
+            etag = '"%d-%s"' % (generation, hashlib.sha1(body).hexdigest()[:20])
+            entry = {"generation": generation, "body": body, "headers": headers, "etag": etag}
+            # If a write landed while we were building, the entry is already stale
+            # and will simply be dropped on the next lookup.
+            cache.put(key, entry)
+
+        headers = dict(entry["headers"], etag=entry["etag"])
+        # Let clients revalidate on every use; revalidation is nearly free
+        headers["cache-control"] = "no-cache"
+        if _etag_matches(if_none_match, entry["etag"]):
+            return Response(status_code=304, headers={"etag": entry["etag"], "cache-control": "no-cache"})
+        return Response(content=entry["body"], status_code=200, headers=headers)
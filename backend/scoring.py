@@ -0,0 +1,107 @@
+from datetime import datetime
+from itertools import groupby
+
+import numpy as np
+from sqlalchemy import text, update
+from sqlmodel import Session
+
+from analytics import convenience_score_from_daily
+from models import Product
+from response_cache import bump_generation
+from changes import stamp_changes
+from events import broker, publish_score_events
+from history_store import RUN_DAYS
+
+# Daily minimum per product, computed by SQLite and streamed ordered by product
+# so each product's series arrives contiguously. A raw run counts on every day
+# it has readings in (RUN_DAYS). Compacted days come straight from the
+# pricehistory_daily rollup: its min_price only covers positive prices, so a
+# day with any unreadable 0.0 reading is 0.0, exactly like the raw tier.
+DAILY_MINIMUMS_QUERY = """
+WITH RECURSIVE """ + RUN_DAYS.format(where="h.product_id IN (SELECT p.id FROM product p WHERE p.current_price > 0 {filters})") + """
+SELECT h.product_id, h.day, MIN(h.price) AS price
+FROM (
+    SELECT product_id, day, price FROM raw_days
+    UNION ALL
+    SELECT product_id, day, CASE WHEN positive_count < reading_count THEN 0.0 ELSE min_price END
+    FROM pricehistory_daily
+) h
+JOIN product p ON p.id = h.product_id
+WHERE p.current_price > 0 {filters}
+GROUP BY h.product_id, h.day
+ORDER BY h.product_id, h.day
+"""
+
+def _iter_daily_series(connection, since=None, product_ids=None, chunk_size=5000):
+    """Yield (product_id, days, daily_prices) for every product with history, one streaming query"""
+    filters = []
+    params = {}
+    if since is not None:
+        filters.append("AND p.last_checked_at >= :since")
+        # Same text format SQLAlchemy uses to store DATETIME columns in SQLite
+        params["since"] = since.strftime("%Y-%m-%d %H:%M:%S.%f")
+    if product_ids is not None:
+        filters.append("AND p.id IN (SELECT value FROM json_each(:ids))")
+        params["ids"] = "[" + ",".join(str(int(i)) for i in product_ids) + "]"
+
+    result = connection.execution_options(stream_results=True).execute(
+        text(DAILY_MINIMUMS_QUERY.format(filters=" ".join(filters))), params
+    )
+
+    def rows():
+        while True:
+            chunk = result.fetchmany(chunk_size)
+            if not chunk:
+                return
+            yield from chunk
+
+    for product_id, group in groupby(rows(), key=lambda r: r[0]):
+        group = list(group)
+        days = np.array([r[1] for r in group], dtype='datetime64[D]')
+        prices = np.array([r[2] for r in group], dtype=float)
+        yield product_id, days, prices
+
+def score_catalog(engine, since=None, product_ids=None, t0=None, read_engine=None):
+    """
+    Recompute Convenience Scores for the whole catalog in one pass.
+    Optionally limited to products checked since a given time (e.g. the start
+    of the latest scrape cycle) or to an explicit list of product ids.
+    With read_engine, the history is read there and `engine` is only used
+    for the final UPDATE, so page writes aren't held up while scoring.
+    Returns the number of products whose score changed.
+    """
+    t0 = t0 or datetime.utcnow()
+
+    with Session(read_engine or engine) as session:
+        current = {
+            p_id: (price, score)
+            for p_id, price, score in session.exec(
+                text("SELECT id, current_price, convenience_score FROM product WHERE current_price > 0")
+            ).all()
+        }
+
+        changes = []
+        for product_id, days, prices in _iter_daily_series(session.connection(), since, product_ids):
+            current_price, old_score = current.get(product_id, (None, None))
+            if not current_price:
+                continue
+            try:
+                score = convenience_score_from_daily(days, prices, current_price, t0)
+            except Exception as e:
+                print(f"Error calculating score for product {product_id}: {e}", flush=True)
+                continue
+            if old_score != score:
+                changes.append({"id": product_id, "convenience_score": score, "old_score": old_score})
+
+    if changes:
+        with Session(engine) as session:
+            stamp_changes(session, changes)
+            session.execute(update(Product), [
+                {"id": c["id"], "convenience_score": c["convenience_score"], "change_seq": c["change_seq"]} for c in changes
+            ])
+            bump_generation(session)
+            with broker.ordered():
+                session.commit()
+                publish_score_events([(c["change_seq"], c["id"], c["old_score"], c["convenience_score"]) for c in changes])
+
+    return len(changes)
@@ -0,0 +1,100 @@
+"""
+Full-text product search (GET /products/search) on an SQLite FTS5 index.
+
+product_fts is an external-content FTS5 table over product (name, slug,
+category): it stores only the index, the text stays in product. Triggers keep
+it in sync with every insert, delete and name/slug/category update, whichever
+code path writes the product (bulk saves, consolidation, migrations).
+
+The unicode61 tokenizer folds case and diacritics, so "rose" finds "Rosé";
+the prefix indexes make "ripa*" a range lookup instead of a term scan.
+"""
+import html
+import re
+
+from sqlalchemy import text
+
+# Relative weight of name, slug and category in the BM25 ranking
+BM25_WEIGHTS = (10.0, 2.0, 1.0)
+# Query terms used, the rest is ignored
+MAX_TERMS = 12
+# Match markers of snippet(): control characters, swapped for <mark> after escaping
+MARK_START, MARK_END = "\x02", "\x03"
+
+FTS_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS product_fts USING fts5(
+        name, slug, category,
+        content='product', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2',
+        prefix='2 3'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS product_fts_insert AFTER INSERT ON product BEGIN
+        INSERT INTO product_fts (rowid, name, slug, category) VALUES (new.id, new.name, new.slug, new.category);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS product_fts_delete AFTER DELETE ON product BEGIN
+        INSERT INTO product_fts (product_fts, rowid, name, slug, category) VALUES ('delete', old.id, old.name, old.slug, old.category);
+    END""",
+    # Price and score updates don't touch the index
+    """CREATE TRIGGER IF NOT EXISTS product_fts_update AFTER UPDATE OF name, slug, category ON product BEGIN
+        INSERT INTO product_fts (product_fts, rowid, name, slug, category) VALUES ('delete', old.id, old.name, old.slug, old.category);
+        INSERT INTO product_fts (rowid, name, slug, category) VALUES (new.id, new.name, new.slug, new.category);
+    END""",
+]
+
+def create_product_fts(session):
+    """Create the FTS table and its triggers, and index the existing products"""
+    for ddl in FTS_DDL:
+        session.exec(text(ddl))
+    session.exec(text("INSERT INTO product_fts (product_fts) VALUES ('rebuild')"))
+
+def match_expression(q):
+    """
+    FTS5 query for free text: every word must match, the last one as a prefix
+    (typed as you search), e.g. 'ripasso superiore 20' -> "ripasso" "superiore" "20"*
+    Words are quoted, so FTS5 syntax in the input is taken literally.
+    """
+    terms = re.findall(r"\w+", q or "")[:MAX_TERMS]
+    if not terms:
+        return None
+    quoted = [f'"{t}"' for t in terms]
+    quoted[-1] += "*"
+    return " ".join(quoted)
+
+SEARCH_QUERY = """
+    SELECT {columns},
+           bm25(product_fts, {weights}) AS rank,
+           snippet(product_fts, 0, char(2), char(3), '…', 16) AS snippet
+    FROM product_fts
+    JOIN product p ON p.id = product_fts.rowid
+    LEFT JOIN product_stats s ON s.product_id = p.id
+    WHERE product_fts MATCH :match {where}
+    ORDER BY rank
+    LIMIT :limit
+"""
+
+def highlight(snippet):
+    """
+    HTML of a snippet() result: the scraped name escaped, so markup in it is
+    shown as text, and the matches in <mark>...</mark>.
+    """
+    return (
+        html.escape(snippet or "")
+        .replace(MARK_START, "<mark>")
+        .replace(MARK_END, "</mark>")
+    )
+
+def search_products(session, columns, q, limit=20, category=None):
+    """
+    Rows of `columns` (aliases p and s, as for /products) best match first,
+    each followed by its BM25 rank (lower is better) and the name with
+    private match markers (see highlight()).
+    """
+    match = match_expression(q)
+    if match is None:
+        return []
+    where, params = "", {"match": match, "limit": limit}
+    if category is not None:
+        where = "AND p.category = :category"
+        params["category"] = category
+    query = SEARCH_QUERY.format(columns=columns, weights=", ".join(map(str, BM25_WEIGHTS)), where=where)
+    return session.exec(text(query).bindparams(**params)).all()
@@ -0,0 +1,128 @@
+"""
+Tag dictionary: listing tags are interned into the `tag` table and stored per
+reading as a bitmask (PriceHistory.tag_mask, bit id - 1), instead of repeating
+the same comma string on every row.
+
+A bitmask holds the first MASK_BITS tags of the dictionary. A reading with a
+tag beyond them keeps its full list in PriceHistory.tags as well (the mask
+still has the bits it can hold); TAGS_SQL reads both back as a comma string.
+
+product_tag holds the tags of each product's latest reading, so
+/products?tag= is an index lookup instead of a LIKE over the history.
+"""
+import json
+
+from sqlalchemy import text
+
+from listing_parsers import normalize_tags
+
+# SQLite integers are signed 64-bit
+MASK_BITS = 63
+
+# Comma string of a pricehistory row aliased `alias`, in tag id order
+TAGS_SQL = """COALESCE({alias}.tags, (
+    SELECT group_concat(t.name, ',') FROM tag t
+    WHERE t.id <= {bits} AND (({alias}.tag_mask >> (t.id - 1)) & 1) = 1
+))"""
+
+def tags_sql(alias="h"):
+    return TAGS_SQL.format(alias=alias, bits=MASK_BITS)
+
+def intern_tags(session, names):
+    """{name: tag id} for the given names, adding the new ones to the dictionary"""
+    names = set(names)
+    if not names:
+        return {}
+    select_ids = text("SELECT t.name, t.id FROM json_each(:names) j JOIN tag t ON t.name = j.value")
+    payload = json.dumps(sorted(names))
+    ids = dict(session.exec(select_ids.bindparams(names=payload)).all())
+    missing = names - set(ids)
+    if missing:
+        # Sorted, so the ids don't depend on set order
+        session.execute(text("INSERT OR IGNORE INTO tag (name) VALUES (:name)"), [{"name": n} for n in sorted(missing)])
+        ids = dict(session.exec(select_ids.bindparams(names=payload)).all())
+    return ids
+
+def encode(names, ids):
+    """(tag_mask, tags) columns of a reading with the tag `names` (normalized)"""
+    mask = 0
+    overflow = False
+    for name in names:
+        tag_id = ids[name]
+        if tag_id <= MASK_BITS:
+            mask |= 1 << (tag_id - 1)
+        else:
+            overflow = True
+    return mask, (",".join(names) if overflow else None)
+
+def encode_readings(session, rows):
+    """
+    Normalize the `tags` of reading dicts in place into tag_mask/tags.
+    Returns {id(row): [tag ids]} for sync_product_tags.
+    """
+    names = {id(row): normalize_tags(row.get("tags")) for row in rows}
+    ids = intern_tags(session, {n for row_names in names.values() for n in row_names})
+    tag_ids = {}
+    for row in rows:
+        row["tag_mask"], row["tags"] = encode(names[id(row)], ids)
+        tag_ids[id(row)] = [ids[n] for n in names[id(row)]]
+    return tag_ids
+
+def sync_product_tags(session, product_tags):
+    """Replace the product_tag rows of the given products: {product_id: [tag ids]}"""
+    if not product_tags:
+        return
+    product_ids = json.dumps(sorted(product_tags))
+    session.exec(text(
+        "DELETE FROM product_tag WHERE product_id IN (SELECT value FROM json_each(:ids))"
+    ).bindparams(ids=product_ids))
+    rows = [{"product_id": p, "tag_id": t} for p, tag_ids in product_tags.items() for t in set(tag_ids)]
+    if rows:
+        session.execute(text("INSERT INTO product_tag (product_id, tag_id) VALUES (:product_id, :tag_id)"), rows)
+
+def backfill_tags(session, batch_size=5000):
+    """
+    Move the comma strings of existing readings into the dictionary and their
+    bitmask, then rebuild product_tag from each product's latest reading.
+    Returns the number of readings converted.
+    """
+    session.exec(text("UPDATE pricehistory SET tags = NULL, tag_mask = 0 WHERE tags IS NOT NULL AND trim(tags) = ''"))
+    converted = 0
+    after = 0
+    while True:
+        rows = session.exec(text(
+            "SELECT id, tags FROM pricehistory WHERE id > :after AND tags IS NOT NULL ORDER BY id LIMIT :n"
+        ).bindparams(after=after, n=batch_size)).all()
+        if not rows:
+            break
+        readings = [{"id": row[0], "tags": row[1]} for row in rows]
+        encode_readings(session, readings)
+        session.execute(text("UPDATE pricehistory SET tag_mask = :tag_mask, tags = :tags WHERE id = :id"), readings)
+        converted += len(readings)
+        after = rows[-1][0]
+
+    rebuild_product_tags(session)
+    return converted
+
+def rebuild_product_tags(session, product_ids=None):
+    """Recompute product_tag from the latest raw reading (all products, or only the given ids)"""
+    if product_ids is None:
+        session.exec(text("DELETE FROM product_tag"))
+        where, params = "", {}
+    else:
+        ids = json.dumps(sorted(int(i) for i in product_ids))
+        session.exec(text(
+            "DELETE FROM product_tag WHERE product_id IN (SELECT value FROM json_each(:ids))"
+        ).bindparams(ids=ids))
+        where, params = "WHERE p.id IN (SELECT value FROM json_each(:ids))", {"ids": ids}
+    latest = session.exec(text(f"""
+        SELECT p.id, {tags_sql()}
+        FROM product p
+        JOIN pricehistory h ON h.id = (
+            SELECT id FROM pricehistory WHERE product_id = p.id ORDER BY timestamp DESC, id DESC LIMIT 1
+        )
+        {where}
+    """).bindparams(**params)).all()
+    readings = {product_id: normalize_tags(tags) for product_id, tags in latest if tags}
+    ids = intern_tags(session, {n for names in readings.values() for n in names})
+    sync_product_tags(session, {product_id: [ids[n] for n in names] for product_id, names in readings.items()})
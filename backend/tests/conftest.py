@@ -0,0 +1,19 @@
+import os
+import sys
+import tempfile
+
+# Backend modules import each other as top-level modules (run from backend/)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# database.py opens DB_PATH at import: keep it away from a real bernabei.db
+os.environ.setdefault("DB_PATH", os.path.join(tempfile.mkdtemp(), "bernabei_test.db"))
+os.environ.setdefault("PAGE_ARCHIVE_DIR", "")
+
+import pytest
+from sqlmodel import create_engine
+
+@pytest.fixture
+def db_engine(tmp_path):
+    """Engine on an empty SQLite file of its own"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}", connect_args={"check_same_thread": False})
+    yield engine
+    engine.dispose()
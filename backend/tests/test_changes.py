@@ -0,0 +1,31 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert
+from sqlmodel import SQLModel, Session
+
+from changes import changes_since, reserve_change_seqs
+from models import Product, PriceHistory
+from scoring import score_catalog
+
+def test_scoring_stamps_changes_without_migrations(db_engine):
+    # Schema from create_all alone (benchmarks, replays into a fresh DB_PATH):
+    # no change_sequence row until the first reservation
+    SQLModel.metadata.create_all(db_engine)
+    now = datetime.utcnow()
+    with Session(db_engine) as session:
+        for i, price in enumerate((10.0, 20.0)):
+            session.add(Product(bernabei_code=f"p{i}", name=f"P{i}", product_link=f"https://x/p{i}", current_price=price, last_checked_at=now))
+        session.flush()
+        session.execute(insert(PriceHistory), [
+            {"product_id": product_id, "price": 15.0, "timestamp": now - timedelta(days=d)}
+            for product_id in (1, 2) for d in range(1, 40)
+        ])
+        session.commit()
+
+    assert score_catalog(db_engine, t0=now) == 2
+
+    with Session(db_engine) as session:
+        rows, _, cursor, has_more = changes_since(session, "p.id, p.convenience_score", 0)
+        assert [row[0] for row in rows] == [1, 2]
+        assert cursor == rows[-1][-1] and not has_more
+        assert reserve_change_seqs(session, 1) == cursor + 1
@@ -0,0 +1,136 @@
+import pytest
+from sqlmodel import SQLModel, Session
+
+import main
+from crawl_state import start_or_resume_run, record_page, finish_category, stop_run
+from models import CrawlRun
+from scraper import BlockingError
+
+CATEGORIES = ["/vino-online/", "/champagne/"]
+
+def _start(engine):
+    run_id, _, resume_pages = start_or_resume_run(engine, CATEGORIES, "sequential")
+    return run_id, resume_pages
+
+def _save_pages(engine, run_id, category, pages):
+    for _ in range(pages):
+        record_page(engine, run_id, category, 48)
+
+def test_completed_run_is_not_resumed(db_engine):
+    SQLModel.metadata.create_all(db_engine)
+    run_id, resume_pages = _start(db_engine)
+    assert resume_pages == {0: 1, 1: 1}
+    _save_pages(db_engine, run_id, CATEGORIES[0], 3)
+    finish_category(db_engine, run_id, CATEGORIES[0])
+    _save_pages(db_engine, run_id, CATEGORIES[1], 2)
+    stop_run(db_engine, run_id, "completed", reason="finished")
+
+    assert _start(db_engine) == (run_id + 1, {0: 1, 1: 1})
+    with Session(db_engine) as session:
+        run = session.get(CrawlRun, run_id)
+        assert (run.status, run.pages, run.items) == ("completed", 5, 240)
+        assert run.finished_at is not None
+
+def test_sequential_block_resumes_at_the_blocked_page(db_engine):
+    SQLModel.metadata.create_all(db_engine)
+    run_id, _ = _start(db_engine)
+    _save_pages(db_engine, run_id, CATEGORIES[0], 2)
+    finish_category(db_engine, run_id, CATEGORIES[0])
+    _save_pages(db_engine, run_id, CATEGORIES[1], 2)
+    # As _crawl builds it: the blocked category at the blocked page, the later ones where they are
+    stop_run(db_engine, run_id, "blocked", reason="403 at /champagne/ page 3", resume_pages={1: 3})
+
+    assert _start(db_engine) == (run_id, {1: 3})
+    with Session(db_engine) as session:
+        run = session.get(CrawlRun, run_id)
+        assert (run.status, run.resume_count, run.pages_at_resume) == ("running", 1, 4)
+
+def test_async_block_resumes_the_unfinished_streams(db_engine):
+    SQLModel.metadata.create_all(db_engine)
+    run_id, _ = _start(db_engine)
+    # Both streams ran together; the first one finished and left the crawler's progress
+    _save_pages(db_engine, run_id, CATEGORIES[0], 2)
+    _save_pages(db_engine, run_id, CATEGORIES[1], 3)
+    stop_run(db_engine, run_id, "blocked", reason="403 at /champagne/ page 4", resume_pages={1: 4})
+
+    assert _start(db_engine) == (run_id, {1: 4})
+
+def test_failed_write_resumes_at_the_lost_page(db_engine):
+    SQLModel.metadata.create_all(db_engine)
+    run_id, _ = _start(db_engine)
+    # Page 2 of the first category failed to save: later pages aren't checkpointed
+    _save_pages(db_engine, run_id, CATEGORIES[0], 1)
+    _save_pages(db_engine, run_id, CATEGORIES[1], 2)
+    finish_category(db_engine, run_id, CATEGORIES[1])
+    stop_run(db_engine, run_id, "failed", reason="page writes failed in /vino-online/")
+
+    assert _start(db_engine) == (run_id, {0: 2})
+
+def test_stale_run_is_abandoned(db_engine, monkeypatch):
+    SQLModel.metadata.create_all(db_engine)
+    run_id, _ = _start(db_engine)
+    _save_pages(db_engine, run_id, CATEGORIES[0], 2)
+    stop_run(db_engine, run_id, "blocked", resume_pages={0: 3, 1: 1})
+    monkeypatch.setattr("crawl_state.CRAWL_RESUME_MAX_AGE_HOURS", 0)
+
+    assert _start(db_engine) == (run_id + 1, {0: 1, 1: 1})
+    with Session(db_engine) as session:
+        assert session.get(CrawlRun, run_id).status == "abandoned"
+
+@pytest.fixture
+def crawl_engine(db_engine, monkeypatch):
+    """run_scrape_job on an empty database, outside any cooldown"""
+    SQLModel.metadata.create_all(db_engine)
+    monkeypatch.setattr(main, "engine", db_engine)
+    monkeypatch.setattr(main, "CATEGORIES", CATEGORIES)
+    monkeypatch.setattr(main, "SCRAPER_MODE", "sequential")
+    monkeypatch.setattr(main.pacer, "cooldown_remaining", lambda: 0.0)
+    return db_engine
+
+def _fake_site(monkeypatch, last_pages, lost, blocked_at=None, status_code=403):
+    """
+    scrape_category_page over categories of last_pages {category: last page}:
+    saving a page in `lost` ({(category, page)}) fails, fetching blocked_at
+    ((category, page)) raises BlockingError with status_code.
+    """
+    def save(batch, checked_at=None):
+        if (batch[0]["category"], batch[0]["page"]) in lost:
+            raise RuntimeError("disk I/O error")
+
+    def scrape(cat, save_callback, start_page, pipeline=None):
+        for page in range(start_page, last_pages[cat] + 1):
+            if (cat, page) == blocked_at:
+                raise BlockingError(f"Scraper blocked by website ({status_code})", page_number=page, status_code=status_code)
+            try:
+                save_callback([{"page": page}])
+            except Exception:
+                pass
+
+    monkeypatch.setattr(main, "save_products_to_db", save)
+    monkeypatch.setattr(main, "scrape_category_page", scrape)
+
+def test_blocked_run_resumes_from_a_page_that_failed_to_save(crawl_engine, monkeypatch):
+    # Page 2 is lost, the block comes two pages later
+    _fake_site(monkeypatch, {CATEGORIES[0]: 6, CATEGORIES[1]: 3}, lost={(CATEGORIES[0], 2)}, blocked_at=(CATEGORIES[0], 4))
+    with pytest.raises(BlockingError):
+        main.run_scrape_job()
+
+    _, _, resume_pages = start_or_resume_run(crawl_engine, CATEGORIES, "sequential")
+    assert resume_pages == {0: 2, 1: 1}
+
+def test_blocked_run_keeps_a_finished_category_that_lost_a_page(crawl_engine, monkeypatch):
+    _fake_site(monkeypatch, {CATEGORIES[0]: 3, CATEGORIES[1]: 5}, lost={(CATEGORIES[0], 3)}, blocked_at=(CATEGORIES[1], 2))
+    with pytest.raises(BlockingError):
+        main.run_scrape_job()
+
+    _, _, resume_pages = start_or_resume_run(crawl_engine, CATEGORIES, "sequential")
+    assert resume_pages == {0: 3, 1: 2}
+
+def test_blocked_reason_names_the_status(crawl_engine, monkeypatch):
+    _fake_site(monkeypatch, {CATEGORIES[0]: 3, CATEGORIES[1]: 3}, lost=set(), blocked_at=(CATEGORIES[1], 2), status_code=429)
+    with pytest.raises(BlockingError):
+        main.run_scrape_job()
+
+    with Session(crawl_engine) as session:
+        run = session.get(CrawlRun, 1)
+        assert (run.status, run.termination_reason) == ("blocked", "429 at /champagne/ page 2")
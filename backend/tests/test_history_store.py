@@ -0,0 +1,73 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert, text, update
+from sqlmodel import SQLModel, Session
+
+from history_store import compact_batch, extend_runs, load_history
+from models import Product, PriceHistory
+from scoring import _iter_daily_series
+
+START = datetime(2024, 3, 1, 3, 0)
+
+def _ingest(session, readings):
+    """The rle branch of save_products_to_db, one reading per page"""
+    for reading in readings:
+        new_rows, run_updates, _ = extend_runs(session, [dict(reading)])
+        if run_updates:
+            session.execute(update(PriceHistory), run_updates)
+        if new_rows:
+            session.execute(insert(PriceHistory), new_rows)
+    session.commit()
+
+def _readings(days, price=10.0, per_day=4, start=START):
+    """per_day readings a day, 6 hours apart"""
+    return [
+        {"product_id": 1, "price": price, "ordinary_price": None, "lowest_price_30_days": None,
+         "tag_mask": 0, "tags": None, "timestamp": start + timedelta(hours=6 * i)}
+        for i in range(days * per_day)
+    ]
+
+def _catalog(db_engine):
+    SQLModel.metadata.create_all(db_engine)
+    session = Session(db_engine)
+    session.add(Product(bernabei_code="p1", name="P1", product_link="https://x/p1", current_price=10.0))
+    session.commit()
+    return session
+
+def test_runs_span_days_up_to_the_max_span(db_engine, monkeypatch):
+    monkeypatch.setattr("history_store.RUN_MAX_DAYS", 7)
+    with _catalog(db_engine) as session:
+        _ingest(session, _readings(20))
+        rows = session.exec(text("SELECT timestamp, seen_count FROM pricehistory ORDER BY timestamp")).all()
+        # 80 unchanged readings: one row per week instead of one per day
+        assert [r[1] for r in rows] == [28, 28, 24]
+
+        daily = load_history(session, 1, resolution="daily")
+        assert len(daily) == 20
+        assert all(p.reading_count == 4 for p in daily)
+        assert daily[0].timestamp == START
+        assert daily[1].timestamp == datetime(2024, 3, 2, 3, 0)
+
+        _, days, prices = next(_iter_daily_series(session.connection()))
+        assert len(days) == 20 and set(prices) == {10.0}
+
+def test_price_change_opens_a_new_run(db_engine):
+    with _catalog(db_engine) as session:
+        _ingest(session, _readings(2) + _readings(1, price=9.0, start=START + timedelta(days=2)))
+        assert session.exec(text("SELECT price, seen_count FROM pricehistory ORDER BY timestamp")).all() == [(10.0, 8), (9.0, 4)]
+
+def test_compaction_splits_a_run_at_the_cutoff(db_engine, monkeypatch):
+    monkeypatch.setattr("history_store.RUN_MAX_DAYS", 30)
+    with _catalog(db_engine) as session:
+        _ingest(session, _readings(10))
+        cutoff = datetime(2024, 3, 5)
+        assert compact_batch(session, [1], cutoff) == 1
+        session.commit()
+
+        rollups = session.exec(text("SELECT day, reading_count FROM pricehistory_daily ORDER BY day")).all()
+        assert rollups == [("2024-03-01", 4), ("2024-03-02", 4), ("2024-03-03", 4), ("2024-03-04", 4)]
+        raw = session.exec(text("SELECT timestamp, seen_count FROM pricehistory")).all()
+        assert raw == [("2024-03-05 03:00:00.000000", 24)]
+
+        daily = load_history(session, 1, resolution="daily")
+        assert len(daily) == 10 and sum(p.reading_count for p in daily) == 40
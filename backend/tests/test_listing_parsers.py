@@ -0,0 +1,27 @@
+import glob
+import os
+
+import pytest
+
+from listing_parsers import PARSERS, LexborHTMLParser, normalize_slug, product_id_from
+from benchmarks.bench_parsers import FIXTURES_DIR, comparable, parse_quietly
+
+FIXTURES = sorted(glob.glob(os.path.join(FIXTURES_DIR, "*.html")))
+
+@pytest.mark.skipif(LexborHTMLParser is None, reason="selectolax is not installed")
+@pytest.mark.parametrize("path", FIXTURES, ids=os.path.basename)
+def test_backends_extract_the_same_products(path):
+    with open(path, encoding="utf-8") as f:
+        html_content = f.read()
+    expected = comparable(parse_quietly(PARSERS["soup"](), html_content))
+    assert expected
+    for name, backend in PARSERS.items():
+        assert comparable(parse_quietly(backend(), html_content)) == expected, name
+
+def test_code_keeps_the_link_slug_as_written():
+    link = "https://www.bernabei.it/vino-rosso/Barolo-Riserva/?ref=list#reviews"
+    # Codes of existing rows were derived from the raw slug; only identity matching is normalized
+    assert product_id_from(link, None, []) == "Barolo-Riserva"
+    assert product_id_from("https://www.bernabei.it/vino-rosso/Barolo#top", None, []) == "Barolo#top"
+    assert normalize_slug(link) == "barolo-riserva"
+    assert product_id_from("", "setLocation('/checkout/cart/add/product/19132/')", []) == "19132"
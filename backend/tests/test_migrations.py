@@ -0,0 +1,84 @@
+from sqlalchemy import text
+from sqlmodel import SQLModel, Session
+
+import models  # noqa: F401  (registers the tables)
+from migrations import MIGRATIONS, run_migrations, verify_migrations, applied_versions
+
+# Schema of the first release, before any migration (no score, slug, stats...)
+BASELINE_DDL = [
+    """CREATE TABLE product (
+        id INTEGER PRIMARY KEY, bernabei_code VARCHAR NOT NULL, name VARCHAR NOT NULL,
+        product_link VARCHAR NOT NULL, image_url VARCHAR, category VARCHAR,
+        current_price FLOAT, last_checked_at DATETIME
+    )""",
+    "CREATE UNIQUE INDEX ix_product_bernabei_code ON product (bernabei_code)",
+    "CREATE INDEX ix_product_name ON product (name)",
+    """CREATE TABLE pricehistory (
+        id INTEGER PRIMARY KEY, product_id INTEGER NOT NULL REFERENCES product (id), price FLOAT NOT NULL,
+        ordinary_price FLOAT, lowest_price_30_days FLOAT, tags VARCHAR, timestamp DATETIME NOT NULL
+    )""",
+    "INSERT INTO product VALUES (1, 'B1', 'Barolo Riserva', 'https://www.bernabei.it/barolo-riserva', NULL, '/vino-online/', 30.0, '2024-01-02 10:00:00.000000')",
+    "INSERT INTO product VALUES (2, 'gen_x', 'Rosé Brut', 'https://www.bernabei.it/rose-brut?x=1', NULL, '/champagne/', 20.0, '2024-01-02 10:00:00.000000')",
+    "INSERT INTO pricehistory VALUES (1, 1, 35.0, 40.0, NULL, 'BIO', '2024-01-01 10:00:00.000000')",
+    "INSERT INTO pricehistory VALUES (2, 1, 30.0, 40.0, NULL, 'BIO,Special Price', '2024-01-02 10:00:00.000000')",
+    "INSERT INTO pricehistory VALUES (3, 2, 20.0, NULL, NULL, NULL, '2024-01-02 10:00:00.000000')",
+]
+
+def baseline_db(engine):
+    with engine.begin() as conn:
+        for statement in BASELINE_DDL:
+            conn.execute(text(statement))
+    # What create_db_and_tables() adds at startup: the tables that don't exist yet
+    SQLModel.metadata.create_all(engine)
+
+def test_baseline_to_latest(db_engine):
+    baseline_db(db_engine)
+
+    applied = run_migrations(db_engine)
+
+    assert applied == [m["version"] for m in MIGRATIONS]
+    assert verify_migrations(db_engine) == 0
+    with Session(db_engine) as session:
+        assert session.exec(text("SELECT id, slug FROM product ORDER BY id")).all() == [(1, "barolo-riserva"), (2, "rose-brut")]
+        assert session.exec(text(
+            "SELECT product_id, min_price, max_price, price_count FROM product_stats ORDER BY product_id"
+        )).all() == [(1, 30.0, 35.0, 2), (2, 20.0, 20.0, 1)]
+        assert session.exec(text(
+            "SELECT t.name FROM product_tag pt JOIN tag t ON t.id = pt.tag_id WHERE pt.product_id = 1 ORDER BY t.name"
+        )).scalars().all() == ["BIO", "Special Price"]
+        assert session.exec(text("SELECT rowid FROM product_fts WHERE product_fts MATCH 'rose'")).scalars().all() == [2]
+        seqs = session.exec(text("SELECT change_seq FROM product ORDER BY id")).scalars().all()
+        assert 0 not in seqs and len(set(seqs)) == 2
+
+def test_rerun_is_idempotent(db_engine):
+    baseline_db(db_engine)
+    run_migrations(db_engine)
+
+    assert run_migrations(db_engine) == []
+
+    # Every migration must also survive being applied twice (e.g. a crash before schema_version was written)
+    with Session(db_engine) as session:
+        before = session.exec(text("SELECT id, slug, change_seq FROM product ORDER BY id")).all()
+        session.exec(text("DELETE FROM schema_version"))
+        session.commit()
+    assert run_migrations(db_engine) == [m["version"] for m in MIGRATIONS]
+    with Session(db_engine) as session:
+        assert applied_versions(session) == {m["version"] for m in MIGRATIONS}
+        assert session.exec(text("SELECT id, slug, change_seq FROM product ORDER BY id")).all() == before
+        assert session.exec(text("SELECT COUNT(*) FROM product_stats")).scalar() == 2
+        assert session.exec(text("SELECT COUNT(*) FROM product_fts WHERE product_fts MATCH 'barolo'")).scalar() == 1
+    assert verify_migrations(db_engine) == 0
+
+def test_stats_backfill_reads_the_schema_of_its_version(db_engine):
+    # Migration 3 alone on the baseline: pricehistory has no run columns yet (migration 7)
+    baseline_db(db_engine)
+    populate = next(m for m in MIGRATIONS if m["version"] == 3)
+
+    with Session(db_engine) as session:
+        populate["apply"](session)
+        session.commit()
+        columns = {row[1] for row in session.exec(text("PRAGMA table_info(pricehistory)")).all()}
+        assert "seen_count" not in columns and "last_seen" not in columns
+        assert session.exec(text(
+            "SELECT product_id, min_price, max_price, price_count FROM product_stats ORDER BY product_id"
+        )).all() == [(1, 30.0, 35.0, 2), (2, 20.0, 20.0, 1)]
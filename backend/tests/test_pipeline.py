@@ -0,0 +1,59 @@
+import os
+
+from benchmarks.bench_parsers import FIXTURES_DIR
+from listing_parsers import parse_product_list
+from pipeline import ScrapePipeline
+import scraper
+
+with open(os.path.join(FIXTURES_DIR, "listing_vino_online_p1.html"), encoding="utf-8") as f:
+    PAGE = f.read()
+
+def _names(products):
+    return [p["name"] for p in products]
+
+def test_parses_overlap_and_survive_a_dead_worker():
+    pipeline = ScrapePipeline(parse_workers=1, parse_queue=3)
+    expected = _names(parse_product_list(PAGE))
+    try:
+        parsed = [pipeline.submit_parse(PAGE) for _ in range(3)]
+        assert [_names(f.result(timeout=60)) for f in parsed] == [expected] * 3
+        assert pipeline.stats()["parse_queue"]["depth"] == 0
+
+        # A worker killed under the pool breaks it: the next page gets a new one
+        broken = pipeline._pool
+        for process in list(broken._processes.values()):
+            process.kill()
+            process.join()
+        assert _names(pipeline.submit_parse(PAGE).result(timeout=60)) == expected
+        assert pipeline._pool is not broken
+        assert pipeline.stats()["stages"]["parse"]["errors"] == 0
+    finally:
+        pipeline._pool.shutdown(wait=False)
+
+class _Listing:
+    def __init__(self, html):
+        self.status_code = 200
+        self.html = html
+
+    def json(self):
+        return {"productlist": self.html}
+
+    def raise_for_status(self):
+        pass
+
+def test_scraper_does_not_wait_after_the_last_page(monkeypatch):
+    pages = {1: PAGE, 2: PAGE, 3: ""}
+    monkeypatch.setattr(scraper.requests, "get", lambda url, params, **kwargs: _Listing(pages[params["p"]]))
+    monkeypatch.setattr(scraper.pacer, "next_delay", lambda: 5.0)
+    monkeypatch.setattr(scraper.pacer, "record_page", lambda *args: None)
+    saves = []
+    monkeypatch.setattr(scraper.pacer, "save", lambda: saves.append(1))
+    sleeps = []
+    monkeypatch.setattr(scraper.time, "sleep", sleeps.append)
+
+    products = scraper.scrape_category_page("/vino-online/", pipeline=ScrapePipeline(parse_workers=0))
+
+    # One delay between each two requests, none after the empty page 3
+    assert len(products) == 2 * len(parse_product_list(PAGE))
+    assert len(sleeps) == len(saves) == 2
+    assert all(0 < s <= 5.0 for s in sleeps)
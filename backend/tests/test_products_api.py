@@ -0,0 +1,69 @@
+import itertools
+
+import pytest
+from fastapi import Response
+from sqlalchemy import text
+from sqlmodel import SQLModel, Session
+
+from main import get_products
+from migrations import run_migrations
+
+DEFAULTS = dict(
+    category=None, q=None, min_score=None, max_score=None, is_lowest_all_time=None, min_discount=None,
+    tag=None, sort=None, order="desc", limit=None, cursor=None,
+)
+
+def _get(session, **params):
+    """get_products called as FastAPI would, returns (products, X-Next-Cursor)"""
+    response = Response()
+    products = get_products(response=response, session=session, **dict(DEFAULTS, **params))
+    return products, response.headers.get("x-next-cursor")
+
+@pytest.fixture
+def catalog(db_engine):
+    SQLModel.metadata.create_all(db_engine)
+    run_migrations(db_engine)
+    scores = [7.5, 7.5, None, 3.0, 7.5, None, 9.0, 3.0]
+    prices = [10.0, None, 25.0, 10.0, 0.0, 25.0, 10.0, 18.0]
+    checked = ["2024-01-02 10:00:00.000000", None, "2024-01-02 10:00:00.000000", "2024-01-01 08:00:00.000000"]
+    with Session(db_engine) as session:
+        for i, (score, price, when) in enumerate(zip(scores, prices, itertools.cycle(checked)), start=1):
+            session.exec(text(
+                "INSERT INTO product (id, bernabei_code, name, product_link, category, current_price, last_checked_at, convenience_score) "
+                "VALUES (:id, :code, :name, :link, '/vino-online/', :price, :when, :score)"
+            ).bindparams(id=i, code=f"c{i}", name=f"Wine {i}", link=f"https://x/wine-{i}", price=price, when=when, score=score))
+            if i % 3:
+                # Every third product has no stats (discount 0); max 20.0 gives ties in discount
+                session.exec(text(
+                    "INSERT INTO product_stats (product_id, min_price, max_price, price_sum, price_count) "
+                    "VALUES (:id, 9.0, 20.0, 40.0, 3)"
+                ).bindparams(id=i))
+        session.commit()
+        yield session
+
+@pytest.mark.parametrize("sort", ["score", "discount", "price", "last_checked"])
+@pytest.mark.parametrize("order", ["asc", "desc"])
+def test_keyset_pages_match_the_unpaginated_order(catalog, sort, order):
+    expected = [p.id for p in _get(catalog, sort=sort, order=order)[0]]
+    assert sorted(expected) == list(range(1, 9))
+
+    paged, cursor = [], None
+    for _ in range(10):
+        products, cursor = _get(catalog, sort=sort, order=order, limit=3, cursor=cursor)
+        paged.extend(p.id for p in products)
+        if cursor is None:
+            break
+    assert paged == expected
+
+def test_min_discount_matches_the_displayed_percentage(catalog):
+    catalog.exec(text("UPDATE product_stats SET max_price = 100.0"))
+    for product_id, price in [(1, 90.4), (2, 90.6), (4, 89.5)]:
+        catalog.exec(text("UPDATE product SET current_price = :price WHERE id = :id").bindparams(price=price, id=product_id))
+    catalog.commit()
+
+    shown = {p.id: p.discount_percentage for p in _get(catalog)[0]}
+    assert (shown[1], shown[2], shown[4]) == (10.0, 9.0, 11.0)
+
+    for min_discount in (9, 10, 11, 10.5):
+        matched = {p.id for p in _get(catalog, min_discount=min_discount)[0]}
+        assert matched == {i for i, d in shown.items() if d >= min_discount}
@@ -0,0 +1,39 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+from sqlmodel import SQLModel, Session, create_engine
+
+from response_cache import ResponseCache, ResponseCacheMiddleware, bump_generation, current_generation
+import response_cache
+
+def test_write_from_another_engine_invalidates_cached_responses(db_engine, tmp_path, monkeypatch):
+    SQLModel.metadata.create_all(db_engine)
+    monkeypatch.setattr(response_cache, "cache", ResponseCache())
+    calls = []
+
+    app = FastAPI()
+    app.add_middleware(ResponseCacheMiddleware, engine=db_engine)
+
+    @app.get("/products")
+    def products():
+        calls.append(1)
+        return {"calls": len(calls)}
+
+    client = TestClient(app)
+    assert current_generation(db_engine) == 0
+    first = client.get("/products")
+    assert client.get("/products", headers={"if-none-match": first.headers["etag"]}).status_code == 304
+    assert len(calls) == 1
+
+    # A maintenance script has its own engine (own process in production)
+    script_engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    with Session(script_engine) as session:
+        session.exec(text("UPDATE product SET name = name"))
+        assert bump_generation(session) == 1
+        session.commit()
+    script_engine.dispose()
+
+    second = client.get("/products", headers={"if-none-match": first.headers["etag"]})
+    assert second.status_code == 200
+    assert second.json() == {"calls": 2}
+    assert second.headers["etag"] != first.headers["etag"]
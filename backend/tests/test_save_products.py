@@ -0,0 +1,45 @@
+import pytest
+from sqlalchemy import text
+from sqlmodel import SQLModel
+
+import main
+from database import create_sqlite_engine
+from migrations import run_migrations
+
+@pytest.fixture
+def catalog_engine(tmp_path, monkeypatch):
+    """save_products_to_db writing to an empty, migrated database of its own"""
+    engine = create_sqlite_engine(tmp_path / "catalog.db")
+    SQLModel.metadata.create_all(engine)
+    run_migrations(engine)
+    monkeypatch.setattr(main, "engine", engine)
+    yield engine
+    engine.dispose()
+
+def _item(n, **overrides):
+    item = {
+        "bernabei_code": f"code-{n}", "name": f"Wine {n}", "product_link": f"https://www.bernabei.it/vino-online/wine-{n}",
+        "image_url": None, "price": 10.0 + n, "ordinary_price": 20.0, "lowest_price_30_days": None,
+        "tags": "BEST PRICE", "category": "/vino-online/",
+    }
+    item.update(overrides)
+    return item
+
+def test_poisoned_row_only_loses_itself(catalog_engine):
+    # name is NOT NULL: the bulk insert fails and is retried row by row
+    main.save_products_to_db([_item(1), _item(2, name=None), _item(3)])
+
+    with catalog_engine.connect() as conn:
+        products = conn.execute(text("SELECT id, bernabei_code FROM product ORDER BY id")).all()
+        assert [code for _, code in products] == ["code-1", "code-3"]
+        history = conn.execute(text("SELECT product_id, price FROM pricehistory ORDER BY product_id")).all()
+        assert history == [(products[0][0], 11.0), (products[1][0], 13.0)]
+        stats = conn.execute(text("SELECT product_id, price_count, last_price FROM product_stats ORDER BY product_id")).all()
+        assert stats == [(products[0][0], 1, 11.0), (products[1][0], 1, 13.0)]
+
+    # The next page updates the survivors and still creates the fixed product
+    main.save_products_to_db([_item(1, price=9.0), _item(2), _item(3)])
+    with catalog_engine.connect() as conn:
+        assert conn.execute(text("SELECT COUNT(*) FROM product")).scalar() == 3
+        assert conn.execute(text("SELECT COUNT(*) FROM pricehistory")).scalar() == 5
+        assert conn.execute(text("SELECT current_price FROM product WHERE bernabei_code = 'code-1'")).scalar() == 9.0
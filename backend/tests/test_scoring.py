@@ -0,0 +1,21 @@
+from datetime import datetime
+
+from sqlmodel import Session, select
+
+from benchmarks.bench_scoring import build_db, legacy_scores
+from models import Product
+from scoring import score_catalog
+
+def test_batch_scores_match_the_per_product_path(tmp_path):
+    engine = build_db(tmp_path / "scores.db", n_products=40, n_days=200, readings_per_day=2)
+    try:
+        expected = legacy_scores(engine)
+        assert score_catalog(engine, t0=datetime.utcnow()) == len(expected)
+        with Session(engine) as session:
+            actual = dict(session.exec(select(Product.id, Product.convenience_score)).all())
+    finally:
+        engine.dispose()
+
+    assert len(expected) == 40
+    for product_id, score in expected.items():
+        assert abs(actual[product_id] - score) <= 0.1, product_id
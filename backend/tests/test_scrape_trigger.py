@@ -0,0 +1,23 @@
+from fastapi.testclient import TestClient
+
+import main
+
+def test_manual_scrape_refused_during_cooldown(monkeypatch):
+    monkeypatch.setattr(main.pacer, "cooldown_remaining", lambda: 120.4)
+    jobs = []
+    monkeypatch.setattr(main, "run_scrape_job", lambda: jobs.append(1))
+
+    response = TestClient(main.app).post("/scrape")
+    assert response.status_code == 429
+    assert response.headers["retry-after"] == "121"
+    assert jobs == []
+
+def test_scrape_job_skipped_during_cooldown(monkeypatch):
+    monkeypatch.setattr(main.pacer, "cooldown_remaining", lambda: 30.0)
+    monkeypatch.setattr(main, "start_or_resume_run", _fail_crawl)
+
+    assert main.run_scrape_job() is False
+    assert not main.scrape_lock.locked()
+
+def _fail_crawl(*args):
+    raise AssertionError("crawl started during the cooldown")
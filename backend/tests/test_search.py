@@ -0,0 +1,64 @@
+import pytest
+from sqlalchemy import text
+from sqlmodel import SQLModel, Session
+
+from main import search
+from migrations import run_migrations
+
+PRODUCTS = [
+    (1, "Barolo Riserva", "barolo-riserva", "/vino-online/"),
+    (2, "Rosé Brut", "rose-brut", "/champagne/"),
+    (3, '<b>Barolo</b> & "Co"', "barolo-co", "/vino-online/"),
+]
+
+@pytest.fixture
+def catalog(db_engine):
+    SQLModel.metadata.create_all(db_engine)
+    run_migrations(db_engine)
+    with Session(db_engine) as session:
+        for product_id, name, slug, category in PRODUCTS:
+            session.exec(text(
+                "INSERT INTO product (id, bernabei_code, name, product_link, slug, category, current_price) "
+                "VALUES (:id, :slug, :name, :link, :slug, :category, 20.0)"
+            ).bindparams(id=product_id, name=name, slug=slug, link=f"https://x/{slug}", category=category))
+        session.commit()
+        yield session
+
+def _ids(session, q, category=None):
+    return sorted(hit.id for hit in search(q=q, category=category, limit=20, session=session))
+
+def test_index_follows_inserts_updates_and_deletes(catalog):
+    assert _ids(catalog, "rose") == [2]
+    assert _ids(catalog, "barolo") == [1, 3]
+    assert _ids(catalog, "bar") == [1, 3]
+    assert _ids(catalog, "barolo", category="/champagne/") == []
+
+    catalog.exec(text("UPDATE product SET name = 'Ripasso Superiore', slug = 'ripasso-superiore' WHERE id = 1"))
+    catalog.exec(text("UPDATE product SET current_price = 15.0 WHERE id = 2"))
+    catalog.exec(text("DELETE FROM product WHERE id = 3"))
+    catalog.commit()
+
+    assert _ids(catalog, "barolo") == []
+    assert _ids(catalog, "ripasso sup") == [1]
+    assert _ids(catalog, "rose") == [2]
+
+@pytest.mark.parametrize("q, expected", [
+    ('barolo"', [1, 3]),
+    ('"barolo" OR "rose', []),
+    ("barolo NOT riserva", []),
+    ("NEAR(barolo riserva)", []),
+    ("barolo -riserva", [1]),
+    ("riserva barolo*", [1]),
+])
+def test_fts_syntax_in_the_query_is_taken_literally(catalog, q, expected):
+    # Quotes, operators and prefixes are plain words that must all match: no syntax error, no OR
+    assert _ids(catalog, q) == expected
+
+def test_query_without_words_matches_nothing(catalog):
+    assert _ids(catalog, '" * ()') == []
+
+def test_snippet_escapes_the_scraped_name(catalog):
+    hits = {hit.id: hit for hit in search(q="barolo", category=None, limit=20, session=catalog)}
+
+    assert hits[3].snippet == "&lt;b&gt;<mark>Barolo</mark>&lt;/b&gt; &amp; &quot;Co&quot;"
+    assert hits[1].snippet == "<mark>Barolo</mark> Riserva"
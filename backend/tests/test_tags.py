@@ -0,0 +1,112 @@
+import pytest
+from fastapi import Response
+from sqlalchemy import text
+from sqlmodel import SQLModel, Session
+
+import main
+from database import create_sqlite_engine
+from migrations import run_migrations
+from tags import MASK_BITS, backfill_tags, tags_sql
+
+PAGE = [
+    ("code-1", 10.0, "BEST PRICE, Special Price"),
+    ("code-2", 12.0, "Special Price,BEST PRICE,BEST PRICE"),
+    ("code-3", 14.0, "-20%"),
+    ("code-4", 16.0, None),
+]
+
+def _engine(path):
+    engine = create_sqlite_engine(path)
+    SQLModel.metadata.create_all(engine)
+    run_migrations(engine)
+    return engine
+
+@pytest.fixture
+def catalog_engine(tmp_path, monkeypatch):
+    engine = _engine(tmp_path / "catalog.db")
+    monkeypatch.setattr(main, "engine", engine)
+    yield engine
+    engine.dispose()
+
+def _save(page):
+    main.save_products_to_db([
+        {"bernabei_code": code, "name": f"Wine {code}", "product_link": f"https://www.bernabei.it/vino-online/{code}",
+         "image_url": None, "price": price, "ordinary_price": None, "lowest_price_30_days": None,
+         "tags": tags, "category": "/vino-online/"}
+        for code, price, tags in page
+    ])
+
+def _codes(session, *tags):
+    response = Response()
+    products = main.get_products(
+        response=response, session=session, category=None, q=None, min_score=None, max_score=None,
+        is_lowest_all_time=None, min_discount=None, tag=list(tags), sort=None, order="desc", limit=None, cursor=None,
+    )
+    return sorted(p.bernabei_code for p in products)
+
+def _readings(session):
+    return session.exec(text(f"""
+        SELECT p.bernabei_code, h.tag_mask, h.tags, {tags_sql()}
+        FROM pricehistory h JOIN product p ON p.id = h.product_id ORDER BY p.bernabei_code
+    """)).all()
+
+def test_tags_are_interned_and_filterable(catalog_engine):
+    _save(PAGE)
+
+    with Session(catalog_engine) as session:
+        tags = main.get_tags(session)
+        assert [(t["name"], t["products"]) for t in tags] == [("BEST PRICE", 2), ("Special Price", 2), ("-20%", 1)]
+        ids = {t["name"]: t["id"] for t in tags}
+
+        # One bit per tag, duplicates dropped, no comma string stored
+        bits = {code: mask for code, mask, stored, _ in _readings(session) if stored is None}
+        best, special = 1 << (ids["BEST PRICE"] - 1), 1 << (ids["Special Price"] - 1)
+        assert bits == {"code-1": best | special, "code-2": best | special, "code-3": 1 << (ids["-20%"] - 1), "code-4": 0}
+
+        assert _codes(session, "BEST PRICE") == ["code-1", "code-2"]
+        assert _codes(session, "BEST PRICE", " Special  Price ") == ["code-1", "code-2"]
+        assert _codes(session, "BEST PRICE", "-20%") == []
+        assert _codes(session, "unknown") == []
+
+    # product_tag follows the latest reading
+    _save([("code-1", 9.0, "-20%")])
+    with Session(catalog_engine) as session:
+        assert _codes(session, "-20%") == ["code-1", "code-3"]
+        assert _codes(session, "BEST PRICE") == ["code-2"]
+
+def test_tags_beyond_the_mask_keep_their_names(catalog_engine):
+    with catalog_engine.begin() as conn:
+        # "BEST PRICE" gets the last bit, the tags interned later don't fit
+        names = [f"old-{i}" for i in range(MASK_BITS - 1)] + ["BEST PRICE"]
+        conn.execute(text("INSERT INTO tag (name) VALUES (:name)"), [{"name": n} for n in names])
+    _save([("code-1", 10.0, "BEST PRICE"), ("code-2", 12.0, "BEST PRICE, Special Price, -20%")])
+
+    with Session(catalog_engine) as session:
+        readings = _readings(session)
+        assert readings[0] == ("code-1", 1 << (MASK_BITS - 1), None, "BEST PRICE")
+        # The mask keeps the bit it can hold, tags the full list
+        assert readings[1] == ("code-2", 1 << (MASK_BITS - 1), "BEST PRICE,Special Price,-20%", "BEST PRICE,Special Price,-20%")
+        assert _codes(session, "-20%") == ["code-2"]
+        assert _codes(session, "BEST PRICE") == ["code-1", "code-2"]
+
+def test_backfill_encodes_like_live_ingest(catalog_engine, tmp_path):
+    _save(PAGE)
+
+    # Same readings written the old way: comma strings only, then backfilled
+    legacy = _engine(tmp_path / "legacy.db")
+    with Session(legacy) as session:
+        for i, (code, price, tags) in enumerate(PAGE, start=1):
+            session.exec(text(
+                "INSERT INTO product (id, bernabei_code, name, product_link, current_price) VALUES (:id, :code, :code, :code, :price)"
+            ).bindparams(id=i, code=code, price=price))
+            session.exec(text(
+                "INSERT INTO pricehistory (product_id, price, tags, timestamp) VALUES (:id, :price, :tags, '2024-01-01 10:00:00.000000')"
+            ).bindparams(id=i, price=price, tags=tags))
+        assert backfill_tags(session) == 3
+        session.commit()
+
+        with Session(catalog_engine) as live:
+            assert _readings(session) == _readings(live)
+            assert main.get_tags(session) == main.get_tags(live)
+        assert _codes(session, "Special Price") == ["code-1", "code-2"]
+    legacy.dispose()
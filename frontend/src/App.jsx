@@ -1,6 +1,7 @@
 import { useEffect, useState } from 'react';
 import axios from 'axios';
 import ProductChart from './components/ProductChart';
+import { getHistories } from './api';
 import { RefreshCw, Search, Tag } from 'lucide-react';
 
 const App = () => {
@@ -50,8 +51,13 @@ const App = () => {
         
         setSelectedProduct(product);
         try {
-            const res = await axios.get(`/products/${product.id}/history`);
-            setHistory(res.data);
+            const data = await getHistories([product.id], 300);
+            const series = data.products[product.id];
+            setHistory(series.timestamps.map((timestamp, i) => ({
+                timestamp,
+                price: series.prices[i],
+                ordinary_price: series.ordinary_prices[i],
+            })));
         } catch (err) {
             console.error(err);
         }
@@ -12,6 +12,13 @@ export const getProductHistory = async (productId) => {
     return response.data;
 };
 
+// Downsampled chart series of several products in one request:
+// { points, products: { "<id>": { timestamps, prices, ordinary_prices, total_points } } }
+export const getHistories = async (productIds, points = 300) => {
+    const response = await axios.get(`${API_URL}/history`, { params: { ids: productIds.join(','), points } });
+    return response.data;
+};
+
 export const triggerScrape = async () => {
     const response = await axios.post(`${API_URL}/scrape`);
     return response.data;
@@ -7,7 +7,13 @@ export default defineConfig({
   server: {
     proxy: {
       '/products': 'http://localhost:8000',
-      '/scrape': 'http://localhost:8000'
+      '/scrape': 'http://localhost:8000',
+      '/history': 'http://localhost:8000',
+      '/events': 'http://localhost:8000',
+      '/tags': 'http://localhost:8000',
+      '/export.csv': 'http://localhost:8000',
+      '/export.tsv': 'http://localhost:8000',
+      '/metrics': 'http://localhost:8000'
     }
   }
 })